@@ -7,13 +7,34 @@ __email__ = "yaddayadda AT gmail.com"
 
 # Created by Nathan on April 03, 2018
 
-import arcpy, os, itertools, datetime, sys, numpy, re, string
-from arcpy.sa import *
+import os, itertools, datetime, sys, numpy, re, string
 from fnmatch import fnmatch
 
+# Without ArcGIS (e.g. on Linux compute nodes) the bands are written
+# by the NumPy engine in noaatools instead of arcpy raster tools.
+# arcpy is only imported by main() when the arcpy engine runs.
+arcpy = None
+
+from noaatools import variables as noaavariables
+from noaatools import cube as noaacube, geotiff
+from noaatools.grid import Grid
+from noaatools.handles import HandlePool, iter_opened
+from noaatools.prefetch import Prefetcher, warm_file
+from noaatools import shard as sharding
+from noaatools import batch
+from noaatools import arcgis
+from noaatools.checkpoint import BandCheckpoint
+
 
 ################################################ I. DEFINE HELPER FUNCTIONS
 
+# Cell size the arcpy engine resamples the bands to, so the second
+# column lines up with the prime meridian.
+resamplecellsize = "0.9375 0.94747340425532"
+
+# Settings recorded in the band checkpoints, set by main().
+bandparameters = {}
+
 
 ################ 1. Helper functions.
 def blockPrint():
@@ -27,6 +48,55 @@ def unzip(iterable):
     return list(zip(*iterable))
 
 
+def getparameter(index):
+    '''
+    Tool parameter from the ArcMap dialog, or from the command line
+    (python 1_NetCDFtoGeotiff.py inputpath startyear endyear variables
+    [--shard i/N]) when running without arcpy, or from the job when
+    run by noaatools.batch.
+    '''
+    if batch.in_batch() or arcgis.in_arcgis():
+        return batch.get_parameter(index)
+    arguments = sharding.pop_shardargument(sys.argv[1:])[0]
+    return arguments[index] if len(arguments) > index else ""
+
+
+def getshard():
+    '''
+    This machine's share of the years, "i/N" from the fifth tool
+    parameter or --shard on the command line; None runs everything.
+    '''
+    if batch.in_batch() or arcgis.in_arcgis():
+        return sharding.parse_shard(getparameter(4))
+    return sharding.pop_shardargument(sys.argv[1:])[1]
+
+
+def getengine():
+    '''
+    Engine that writes the bands, "arcpy" or "numpy", from the sixth
+    tool parameter or the fifth command line argument (the shard is
+    --shard there). Empty uses arcpy when it is installed.
+    '''
+    if batch.in_batch() or arcgis.in_arcgis():
+        engine = getparameter(5)
+    else:
+        engine = getparameter(4)
+    engine = engine.strip().lower() or ('arcpy' if arcgis.has_arcpy() else 'numpy')
+    if engine not in ('arcpy', 'numpy'):
+        raise ValueError("Unknown engine {} (arcpy or numpy)".format(engine))
+    return engine
+
+
+def getyearweight(task):
+    '''Number of bands of the NetCDF file of a task, from the year in its name.'''
+    year = re.search(r'\.(\d{4})\.nc$', task[0])
+    return sharding.get_yearweight(year.group(1)) if year else 365
+
+
+def addmessage(message):
+    arcgis.addmessage(message)
+
+
 def setup_arcpyenvironment():
     '''
     Setup the ArcPy stuff, required for
@@ -39,26 +109,29 @@ def setup_arcpyenvironment():
 
     # Prepare the ArcGIS environment
     arcpy.AddMessage(arcpy.ProductInfo())
-    arcpy.CheckOutExtension("Spatial")
     arcpy.env.parallelProcessingFactor = "100%"
 
     # Setup workspace and project management:
     arcpy.env.workspace = "in_memory"
     arcpy.env.overwriteOutput = True
 
+    # Write compressed tifs (lossless LZW) instead of raw float32.
+    arcpy.env.compression = "LZW"
+
 
 
 ################ 2. Functions for preparing NetCDF files, outputs, etc. for loops.
 
-def get_listofnetcdfs(startyear, endyear):
+def get_listofnetcdfs(startyear, endyear, noaavariable):
 
     '''
-    Generate a list of files that we'll process.
+    Generate a list of files that we'll process
+    for one variable (a noaatools NoaaVariable).
     '''
     if startyear == "":
-        #Loop through input folder and search all prate files
+        #Loop through input folder and search all files of the variable
         root = inputpath
-        pattern = "prate.*.nc"
+        pattern = noaavariable.fileprefix + ".*.nc"
         listofnoaafilenames = []
         clean_listofnoaapaths = []
 
@@ -73,7 +146,7 @@ def get_listofnetcdfs(startyear, endyear):
     else:
         
         # Create list of NOAA files using list comprehension and fast concatination:
-        listofnoaafilenames = ['.'.join(map(str, [noaafile_type, fileyear, 'nc'])) for
+        listofnoaafilenames = [noaavariable.get_filename(fileyear) for
                                fileyear in range(int(startyear), int(endyear)+1)]
 
         # Remove corrupted file from list.
@@ -109,28 +182,96 @@ def prepare_rasterpaths(listofnoaafilenames):
     return newoutputfilepaths
 
 
-def make_iterators(listofnoaapaths, listofnewouputpaths):
+def get_netcdfheader(netcdffile):
+    '''
+    Header metadata of a NetCDF file, cached by the handle pool:
+    the number of bands in the time dimension.
+    '''
+
+    # Do it directly with the getDim... function!
+    return {'topband': netcdffile.getDimensionSize(dimension_type)}
+
+
+def skipyear(task, exception):
+    '''Report a year whose NetCDF file cannot be read (e.g. prate.1899.nc) and go on.'''
+
+    addmessage("Skipping {}: {}".format(task[0], exception))
+
+
+def make_iterators(tasks, handlepool):
     '''
     Creates tuples of NetCDF files AND top bands for the main loop
-    of the code.
+    of the code, along with the output path and the variable each
+    file holds.
 
-    I'm using a generator since the NetCDF files can be large.
+    I'm using a generator since the NetCDF files can be large: each
+    file is opened only when its year is reached, through a small pool
+    of open handles, and a file that cannot be opened is skipped.
 
-    :param listofnoaafiles
+    :param tasks: tuples of (NetCDF path, output path, variable)
+    :param handlepool: noaatools.handles.HandlePool of NetCDF properties
     :return: tuples of TOP bands and NetCDF files
     '''
 
-    netcdffiles = [arcpy.NetCDFFileProperties(file) for file in listofnoaapaths]
+    opened = iter_opened(handlepool, tasks, key=lambda task: task[0], onerror=skipyear)
+    for (inputfilepath, outputpath, noaavariable), netcdffile, header in opened:
+        yield header['topband'], netcdffile, inputfilepath, outputpath, noaavariable
 
-    # Get number of bands in the time dimension_type.
-    # Do it directly with the getDim... function!
-    topbands = [netcdffile.getDimensionSize('time') for netcdffile in netcdffiles]
 
-    # Convert list of output path to generator:
-    outputpaths = [path for path in listofnewouputpaths]
+def resumeyear(inputfilepath, outputpath, nbands):
+    '''
+    Checkpoint of a year and the first band to export: 0 for a new
+    year, the first band not committed when a previous run stopped
+    mid-year (after checking the last committed tif), nbands when done.
+    '''
+
+    checkpoint = BandCheckpoint(outputpath, inputfilepath, bandparameters)
+    firstband = checkpoint.resume(nbands)
+    if 0 < firstband < nbands:
+        addmessage("Resuming {} at band {} of {}".format(os.path.basename(inputfilepath), firstband, nbands))
 
-    # Chain together three lists: the NetCDF files, bands, and output path:
-    return topbands, netcdffiles, listofnoaapaths, outputpaths
+    return checkpoint, firstband
+
+
+def yeardone(task):
+    '''True when every band of a task was committed and its last tif checks out.'''
+
+    try:
+        checkpoint = BandCheckpoint(task[1], task[0], bandparameters)
+    except (IOError, OSError):
+        return False
+
+    return checkpoint.is_complete() and checkpoint.verify_output(-1)
+
+
+def writeshardmanifest(tasks, shard, manifestname):
+    '''
+    Record a finished shard for merge-shards (noaatools.shard), e.g.
+    output/shards/tif_prate_1900_1950_shard_1_of_4.json, once every
+    year of it has all its bands; a shard with an unfinished year
+    records nothing.
+    '''
+
+    outputfiles = []
+    for task in tasks:
+        if not yeardone(task):
+            addmessage("Shard {}/{}: {} is not complete, no manifest written".format(
+                shard[0], shard[1], os.path.basename(task[0])))
+            return
+        checkpoint = BandCheckpoint(task[1], task[0], bandparameters)
+        outputfiles.extend(os.path.join(task[1], output[0]) for output in checkpoint.outputs)
+
+    sharding.write_manifest(projectpath + '/output', shard, [os.path.basename(task[0]) for task in tasks],
+                            outputfiles, manifestname)
+
+
+def warmtask(task):
+    '''Pull the NetCDF file of a task into the OS cache; missing files are left to make_iterators.'''
+
+    try:
+        return warm_file(task[0])
+    except (IOError, OSError):
+        return 0
 
 
 ################ 3. Core "INNER" functions for processing, exporting NetCDF bands.
@@ -176,15 +317,16 @@ def sub_getdatefromcurrentband(netcdffile, dateband):
 def exportbands(timeband,
                 inputproperties,
                 inputfilepath,
-                outputpath):
+                outputpath,
+                noaavariable):
     '''
     Within the NetCDF processing loop we create raster files
     and save them to new folders.
 
     Take date arguments...
 
-    Along with the dimension value, the input file, and the
-    output file.
+    Along with the dimension value, the input file, the
+    output file and the variable to export.
     '''
 
     # Grab a string value and the date value from current band.
@@ -196,16 +338,16 @@ def exportbands(timeband,
     filemonth, fileday, fileyear = sub_processdatesfromnetcdf(dimension_date)
 
     # Make filename from year, month, and day:
-    arguments = [noaafile_type, fileyear, filemonth, fileday]    
+    arguments = [noaavariable.name, fileyear, filemonth, fileday]    
     outputrastername = '_'.join(map(str, arguments))
     print(('Exporting raster {}.tif'.format(outputrastername)))
 
     # Take CURRENT dimensions from current NetCDF.
     # Pull current layer out as raster layer in memory named 'outfilename'.
-    # rainfall (PRATE) is the value that will be mapped.
+    # The variable (e.g. rainfall, PRATE) is the value that will be mapped.
 
     makenetcdf = arcpy.MakeNetCDFRasterLayer_md(inputfilepath,
-                                                "prate",
+                                                noaavariable.name,
                                                 "lon",
                                                 "lat",
                                                 "temporaryraster",
@@ -220,7 +362,7 @@ def exportbands(timeband,
 
     # Resample raster such that resultant raster has half the X and Y dimensions
     # This will make each raster having second column perfectly aligned by prime meridian
-    arcpy.Resample_management("temporaryraster", outputrasterfile, "0.9375 0.94747340425532",
+    arcpy.Resample_management("temporaryraster", outputrasterfile, resamplecellsize,
                               "NEAREST")
 
     # Clip first column of each raster (the only column that lies in -X dimension)
@@ -237,22 +379,106 @@ def exportbands(timeband,
     arcpy.Delete_management("in_memory")
 ##    arcpy.Delete_management(outputrasterfileclp)
 
+    return outputrasterfile
+
 def loopovernetcdfbands(toptimeband,
                         inputproperties,
                         inputfilepath,
-                        outputpath):
+                        outputpath,
+                        noaavariable):
 
     '''
     Process all ~365 time bands of a NetCDF file.
 
-    This function takes four arguments:
+    This function takes five arguments:
     1) NetCDF properties
     2) The top-most time band for every NetCDF
     3) The path string for the NetCDF file
-    4) The output path for the rasters.
+    4) The output path for the rasters
+    5) The variable stored in the file.
+
+    Each band is committed to the year's checkpoint once its tif is
+    written, so a rerun after a failure starts at the first band missing.
     '''
 
-    [exportbands(t, inputproperties, inputfilepath, outputpath) for t in range(toptimeband)]
+    checkpoint, firstband = resumeyear(inputfilepath, outputpath, toptimeband)
+    for t in range(firstband, toptimeband):
+        checkpoint.commit(t, exportbands(t, inputproperties, inputfilepath, outputpath, noaavariable))
+
+
+def exportyear(args):
+    '''
+    loopovernetcdfbands for one year of make_iterators. An arcpy failure
+    while exporting (e.g. a corrupt band) skips the rest of the year,
+    like a file that cannot be opened, instead of aborting the run.
+    The bands committed so far are kept, so a rerun resumes the year
+    at the band that failed.
+    '''
+
+    try:
+        loopovernetcdfbands(*args)
+    except (arcpy.ExecuteError, IOError, OSError, RuntimeError) as exception:
+        skipyear((args[2],), exception)
+
+
+################ 4. NumPy engine: export bands without arcpy.
+
+def loadnetcdfyear(inputfilepath, noaavariable):
+    '''
+    Read a whole year with the NumPy engine: the float32 cube
+    (native units, like the arcpy raster layer), the dates of the
+    bands and the lat/lon grid.
+    '''
+
+    yearcube, dates = noaacube.load_yearcube(inputfilepath, noaavariable.name)
+    grid = Grid.from_netcdf(inputfilepath)
+
+    return yearcube, dates, grid
+
+
+def tryloadnetcdfyear(inputfilepath, noaavariable):
+    '''
+    loadnetcdfyear, returning the read error instead of raising it so
+    a bad year is skipped. netCDF4 raises OSError for a missing or
+    unreadable file and RuntimeError for a corrupt one; anything else
+    (a missing package, a bug) still stops the run.
+    '''
+
+    try:
+        return loadnetcdfyear(inputfilepath, noaavariable)
+    except (IOError, OSError, RuntimeError) as exception:
+        return exception
+
+
+def exportyear_numpy(yearcube, dates, grid, inputfilepath, outputpath, noaavariable):
+    '''
+    Write every band of a loaded year as a tiled, LZW compressed
+    GeoTIFF with the built-in writer (noaatools.geotiff), committing
+    each to the year's checkpoint like loopovernetcdfbands.
+
+    File names follow exportbands, e.g. prate_1900_1_31.tif,
+    so 2a/2b/2c pick them up unchanged.
+    '''
+
+    geotransform = geotiff.get_gridgeotransform(grid.lats, grid.lons)
+    bands = geotiff.get_northup(yearcube, grid.lats)
+    checkpoint, firstband = resumeyear(inputfilepath, outputpath, len(dates))
+
+    for t in range(firstband, len(dates)):
+        band, date = bands[t], dates[t]
+
+        # Same Month/Day/Year string as the arcpy dimension value.
+        fileyear, filemonth, fileday = [int(chunk) for chunk in str(date).split('-')]
+        filemonth, fileday, fileyear = sub_processdatesfromnetcdf(
+            '{}/{}/{}'.format(filemonth, fileday, fileyear))
+
+        outputrastername = '_'.join(map(str, [noaavariable.name, fileyear, filemonth, fileday]))
+        print(('Exporting raster {}.tif'.format(outputrastername)))
+
+        outputrasterfile = os.path.join(outputpath, ''.join([outputrastername, '.tif']))
+        geotiff.write_geotiff(outputrasterfile, band, geotransform, nodata=numpy.nan,
+                              codec="lzw", descriptions=[str(date)])
+        checkpoint.commit(t, outputrasterfile)
 
 
 
@@ -267,68 +493,128 @@ def main():
     Run core functions.
     '''
        
-    global inputpath, workingpath, arcgisenvironmentpath, projectpath, outputpath
-    inputpath = arcpy.GetParameterAsText(0)
+    global inputpath, workingpath, arcgisenvironmentpath, projectpath, outputpath, arcpy
+    inputpath = getparameter(0)
     inputpath = str(inputpath)
-    inputpath = string.replace(inputpath, "\\", "/")
+    inputpath = inputpath.replace("\\", "/")
 
     workingpath = inputpath + "/" + 'workingdir'
     if not os.path.isdir(workingpath + "/"):
-        os.mkdir(workingpath + "/")
+        os.makedirs(workingpath + "/", exist_ok=True)
         
     arcgisenvironmentpath = workingpath + "/" + 'ArcGIS'
     if not os.path.isdir(arcgisenvironmentpath + "/"):
-        os.mkdir(arcgisenvironmentpath + "/")
+        os.makedirs(arcgisenvironmentpath + "/", exist_ok=True)
         
     projectpath = workingpath + '/myproject'
     if not os.path.isdir(projectpath + "/"):
-        os.mkdir(projectpath + "/")
+        os.makedirs(projectpath + "/", exist_ok=True)
         
     outputpath = projectpath + '/output'
     if not os.path.isdir(outputpath + "/"):
-        os.mkdir(outputpath + "/")
+        os.makedirs(outputpath + "/", exist_ok=True)
     
 
     ## B - SETUP ArcPy: Setup the API for ArcGis in Python (ArcPy)
-    setup_arcpyenvironment()
+    # Only imported for the arcpy engine: the NumPy engine starts
+    # without paying for arcpy and Spatial Analyst.
+    engine = getengine()
+
+    # Settings that change the rasters: a year written with other
+    # settings is written again (see noaatools.checkpoint).
+    global bandparameters
+    bandparameters = {'engine': engine}
+    if engine == 'arcpy':
+        bandparameters['resamplecellsize'] = resamplecellsize
+        arcpy = arcgis.get_arcpy(spatial=True)
+        setup_arcpyenvironment()
+    else:
+        # Fail here rather than skip every year when netCDF4 is missing.
+        noaacube.get_netcdf4()
 
     # Define some variables we use for processing NetCDFs:
     # In this code, we only care about the TIME dimension.
     global dimension_type
     dimension_type = "time"
 
-    # We're working with precipitation files:
-    # PRATE is short of precipitation rate.
-    global noaafile_type
-    noaafile_type = "prate"
+    # Variables to process, e.g. "prate;air;tmax". Defaults to
+    # precipitation files (PRATE is short of precipitation rate).
+    listofvariables = noaavariables.parse_variables(getparameter(3))
 
     # Start and end year:
     # The years for the 3 sample input files
-    startyear = arcpy.GetParameterAsText(1)
-    endyear = arcpy.GetParameterAsText(2)
+    startyear = getparameter(1)
+    endyear = getparameter(2)
     if startyear > endyear:
-        arcpy.AddMessage("Please select end year greater than or equal to start year")
+        addmessage("Please select end year greater than or equal to start year")
         quit()       
     
     ## C - MAIN: Functions.
 
     
     # Get list of NetCDF files (with full paths and filenames only)
-    listofnoaapaths, listofnoaafilenames = get_listofnetcdfs(startyear, endyear)
+    # for every variable, keeping track of the variable of each file.
+    listofnoaapaths, listofnoaafilenames, listoffilevariables = [], [], []
+    for noaavariable in listofvariables:
+        variablepaths, variablefilenames = get_listofnetcdfs(startyear, endyear, noaavariable)
+        listofnoaapaths.extend(variablepaths)
+        listofnoaafilenames.extend(variablefilenames)
+        listoffilevariables.extend([noaavariable] * len(variablepaths))
     
     # Make directories for rasters output.
     listofnewouputpaths = prepare_rasterpaths(listofnoaafilenames)
 
-    try:            
-        # Create pairs (zip) for looping over:
-        iterators = make_iterators(listofnoaapaths, listofnewouputpaths)
-    except:
-        arcpy.AddMessage("Sart and End years are not valid")
-        quit()
-
-    # Main wrapper loop: for each set of set of tuples, executes
-    # a processing file and executes the processing functions.
-    [loopovernetcdfbands(*args) for args in zip(*iterators)]
+    # Read the next years on a background thread while the current
+    # year is exported, so we do not wait on (network) storage.
+    prefetchdepth = 2
+    prefetchmaxbytes = 256 * 1024 * 1024
+
+    tasks = list(zip(listofnoaapaths, listofnewouputpaths, listoffilevariables))
+
+    # With --shard i/N, keep only this machine's years. Every machine
+    # computes the same assignment, balanced by band count.
+    shard = getshard()
+    tasks = sharding.select_shard(tasks, shard, key=lambda task: os.path.basename(task[0]),
+                                  weight=getyearweight)
+    if shard is not None:
+        addmessage("Shard {}/{}: {} files".format(shard[0], shard[1], len(tasks)))
+    manifestname = '_'.join(['tif'] + [noaavariable.name for noaavariable in listofvariables] +
+                            [str(startyear), str(endyear)])
+
+    # Without arcpy: load each year once and write all its bands
+    # with the NumPy GeoTIFF writer. Years whose checkpoint is
+    # complete are not loaded at all.
+    if engine == 'numpy':
+        prefetcher = Prefetcher(lambda task: None if yeardone(task) else tryloadnetcdfyear(task[0], task[2]),
+                                tasks, prefetchdepth, prefetchmaxbytes)
+        for (inputfilepath, outputpath, noaavariable), loadedyear in prefetcher:
+            if loadedyear is None:
+                addmessage("Skipping {}: all bands were written".format(inputfilepath))
+                continue
+            if isinstance(loadedyear, Exception):
+                skipyear((inputfilepath,), loadedyear)
+                continue
+            exportyear_numpy(*(loadedyear + (inputfilepath, outputpath, noaavariable)))
+        if shard is not None:
+            writeshardmanifest(tasks, shard, manifestname)
+        return
+
+    # arcpy reads the files itself, so only pull the next years'
+    # NetCDF files into the OS cache; the bytes read count toward the cap.
+    prefetcher = Prefetcher(warmtask, tasks, prefetchdepth, prefetchmaxbytes, sizer=lambda nbytes: nbytes)
+
+    # Keep only a couple of NetCDF files open at a time.
+    with HandlePool(arcpy.NetCDFFileProperties, get_netcdfheader, maxopen=2) as handlepool:
+
+        # Create tuples for looping over, one year at a time:
+        iterators = make_iterators((task for task, _ in prefetcher), handlepool)
+
+        # Main wrapper loop: for each set of set of tuples, executes
+        # a processing file and executes the processing functions.
+        [exportyear(args) for args in iterators]
+
+    if shard is not None:
+        writeshardmanifest(tasks, shard, manifestname)
     
     
 # Run with main function.
@@ -1,90 +1,241 @@
 # Import Requried Libraries
-import arcpy
-from arcpy.sa import *
-import os, sys, string
+# (arcpy is imported by getarcpy, only for the steps that use it)
+import os, sys, string, numpy
 from fnmatch import fnmatch
 
-# Get user defined variables from ArcGIS tool GUI
-
-root = arcpy.GetParameterAsText(0)      # Input Folder
-ptshp = arcpy.GetParameterAsText(1)     # Input Point Shapefile
-ptinter = arcpy.GetParameter(2)         # Interpolate values at point locations
-
-# Define local variables for calculating statistics
-if ptinter == True:
-    ptinterval = "INTERPOLATE"
-else:
-    ptinterval = "NONE"
-
-# Set Workspace to input folder
-arcpy.env.workspace = root
-
-# Enable overwriting
-arcpy.env.overwriteOutput = True
-
-# Define variables related to tiff files in the input folder
-pattern = "prate_*.tif"                 # Pattern that will be used to find & prepare a list of raster files
-spattern = "prate_*.shp"                # Pattern that will be used to find & prepare a list of shapefiles
-dpattern = "prate.*"                    # Pattern that will be used to find & prepare a list of input folders
-lTIFs = []                              # Create a blank list that would be populated by input geotiff files later
-mydirs = []                             # Create a blank list that would be populated by input folders later
-
-# Create a list of child folders in the root folder containing GeoTiff Files
-for path, subdirs, files in os.walk(root):
-    for mydir in subdirs:
-        if fnmatch(mydir, dpattern):
-            mydirpath = os.path.join(path, mydir)
-            mydirs.append(mydirpath)
-    if len(mydirs) == 0:
-        mydirs = root
-# Delete empty shapefiles so that they may be generated anew
-    for name in files:        
-        if fnmatch(name, spattern):
-            SHP = os.path.join(path, name)               
-            if arcpy.management.GetCount(SHP)[0] == "0":
-                arcpy.AddMessage('Deleting empty shapefiles if any') 
-                arcpy.Delete_management(SHP)
-
-# Prepare a list of geotiff files matching the defined pattern from input folder
-for mydir in mydirs:
-    for path, subdirs, files in os.walk(mydir):
-        if len(mydirs)>1:
-            arcpy.AddMessage("\n" + 'Processing Folder ' + mydir + "\n")
-        for name in files:
-            if fnmatch(name, pattern):
-                TIF = os.path.join(path, name)
-                lTIFs.append(TIF)                 
-        # Loop through each raster file and calculate statistics
-        for tif in lTIFs:
-            tifpath, tifname = os.path.split(tif)       # Split filenames and paths
-
-            ###################################################################
-            ## Definition of variables related to Point Shapefile Processing ##
-            ###################################################################
-            
-            ptout = tif.replace('.tif', '.shp')         # Full name & Path of temp output point shp
-           
-            ##############################################################
-            ## Start process to calulate statistics for point shapefile ##
-            ##############################################################
-            
-            # Delete temporary point shapefile if already exists
-            if not os.path.exists(ptout):
-
-                arcpy.AddMessage('Processing ' + tifname)
-                try:
-                    arcpy.sa.ExtractValuesToPoints(ptshp, tif, ptout,
-                                      ptinterval, "VALUE_ONLY")
-                except:
-                    arcpy.AddMessage('Error in processing ' + tifname)
-            else:
-                arcpy.AddMessage('Skipping ' + tifname + " (Already Exists)")
-
-            del ptout
-            del tif
-        lTIFs = []
-            
-        
-
-           
+from noaatools import variables as noaavariables
+from noaatools import shard as sharding
+from noaatools import points, tables, shapes, dbf, depends, pipeline
+from noaatools import batch
+from noaatools.arcgis import addmessage, get_arcpy
 
+def getptcsv(tif):
+    # Daily CSV that 2b would write for this raster, e.g. 1900_1_31_pt.csv
+    tifpath, tifname = os.path.split(tif)
+    return os.path.join(tifpath, tifname.split('_', 1)[1].replace('.tif', '_pt.csv'))
+
+def getptcolumn(tif):
+    # Date column of the daily CSV, e.g. d900_1_31 as in 2b
+    return "d" + os.path.basename(getptcsv(tif)).replace('_pt.csv', '')[1:]
+
+def getyearlyname(noaavariable, tif):
+    # Value table of a year in batched mode, e.g. prate_1900_pt_yearly.csv
+    return noaavariable.name + "_" + str(points.get_rasterdate(tif))[:4] + "_pt_yearly.csv"
+
+def getarcpy(root):
+    # Import arcpy with the Spatial Analyst extension and set up the
+    # workspace the first time an arcpy-backed step runs
+    arcpy = get_arcpy(spatial=True)
+
+    # Set Workspace to input folder
+    arcpy.env.workspace = root
+
+    # Enable overwriting
+    arcpy.env.overwriteOutput = True
+    return arcpy
+
+# The main guard keeps the worker processes of the parallel mode from
+# running the tool again when they import this script
+def main():
+    # Get user defined variables from ArcGIS tool GUI (or the batch job)
+
+    root = batch.get_parameter(0)           # Input Folder
+    ptshp = batch.get_parameter(1)          # Input Point Shapefile
+    ptinter = batch.get_flag(2)             # Interpolate values at point locations
+    noaavars = batch.get_parameter(3)       # Variables to process, e.g. "prate;air" (default prate)
+    shard = sharding.parse_shard(batch.get_parameter(4))  # Optional "i/N": process only this machine's share of the rasters
+    ptprocesses = batch.get_parameter(5)    # Optional number of worker processes; empty keeps one ExtractValuesToPoints per raster
+    ptvf = batch.get_parameter(6) or "FID"  # Point Value Field written to the CSVs in parallel mode
+    ptblock = batch.get_parameter(7)        # Optional days per block; writes one value table per year instead of daily outputs
+    inputpath = batch.get_parameter(8)      # Optional NetCDF folder; extracts all variables straight from the yearly files
+
+    # Define local variables for calculating statistics
+    if ptinter == True:
+        ptinterval = "INTERPOLATE"
+    else:
+        ptinterval = "NONE"
+
+    # Outputs are redone only when their rasters, the point shapefile or
+    # these parameters changed since they were written (noaatools.depends)
+    ptinputs = depends.get_shapefileinputs(ptshp)
+    ptparameters = {'ptinterval': ptinterval}
+
+    # A sharded run records its tasks (rasters, or year folders in batched
+    # mode) and outputs in a manifest for merge-shards, e.g.
+    # shards/pt_prate_shard_1_of_4.json; a shard with errors writes none
+    noaavariablelist = noaavariables.parse_variables(noaavars)
+    manifestname = 'pt_' + '_'.join(noaavariable.name for noaavariable in noaavariablelist)
+    shardtasks, shardoutputs, sharderrors = [], [], 0
+
+    # In parallel, batched or NetCDF mode read the point ids and WGS 84 coordinates
+    # once (straight from the .shp/.dbf when they are already in lat/lon)
+    if (ptprocesses or ptblock or inputpath) and shapes.is_geographic(ptshp):
+        ptx, pty = shapes.read_points(ptshp).T
+        ptrecords, ptfields = dbf.read_dbf(ptshp[:-4] + '.dbf')
+        ptids = range(len(ptx)) if ptvf.upper() == "FID" else dbf.get_column(ptrecords, ptfields, ptvf)
+    elif ptprocesses or ptblock or inputpath:
+        arcpy = getarcpy(root)
+        ptrows = [row for row in arcpy.da.SearchCursor(ptshp, [ptvf, "SHAPE@X", "SHAPE@Y"],
+                                                        spatial_reference=arcpy.SpatialReference(4326))]
+        ptids, ptx, pty = [list(column) for column in zip(*ptrows)]
+
+    # Batched and NetCDF mode: the points are stored once, the yearly tables hold only values
+    if ptblock or inputpath:
+        points.write_pointtable(os.path.join(root, "pt_points.csv"), ptids, ptx, pty, ptvf)
+
+    # NetCDF mode: the points are mapped onto the reanalysis grid once and
+    # the weights shared by every variable and year; each yearly file is
+    # read once (only the window around the points) into a yearly table,
+    # e.g. prate.1900/prate_1900_pt_yearly.csv in the root folder
+    if inputpath:
+        years = pipeline.find_years(inputpath, noaavariablelist)
+        if not years:
+            addmessage('No NetCDF files in ' + inputpath)
+            return
+        grid = pipeline.get_grid(inputpath, noaavariablelist, years)
+        ptweights = grid.locate_points(ptx, pty, ptinter == True).to_window(grid.get_window(ptx, pty))
+        extraction = pipeline.Extraction("pt", ptweights, list(ptids), ptvf)
+        for outputfile in pipeline.run_extractions(inputpath, root, noaavariablelist, years, [extraction],
+                                                   shard=shard, manifestname=manifestname):
+            addmessage('Wrote ' + outputfile)
+        return
+
+    # Loop through each variable; its rasters sit in folders such as prate.1900
+    for noaavariable in noaavariablelist:
+
+        # Define variables related to tiff files in the input folder
+        pattern = noaavariable.name + "_*.tif"         # Pattern that will be used to find & prepare a list of raster files
+        spattern = noaavariable.name + "_*.shp"        # Pattern that will be used to find & prepare a list of shapefiles
+        dpattern = noaavariable.fileprefix + ".*"      # Pattern that will be used to find & prepare a list of input folders
+        lTIFs = []                              # Create a blank list that would be populated by input geotiff files later
+        mydirs = []                             # Create a blank list that would be populated by input folders later
+
+        # Create a list of child folders in the root folder containing GeoTiff Files
+        for path, subdirs, files in os.walk(root):
+            for mydir in subdirs:
+                if fnmatch(mydir, dpattern):
+                    mydirpath = os.path.join(path, mydir)
+                    mydirs.append(mydirpath)
+        # Delete empty shapefiles so that they may be generated anew
+            for name in files:        
+                if fnmatch(name, spattern):
+                    SHP = os.path.join(path, name)
+                    if dbf.read_dbfheader(SHP[:-4] + '.dbf')[0] == 0:   # record count from the .dbf header
+                        addmessage('Deleting empty shapefiles if any') 
+                        shapes.delete_shapefile(SHP)
+
+        # Rasters directly in the root folder (always a list, so sharding
+        # splits folders and not the characters of a path)
+        if len(mydirs) == 0:
+            mydirs = [root]
+
+        # Prepare a list of geotiff files matching the defined pattern from input folder
+        for mydir in mydirs:
+            for path, subdirs, files in os.walk(mydir):
+                if len(mydirs)>1:
+                    addmessage("\n" + 'Processing Folder ' + mydir + "\n")
+                record = depends.DependencyRecord(path)
+                for name in files:
+                    if fnmatch(name, pattern):
+                        TIF = os.path.join(path, name)
+                        lTIFs.append(TIF)                 
+                # Keep only this machine's rasters when sharded (same split on every machine);
+                # batched mode writes one table per folder, so it splits whole folders
+                if not ptblock:
+                    lTIFs = sharding.select_shard(lTIFs, shard, key=os.path.basename)
+                elif path not in sharding.select_shard(mydirs, shard, key=os.path.basename):
+                    lTIFs = []
+
+                # Batched mode: blocks of days are extracted at once into
+                # (days x points) arrays and written as one value table per
+                # folder, e.g. prate_1900_pt_yearly.csv, with no daily outputs
+                if ptblock and lTIFs:
+                    ptyearly = os.path.join(path, getyearlyname(noaavariable, lTIFs[0]))
+                    shardtasks.append(os.path.basename(path))
+                    shardoutputs.append(ptyearly)
+                    signature = depends.get_signature(lTIFs + ptinputs, dict(ptparameters, ptvf=ptvf))
+                    if record.is_current(ptyearly, signature):
+                        addmessage('Skipping ' + ptyearly + " (Up to date)")
+                    else:
+                        tifdates, tifvalues = [], []
+                        for tifs, blockdates, values, errors in points.extract_blocks(
+                                lTIFs, ptx, pty, ptinter == True, int(ptprocesses or 0), int(ptblock)):
+                            for tif, error in errors:
+                                addmessage('Error in processing ' + os.path.basename(tif) + ': ' + error)
+                                sharderrors += 1
+                            addmessage('Extracted ' + str(len(tifs)) + ' days')
+                            tifdates.extend(blockdates)
+                            tifvalues.append(values)
+                        tifdates = numpy.array(tifdates, dtype='datetime64[D]')
+                        order = numpy.argsort(tifdates, kind='stable')
+                        addmessage('Writing ' + ptyearly)
+                        tables.write_widetable(ptyearly, ptids, tifdates[order],
+                                               numpy.concatenate(tifvalues)[order], ptvf)
+                        record.record(ptyearly, signature)
+                    lTIFs = []
+
+                # Parallel mode: worker processes load the points once and
+                # the values are written straight to the daily CSVs of 2b
+                if ptprocesses:
+                    signatures = dict((tif, depends.get_signature([tif] + ptinputs, dict(ptparameters, ptvf=ptvf)))
+                                      for tif in lTIFs)
+                    shardtasks.extend(os.path.basename(tif) for tif in lTIFs)
+                    shardoutputs.extend(getptcsv(tif) for tif in lTIFs)
+                    lTIFs = [tif for tif in lTIFs if not record.is_current(getptcsv(tif), signatures[tif])]
+                    for tif, tifdate, values, error in points.extract_rasters(lTIFs, ptx, pty, ptinter == True,
+                                                                              int(ptprocesses)):
+                        if error is not None:
+                            addmessage('Error in processing ' + os.path.basename(tif) + ': ' + error)
+                            sharderrors += 1
+                            continue
+                        addmessage('Writing ' + getptcsv(tif))
+                        points.write_pointcsv(getptcsv(tif), ptids, getptcolumn(tif), values, ptvf)
+                        record.record(getptcsv(tif), signatures[tif])
+                    lTIFs = []
+
+                # Loop through each raster file and calculate statistics
+                for tif in lTIFs:
+                    tifpath, tifname = os.path.split(tif)       # Split filenames and paths
+
+                    ###################################################################
+                    ## Definition of variables related to Point Shapefile Processing ##
+                    ###################################################################
+
+                    ptout = tif.replace('.tif', '.shp')         # Full name & Path of temp output point shp
+
+                    ##############################################################
+                    ## Start process to calulate statistics for point shapefile ##
+                    ##############################################################
+
+                    # Extract unless the point shapefile, or the CSV 2b converted
+                    # it to, was made from this raster, shapefile and ptinterval
+                    signature = depends.get_signature([tif] + ptinputs, ptparameters)
+                    ptcsvcurrent = record.is_current(getptcsv(tif), signature, subset=True)
+                    shardtasks.append(tifname)
+                    shardoutputs.append(getptcsv(tif) if ptcsvcurrent else ptout)
+                    if not (ptcsvcurrent or record.is_current(ptout, signature)):
+
+                        addmessage('Processing ' + tifname)
+                        arcpy = getarcpy(root)
+                        try:
+                            arcpy.sa.ExtractValuesToPoints(ptshp, tif, ptout,
+                                              ptinterval, "VALUE_ONLY")
+                            record.record(ptout, signature)
+                        except:
+                            addmessage('Error in processing ' + tifname)
+                            sharderrors += 1
+                    else:
+                        addmessage('Skipping ' + tifname + " (Up to date)")
+
+                    del ptout
+                    del tif
+                lTIFs = []
+                record.write()
+
+    if shard is not None and sharderrors:
+        addmessage('Shard {}/{} had {} errors; no manifest written'.format(shard[0], shard[1], sharderrors))
+    elif shard is not None:
+        sharding.write_manifest(root, shard, shardtasks, shardoutputs, manifestname)
+
+if __name__ == "__main__":
+    main()
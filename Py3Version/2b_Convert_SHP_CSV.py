@@ -1,86 +1,121 @@
 # Import Requried Libraries
-import arcpy
-from arcpy.sa import *
+# (arcpy is only imported for tables the .dbf reader cannot use)
 import os, sys, string
 from fnmatch import fnmatch
 
-# Get user defined variables from ArcGIS tool GUI
-
-root = arcpy.GetParameterAsText(0)      # Input Folder
-ptshp = arcpy.GetParameterAsText(1)     # Input Point Shapefile
-ptvf = arcpy.GetParameterAsText(2)      # Point Value Field
-delshp = arcpy.GetParameter(3)         # Interpolate values at point locations
-
-# Set Workspace to input folder
-arcpy.env.workspace = root
-
-# Enable overwriting
-arcpy.env.overwriteOutput = True
-
-# Define variables related to shpf files in the input folder
-pattern = "prate_*.shp"                 # Pattern that will be used to find & prepare a list of raster files
-SHPs = []                              # Create a blank list that would be populated by input geoshpf files later
-
-# Prepare a list of geoshpf files matching the defined pattern from input folder
-
-for path, subdirs, files in os.walk(root):
-    for name in files:
-        if fnmatch(name, pattern):
-            SHP = os.path.join(path, name)
-            SHPs.append(SHP)            
-            
-# Loop through each raster file and calculate statistics
-for shp in SHPs:
-    shppath, shpname = os.path.split(shp)       # Split filenames and paths       
-    
-    ptcsv = shpname.replace('.shp', '_pt.csv')  # Define output csv file (add _pt after filename)
-    ptcsv = ptcsv.replace('prate_', '')         # Finalize CSV name by stripping "prate_"
-    tbloutfield = ptcsv.split('.')[0]           # Get output csv filname without extension
-    tbloutfield = tbloutfield.replace('_pt', '')# Strip _pt from name
-    tbloutfield = "d"+tbloutfield[1:]           # Replace first char of date(year) by "d" to overrule a restriction
-   
-    ##############################################################
-    ## Start process to calulate statistics for point shapefile ##
-    ##############################################################
-    
-
-    # Compute statistics only if output CSV file doesn't exist
-    if not os.path.exists(os.path.join(shppath, ptcsv)):
-        arcpy.AddMessage('Processing ' + shpname)        
-
-        # Delete unnecessary fields and rename the statistics field to date
-        arcpy.AddMessage("  Dropping and renaming fields")
-        fieldList = arcpy.ListFields(shp)  #get a list of point shp fields 
-        for field in fieldList: #loop through each field
-            if field.name == 'RASTERVALU':  #look for the name RASTERVALU                    
-                arcpy.AddField_management(shp, tbloutfield, "DOUBLE", "", "", "", "", "NULLABLE")                     
-                arcpy.CalculateField_management(shp, tbloutfield, "!RASTERVALU!", "PYTHON")
-                arcpy.DeleteField_management(shp, "RASTERVALU")
+from noaatools import variables as noaavariables
+from noaatools import dbf, points, shapes, depends
+from noaatools import batch
+from noaatools.arcgis import addmessage, get_arcpy
+
+def main():
+    # Get user defined variables from ArcGIS tool GUI (or the batch job)
+
+    root = batch.get_parameter(0)      # Input Folder
+    ptshp = batch.get_parameter(1)     # Input Point Shapefile
+    ptvf = batch.get_parameter(2)      # Point Value Field
+    delshp = batch.get_flag(3)         # Interpolate values at point locations
+    noaavars = batch.get_parameter(4)  # Variables to process, e.g. "prate;air" (default prate)
+
+    # Define variables related to shpf files in the input folder
+    SHPs = []                              # Create a blank list that would be populated by input geoshpf files later
+
+    # Prepare a list of geoshpf files matching the defined pattern from input folder
+
+    for noaavariable in noaavariables.parse_variables(noaavars):
+        pattern = noaavariable.name + "_*.shp"     # Pattern that will be used to find & prepare a list of raster files
+        for path, subdirs, files in os.walk(root):
+            for name in files:
+                if fnmatch(name, pattern):
+                    SHP = os.path.join(path, name)
+                    SHPs.append((SHP, noaavariable))
+
+    # Dependency records of each folder, written at the end
+    records = {}
+
+    # Loop through each raster file and calculate statistics
+    for shp, noaavariable in SHPs:
+        shppath, shpname = os.path.split(shp)       # Split filenames and paths       
+
+        ptcsv = shpname.replace('.shp', '_pt.csv')  # Define output csv file (add _pt after filename)
+        ptcsv = ptcsv.replace(noaavariable.name + '_', '')  # Finalize CSV name by stripping "prate_"
+        tbloutfield = ptcsv.split('.')[0]           # Get output csv filname without extension
+        tbloutfield = tbloutfield.replace('_pt', '')# Strip _pt from name
+        tbloutfield = "d"+tbloutfield[1:]           # Replace first char of date(year) by "d" to overrule a restriction
+
+        ##############################################################
+        ## Start process to calulate statistics for point shapefile ##
+        ##############################################################
+
+
+        # Convert only if the output CSV was not made from this point
+        # shapefile (i.e. from its raster, points and ptinterval) and ptvf
+        if shppath not in records:
+            records[shppath] = depends.DependencyRecord(shppath)
+        record = records[shppath]
+        signature = record.derive(shp, {'ptvf': ptvf})
+        if not record.is_current(os.path.join(shppath, ptcsv), signature):
+            addmessage('Processing ' + shpname)        
+
+            # Read RASTERVALU and the point value field straight from the .dbf
+            # and write the CSV, instead of rewriting the table with field tools
+            try:
+                ptrecords, ptfields = dbf.read_dbf(shp[:-4] + '.dbf')
+                ptvalues = dbf.get_column(ptrecords, ptfields, 'RASTERVALU')
+                if ptvf.upper() == "FID":   # FID is the record number, not a stored field
+                    ptids = range(len(ptvalues))
+                else:
+                    ptids = dbf.get_column(ptrecords, ptfields, ptvf)
+                del ptrecords
+                addmessage("  Writing " + ptcsv)
+                points.write_pointcsv(os.path.join(shppath, ptcsv), ptids, tbloutfield, ptvalues, ptvf)
+            except (IOError, KeyError, ValueError):
+                arcpy = get_arcpy()
+
+                # Set Workspace to input folder
+                arcpy.env.workspace = root
+
+                # Enable overwriting
+                arcpy.env.overwriteOutput = True
+
+                # Fall back to the field tools for tables the reader cannot use
+                # Delete unnecessary fields and rename the statistics field to date
+                addmessage("  Dropping and renaming fields")
+                fieldList = arcpy.ListFields(shp)  #get a list of point shp fields 
+                for field in fieldList: #loop through each field
+                    if field.name == 'RASTERVALU':  #look for the name RASTERVALU                    
+                        arcpy.AddField_management(shp, tbloutfield, "DOUBLE", "", "", "", "", "NULLABLE")                     
+                        arcpy.CalculateField_management(shp, tbloutfield, "!RASTERVALU!", "PYTHON")
+                        arcpy.DeleteField_management(shp, "RASTERVALU")
+                    else:
+                        if not (field.name == ptvf or field.name == "FID" or field.name == "Shape"):
+                            try:
+                                arcpy.DeleteField_management(shp, field.name)
+                            except:
+                                addmessage("Error Deleting Field " + field.name)
+
+                # Convert shapefile to CSV
+                addmessage("  Writing " + ptcsv)
+                arcpy.TableToTable_conversion(shp, shppath, ptcsv)
+                arcpy.Delete_management(shp)            
             else:
-                if not (field.name == ptvf or field.name == "FID" or field.name == "Shape"):
-                    try:
-                        arcpy.DeleteField_management(shp, field.name)
-                    except:
-                        arcpy.AddMessage("Error Deleting Field " + field.name)
-
-        # Convert shapefile to CSV
-        arcpy.AddMessage("  Writing " + ptcsv)
-        arcpy.TableToTable_conversion(shp, shppath, ptcsv)
-        arcpy.Delete_management(shp)            
-    else:
-        arcpy.AddMessage('Output already exists. Skipping ' + shpname)
-
-    # Perform Cleanup
-    if delshp == True:
-        arcpy.Delete_management(shp)
-        
-    del shp
-    del ptcsv
-    del tbloutfield
-
-    
-        
-    
-
-       
+                # Outside the try: the CSV is written, so an error deleting
+                # the shapefile must not convert it again with arcpy
+                shapes.delete_shapefile(shp)
+            record.record(os.path.join(shppath, ptcsv), signature)
+        else:
+            addmessage('Output already exists. Skipping ' + shpname)
+
+        # Perform Cleanup
+        if delshp == True:
+            shapes.delete_shapefile(shp)
+
+        del shp
+        del ptcsv
+        del tbloutfield
+
+    for record in records.values():
+        record.write()
 
+if __name__ == "__main__":
+    main()
@@ -1,124 +1,242 @@
 # Import Requried Libraries
-import arcpy
-from arcpy.sa import *
+# (arcpy is imported by get_arcpy, only for the split shapefile path)
 import os, sys, string
 from fnmatch import fnmatch
 
-# Get user defined variables from ArcGIS tool GUI
-
-root = arcpy.GetParameterAsText(0)      # Input Folder
-pgshp = arcpy.GetParameterAsText(1)     # Input Polygon Shapefile
-pgvf = arcpy.GetParameterAsText(2)      # Polygon Value Field
-pgsf = arcpy.GetParameterAsText(3)      # Polygon Split Field
-
-# List of all shapefiles in the workspace
-shps = arcpy.ListFiles("*.shp")
-
-# If splitted shapefiles not already exist
-if not shps:
-
-    # Start procedure to split input shapefiles
-    fgdb = root + os.sep + "fGDB.gdb"
-    fcname = os.path.split(pgshp)[1]
-    fcname = fcname.replace('.shp', '')
-    infc = fgdb + os.sep + fcname
-
-    # Create File GDB
-    if not arcpy.Exists(fgdb):
-        arcpy.CreateFileGDB_management(root, "fGDB.gdb")
-
-    # Convert input polygon shp to feature class
-    arcpy.FeatureClassToGeodatabase_conversion(pgshp, fgdb)
-
-    # Split shapefile by unique field into layers
-    arcpy.AddMessage("Splitting polygon shapefile")
-    arcpy.SplitByAttributes_analysis(infc, root, pgsf)
-
-    # Delete file Geodatabase
-    if arcpy.Exists(fgdb):
-        arcpy.Delete_management(fgdb)
-
-# Set Workspace to input folder
-arcpy.env.workspace = root
-
-# Enable overwriting
-arcpy.env.overwriteOutput = True
-
-# Define variables related to tiff files in the input folder
-pattern = "prate_*.tif"                 # Pattern that will be used to find & prepare a list of raster files
-lTIFs = []                              # Create a blank list that would be populated by input geotiff files later
-
-# Prepare a list of geotiff files matching the defined pattern from input folder
-
-for path, subdirs, files in os.walk(root):
-    for name in files:
-        if fnmatch(name, pattern):
-            TIF = os.path.join(path, name)
-            lTIFs.append(TIF)
-      
-# Loop through each raster file and calculate statistics
-for tif in lTIFs:
-    tifpath, tifname = os.path.split(tif)       # Split filenames and paths
-   
-
-    #####################################################################
-    ## Definition of variables related to Polygon Shapefile Processing ##
-    #####################################################################
-
-    pgcsv = tifname.replace('.tif', '_pg.csv')    
-    pgdbf = tifname.replace('.tif', '_pg.dbf')
-    tbloutfield = tifname.split('.')[0]                 # Get tif filname without extension
-    tbloutfield = tbloutfield.replace('prate_', '') # Strip prate_ from name
-    tbloutfield = "d"+tbloutfield[1:]               # Replace first char of date(year) by "d" to overrule a restriction
-    pgcsvp = os.path.join(tifpath, pgcsv)
-    inTables = []
-    
-        
-    ################################################################
-    ## Start process to calulate statistics for polygon shapefile ##
-    ################################################################
-        
-    if pgshp:
-
-        arcpy.AddMessage('Processing ' + tifname)
-        try:
-            arcpy.Delete_management("tempras")
-        except:
+from noaatools import variables as noaavariables
+from noaatools import shard as sharding
+from noaatools import shapes, zones, depends, pipeline, rasterize
+from noaatools import batch
+from noaatools.arcgis import addmessage, get_arcpy
+
+def main():
+    # Get user defined variables from ArcGIS tool GUI (or the batch job)
+
+    root = batch.get_parameter(0)      # Input Folder
+    pgshp = batch.get_parameter(1)     # Input Polygon Shapefile
+    pgvf = batch.get_parameter(2)      # Polygon Value Field
+    pgsf = batch.get_parameter(3)      # Polygon Split Field
+    noaavars = batch.get_parameter(4)  # Variables to process, e.g. "prate;air" (default prate)
+    pgsupersample = int(batch.get_parameter(5) or 16)  # Sub-cells per cell side for the in-memory zones
+    inputpath = batch.get_parameter(6) # Optional NetCDF folder; extracts all variables straight from the yearly files
+    shard = sharding.parse_shard(batch.get_parameter(7))  # Optional "i/N": process only this machine's share of the rasters
+
+    # A sharded run records its rasters (or yearly files) and outputs in a
+    # manifest for merge-shards, e.g. shards/pg_prate_shard_1_of_4.json;
+    # a shard with errors writes none
+    noaavariablelist = noaavariables.parse_variables(noaavars)
+    manifestname = 'pg_' + '_'.join(noaavariable.name for noaavariable in noaavariablelist)
+    shardtasks, shardoutputs, sharderrors = [], [], 0
+
+    # A lat/lon polygon shapefile is grouped by the split field in memory:
+    # one zone per (group, pgvf value), all groups averaged in one pass per
+    # raster straight from the tifs, and no split shapefiles are written
+    grouped = None
+    if pgshp and pgsf and shapes.is_geographic(pgshp):
+        addmessage("Grouping polygons by " + pgsf)
+        grouped = zones.GroupedZones(pgshp, pgvf, pgsf, pgsupersample)
+
+    # NetCDF mode: the zone weights are built once on the reanalysis grid
+    # and shared by every variable and year; each yearly file is read once
+    # (only the window around the polygons) into a yearly table, e.g.
+    # prate.1900/prate_1900_pg_yearly.csv in the root folder, with one row
+    # per zone identified by split field and zone value (e.g. DE_DE11)
+    if inputpath:
+        if grouped is None:
+            raise ValueError("Reading the NetCDF files needs a lat/lon polygon shapefile and a split field")
+        years = pipeline.find_years(inputpath, noaavariablelist)
+        if not years:
+            addmessage('No NetCDF files in ' + inputpath)
+            return
+        grid = pipeline.get_grid(inputpath, noaavariablelist, years)
+        pgx, pgy = grouped.polygons.coords.T
+        pgweights = rasterize.get_zoneweights(grouped.polygons, grid, pgsupersample, grouped.featurezones,
+                                              grouped.nzones).to_window(grid.get_window(pgx, pgy))
+        zoneids = [str(group) + '_' + str(zonevalue) for group, zonevalue in zip(grouped.zonegroups,
+                                                                                 grouped.zonevalues)]
+        extraction = pipeline.Extraction("pg", pgweights, zoneids, pgsf + '_' + pgvf)
+        for outputfile in pipeline.run_extractions(inputpath, root, noaavariablelist, years, [extraction],
+                                                   shard=shard, manifestname=manifestname):
+            addmessage('Wrote ' + outputfile)
+        return
+
+    # Outputs are redone only when their raster, the polygon shapefile or
+    # these parameters changed since they were written (noaatools.depends)
+    pgcellsize = "0.04 0.04"                # Cell size the arcpy path resamples the rasters to
+    pginputs = depends.get_shapefileinputs(pgshp) if pgshp else []
+    if grouped is not None:
+        pgparameters = {'pgvf': pgvf, 'pgsf': pgsf, 'pgsupersample': pgsupersample}
+    else:
+        pgparameters = {'pgvf': pgvf, 'pgsf': pgsf, 'resamplecellsize': pgcellsize}
+    record = None
+
+    # The split shapefiles and ZonalStatisticsAsTable need arcpy and
+    # Spatial Analyst, the grouped path runs without them
+    if grouped is None:
+        arcpy = get_arcpy(spatial=True)
+
+        # Set Workspace to input folder
+        arcpy.env.workspace = root
+
+        # Enable overwriting
+        arcpy.env.overwriteOutput = True
+
+        # List of all shapefiles in the workspace
+        shps = arcpy.ListFiles("*.shp")
+
+        # If splitted shapefiles not already exist
+        if not shps:
+
+            # Start procedure to split input shapefiles
+            fgdb = root + os.sep + "fGDB.gdb"
+            fcname = os.path.split(pgshp)[1]
+            fcname = fcname.replace('.shp', '')
+            infc = fgdb + os.sep + fcname
+
+            # Create File GDB
+            if not arcpy.Exists(fgdb):
+                arcpy.CreateFileGDB_management(root, "fGDB.gdb")
+
+            # Convert input polygon shp to feature class
+            arcpy.FeatureClassToGeodatabase_conversion(pgshp, fgdb)
+
+            # Split shapefile by unique field into layers
+            addmessage("Splitting polygon shapefile")
+            arcpy.SplitByAttributes_analysis(infc, root, pgsf)
+
+            # Delete file Geodatabase
+            if arcpy.Exists(fgdb):
+                arcpy.Delete_management(fgdb)
+
+    # Define variables related to tiff files in the input folder
+    lTIFs = []                              # Create a blank list that would be populated by input geotiff files later
+
+    # Prepare a list of geotiff files matching the defined pattern from input folder
+
+    for noaavariable in noaavariablelist:
+        pattern = noaavariable.name + "_*.tif"     # Pattern that will be used to find & prepare a list of raster files
+        for path, subdirs, files in os.walk(root):
+            for name in files:
+                if fnmatch(name, pattern):
+                    TIF = os.path.join(path, name)
+                    lTIFs.append((TIF, noaavariable))
+
+    # Keep only this machine's rasters when sharded (same split on every machine)
+    lTIFs = sharding.select_shard(lTIFs, shard, key=lambda item: os.path.basename(item[0]))
+    if shard is not None:
+        addmessage("Shard {}/{}: {} rasters".format(shard[0], shard[1], len(lTIFs)))
+
+    if grouped is None and lTIFs:
+        # Only resample the area of interest: the polygon extent plus one source
+        # cell (1.875 degrees) so cells partly covered by a polygon are kept.
+        # The extent is projected into the rasters' lat/lon first, as the
+        # margin is in degrees and the shapefile here is not in lat/lon.
+        aoimargin = 1.875
+        pgextent = arcpy.Describe(pgshp).extent
+        tifsr = arcpy.Describe(lTIFs[0][0]).spatialReference
+        if pgextent.spatialReference is not None and pgextent.spatialReference.name != 'Unknown':
+            pgextent = pgextent.projectAs(tifsr)
+        arcpy.env.extent = arcpy.Extent(pgextent.XMin - aoimargin, pgextent.YMin - aoimargin,
+                                        pgextent.XMax + aoimargin, pgextent.YMax + aoimargin)
+
+    # Loop through each raster file and calculate statistics
+    for tif, noaavariable in lTIFs:
+        tifpath, tifname = os.path.split(tif)       # Split filenames and paths
+
+
+        #####################################################################
+        ## Definition of variables related to Polygon Shapefile Processing ##
+        #####################################################################
+
+        pgcsv = tifname.replace('.tif', '_pg.csv')    
+        pgdbf = tifname.replace('.tif', '_pg.dbf')
+        tbloutfield = tifname.split('.')[0]                 # Get tif filname without extension
+        tbloutfield = tbloutfield.replace(noaavariable.name + '_', '') # Strip prate_ from name
+        tbloutfield = "d"+tbloutfield[1:]               # Replace first char of date(year) by "d" to overrule a restriction
+        pgcsvp = os.path.join(tifpath, pgcsv)
+        inTables = []
+
+        # The records of a raster folder are written when the next folder starts
+        if record is None or record.folder != tifpath:
+            if record is not None:
+                record.write()
+            record = depends.DependencyRecord(tifpath)
+        signature = depends.get_signature([tif] + pginputs, pgparameters)
+        shardtasks.append(tifname)
+        shardoutputs.append(os.path.join(root, pgcsv))
+        if record.is_current(os.path.join(root, pgcsv), signature):
+            addmessage('Skipping ' + tifname + " (Up to date)")
             continue
-        arcpy.Resample_management(tif, "tempras", "0.04 0.04", "NEAREST")
-        # list all fcs in workspace
-        fcs = arcpy.ListFiles("*.shp")
-        for fc in fcs:           
-      
-            sfcname = fc.replace('.shp', '')        # Splited shapefile name without extension
-            
-            pgtmpdbf = fc.replace('.shp', '_pg_')   # Prepare temporary table name that'll contain mean values
-            pgtmpdbf = pgtmpdbf + sfcname + '.dbf'  # Finalize temporary table name
-            arcpy.AddMessage('Calculating Polygon statistics for ' + sfcname)
-
-            ZonalStatisticsAsTable(fc, pgvf, "tempras", pgtmpdbf, "DATA", "MEAN")
-            arcpy.AddField_management(pgtmpdbf, "NUTS_ID1", "TEXT", field_length="5")
-            arcpy.CalculateField_management(pgtmpdbf, "NUTS_ID1", '!NUTS_ID!', "PYTHON_9.3")
-            arcpy.AddField_management(pgtmpdbf, tbloutfield, "DOUBLE", "", "", "", "", "NULLABLE")
-            arcpy.CalculateField_management(pgtmpdbf, tbloutfield, '!MEAN!', "PYTHON_9.3")
-            pgfieldList = arcpy.ListFields(pgtmpdbf)  #get a list of temp point shp fields 
-            for pgfield in pgfieldList: #loop through each field                
-                if not (pgfield.name == "OID" or pgfield.name == "NUTS_ID1" or pgfield.name == tbloutfield):
-                    try:
-                        arcpy.DeleteField_management(pgtmpdbf, pgfield.name)
-                    except:
-                        arcpy.AddMessage("Error Deleting Field " + pgfield.name)
-
-            inTables.append(pgtmpdbf)
-
-        arcpy.AddMessage('Merging temp tables into ' + pgdbf)
-        arcpy.Merge_management(inTables,pgdbf)
-        arcpy.TableToTable_conversion(pgdbf, root, pgcsv)
-        arcpy.Delete_management(pgdbf)
-        arcpy.Delete_management("tempras")
-        for tbl in inTables:
-            arcpy.Delete_management(tbl)
-    
-
-       
 
+
+        ################################################################
+        ## Start process to calulate statistics for polygon shapefile ##
+        ################################################################
+
+        if grouped is not None:
+
+            addmessage('Processing ' + tifname)
+            try:
+                values = grouped.extract(tif)
+            except Exception as exception:
+                addmessage('Error in processing ' + tifname + ': ' + str(exception))
+                sharderrors += 1
+                continue
+            zones.write_zonecsv(os.path.join(root, pgcsv), grouped.zonegroups, grouped.zonevalues,
+                                tbloutfield, values, pgsf, pgvf)
+            record.record(os.path.join(root, pgcsv), signature)
+
+        elif pgshp:
+
+            addmessage('Processing ' + tifname)
+            try:
+                arcpy.Delete_management("tempras")
+            except:
+                addmessage('Error in processing ' + tifname)
+                sharderrors += 1
+                continue
+            arcpy.Resample_management(tif, "tempras", pgcellsize, "NEAREST")
+            # list all fcs in workspace
+            fcs = arcpy.ListFiles("*.shp")
+            for fc in fcs:           
+
+                sfcname = fc.replace('.shp', '')        # Splited shapefile name without extension
+
+                pgtmpdbf = fc.replace('.shp', '_pg_')   # Prepare temporary table name that'll contain mean values
+                pgtmpdbf = pgtmpdbf + sfcname + '.dbf'  # Finalize temporary table name
+                addmessage('Calculating Polygon statistics for ' + sfcname)
+
+                arcpy.sa.ZonalStatisticsAsTable(fc, pgvf, "tempras", pgtmpdbf, "DATA", "MEAN")
+                arcpy.AddField_management(pgtmpdbf, "NUTS_ID1", "TEXT", field_length="5")
+                arcpy.CalculateField_management(pgtmpdbf, "NUTS_ID1", '!NUTS_ID!', "PYTHON_9.3")
+                arcpy.AddField_management(pgtmpdbf, tbloutfield, "DOUBLE", "", "", "", "", "NULLABLE")
+                arcpy.CalculateField_management(pgtmpdbf, tbloutfield, '!MEAN!', "PYTHON_9.3")
+                pgfieldList = arcpy.ListFields(pgtmpdbf)  #get a list of temp point shp fields 
+                for pgfield in pgfieldList: #loop through each field                
+                    if not (pgfield.name == "OID" or pgfield.name == "NUTS_ID1" or pgfield.name == tbloutfield):
+                        try:
+                            arcpy.DeleteField_management(pgtmpdbf, pgfield.name)
+                        except:
+                            addmessage("Error Deleting Field " + pgfield.name)
+
+                inTables.append(pgtmpdbf)
+
+            addmessage('Merging temp tables into ' + pgdbf)
+            arcpy.Merge_management(inTables,pgdbf)
+            arcpy.TableToTable_conversion(pgdbf, root, pgcsv)
+            arcpy.Delete_management(pgdbf)
+            arcpy.Delete_management("tempras")
+            for tbl in inTables:
+                arcpy.Delete_management(tbl)
+            record.record(os.path.join(root, pgcsv), signature)
+
+    if record is not None:
+        record.write()
+
+    if shard is not None and sharderrors:
+        addmessage('Shard {}/{} had {} errors; no manifest written'.format(shard[0], shard[1], sharderrors))
+    elif shard is not None:
+        sharding.write_manifest(root, shard, shardtasks, shardoutputs, manifestname)
+
+if __name__ == "__main__":
+    main()
@@ -1,48 +1,142 @@
-import os, pandas, arcpy
+import os, re
 
-# Get user defined variables
+from noaatools import pipeline, longstore, depends
+from noaatools import batch
+from noaatools.arcgis import addmessage
 
-path = arcpy.GetParameterAsText(0)   # Input Folder
-ptcsv = arcpy.GetParameterAsText(1)  # ptcsv for Point CSV
-pgcsv = arcpy.GetParameterAsText(2)  # ptcsv for Polygon CSV
+def getvariable(c):
+    # Polygon CSVs keep the variable in the name (prate_1900_1_31_pg.csv),
+    # point CSVs sit in the yearly folder of the variable (air.2m.1900)
+    cfolder, cname = os.path.split(c)
+    prefix = re.match(r'(.*?)_?\d{4}_\d{1,2}_\d{1,2}_p[tg]\.csv$', cname)
+    if prefix and prefix.group(1):
+        return prefix.group(1)
+    return re.sub(r'\.\d{4}$', '', os.path.basename(cfolder))
 
-if not ptcsv.endswith('.csv') and ptcsv:
-    ptcsv = ptcsv + ".csv"
-    
-if not pgcsv.endswith('.csv') and pgcsv:
-    pgcsv = pgcsv + ".csv"
-
-
-ptfiles=[]                           # Empty list that will contain all point CSVs
-pgfiles=[]                           # Empty list that will contain all polygon CSVs
-
-
-# Prepare list of all CSV files in their corresponding variables
-for root, dirs, files in os.walk(path):
-    for mfile in files:
-        if mfile.endswith("_pt.csv"):
-             ptfiles.append(os.path.join(root, mfile))
-        if mfile.endswith("_pg.csv"):
-             pgfiles.append(os.path.join(root, mfile))
+def groupbyvariable(clist, fout):
+    # One merged table per variable, e.g. out.csv becomes out_air.2m.csv
+    # when more than one variable is present
+    groups = {}
+    for c in clist:
+        groups.setdefault(getvariable(c), []).append(c)
+    if len(groups) == 1:
+        return [(clist, fout)]
+    return [(groups[v], fout.replace('.csv', '_' + v + '.csv')) for v in sorted(groups)]
 
 def mergecsvs(clist, fout):
+    import pandas
     for c in clist:
         cdataframe = pandas.read_csv( c )
         cdf = cdataframe.drop('OID', axis =1)
         if not os.path.exists(fout):
-            arcpy.AddMessage('Appending ' + os.path.split(c)[1])
+            addmessage('Appending ' + os.path.split(c)[1])
             cdf.to_csv(fout, index=False)
         else:
-            arcpy.AddMessage('Appending ' + os.path.split(c)[1])
+            addmessage('Appending ' + os.path.split(c)[1])
             fdf = pandas.read_csv(fout)
             cname = list(cdf.columns.values)[0]
             fdf[cname] = cdf[cname]
             fdf.to_csv(fout, index=False)
 
-# Merge point CSVs if present
-if (ptcsv and ptfiles):
-    mergecsvs(ptfiles, ptcsv)
-    
-# Merge polygon CSVs if present
-if (pgcsv and pgfiles):
-    mergecsvs(pgfiles, pgcsv)   
+def mergelong(clist, fout, readtable=None, replace=()):
+    # Long layout: the days are appended to out.lts one year at a time
+    # (only days not stored yet, or those of the replace tables), then
+    # exported as out.csv sorted by feature and date with a per-feature
+    # offset index, out_index.csv
+    addmessage('Appending ' + str(len(clist)) + ' tables to ' + fout.replace('.csv', '.lts'))
+    store = longstore.append_tables(fout.replace('.csv', '.lts'), clist, readtable, replace)
+    addmessage('Writing ' + fout)
+    store.to_csv(fout)
+
+def getdirty(clist, fout, layout):
+    # Tables changed or added since fout was merged from them (all of them
+    # when fout or its long store is missing), with the signature to record
+    record = depends.DependencyRecord(os.path.dirname(os.path.abspath(fout)))
+    signature = depends.get_signature(clist, {'layout': layout})
+    dirty = set(record.get_dirty(fout, signature))
+    if layout == "long" and not os.path.exists(os.path.join(fout.replace('.csv', '.lts'), longstore.MANIFEST)):
+        dirty = set(signature['inputs'])
+    return [c for c in clist if os.path.abspath(c) in dirty], record, signature
+
+def merge(clist, fout, layout, mergetables):
+    # Merge only what changed: mergetables(changed tables) patches them into
+    # fout, then fout is recorded as made from all of clist
+    cdirty, record, signature = getdirty(clist, fout, layout)
+    if not cdirty:
+        addmessage('Skipping ' + fout + ' (Up to date)')
+        return
+    mergetables(cdirty)
+    record.record(fout, signature)
+    record.write()
+
+def main():
+    # Get user defined variables (from the ArcGIS tool GUI or the batch job)
+
+    path = batch.get_parameter(0)   # Input Folder
+    ptcsv = batch.get_parameter(1)  # ptcsv for Point CSV
+    pgcsv = batch.get_parameter(2)  # ptcsv for Polygon CSV
+    layout = batch.get_parameter(3) or "wide"  # "wide" (one column per day) or "long" (feature, date, value rows)
+
+    if not ptcsv.endswith('.csv') and ptcsv:
+        ptcsv = ptcsv + ".csv"
+
+    if not pgcsv.endswith('.csv') and pgcsv:
+        pgcsv = pgcsv + ".csv"
+
+
+    ptfiles=[]                           # Empty list that will contain all point CSVs
+    pgfiles=[]                           # Empty list that will contain all polygon CSVs
+    ptyearly=[]                          # Yearly point value tables (batched and NetCDF mode of 2a)
+    pgyearly=[]                          # Yearly polygon value tables (NetCDF mode of 2c)
+
+
+    # Prepare list of all CSV files in their corresponding variables
+    for root, dirs, files in os.walk(path):
+        for mfile in files:
+            if mfile.endswith("_pt.csv"):
+                 ptfiles.append(os.path.join(root, mfile))
+            if mfile.endswith("_pg.csv"):
+                 pgfiles.append(os.path.join(root, mfile))
+            if mfile.endswith("_pt_yearly.csv"):
+                 ptyearly.append(os.path.join(root, mfile))
+            if mfile.endswith("_pg_yearly.csv"):
+                 pgyearly.append(os.path.join(root, mfile))
+
+    if layout == "long":
+        # Yearly tables are only used when there are no daily CSVs of the kind
+        for cfiles, cout, readtable, cdaily in [(ptfiles, ptcsv, None, []),
+                                                (ptyearly, ptcsv, pipeline.read_yearlytable, ptfiles),
+                                                (pgfiles, pgcsv, None, []),
+                                                (pgyearly, pgcsv, pipeline.read_yearlytable, pgfiles)]:
+            if cout and cfiles and not cdaily:
+                for vfiles, vcsv in groupbyvariable(cfiles, cout):
+                    merge(vfiles, vcsv, layout,
+                          lambda cdirty: mergelong(cdirty, vcsv, readtable, replace=cdirty))
+        ptfiles = pgfiles = ptyearly = pgyearly = []
+
+    # Merge point CSVs if present (a merged table only gets the columns
+    # of the daily CSVs that changed since the last merge)
+    if (ptcsv and ptfiles):
+        for vfiles, vcsv in groupbyvariable(ptfiles, ptcsv):
+            merge(vfiles, vcsv, layout, lambda cdirty: mergecsvs(cdirty, vcsv))
+
+    # Yearly point tables already hold every day as a column, so they are
+    # concatenated by date rather than merged day by day
+    if (ptcsv and ptyearly and not ptfiles):
+        for vfiles, vcsv in groupbyvariable(ptyearly, ptcsv):
+            addmessage('Merging ' + str(len(vfiles)) + ' yearly tables into ' + vcsv)
+            merge(vfiles, vcsv, layout, lambda cdirty: pipeline.merge_yearlytables(vfiles, vcsv))
+
+    # Merge polygon CSVs if present
+    if (pgcsv and pgfiles):
+        for vfiles, vcsv in groupbyvariable(pgfiles, pgcsv):
+            merge(vfiles, vcsv, layout, lambda cdirty: mergecsvs(cdirty, vcsv))
+
+    # Yearly polygon tables are concatenated by date like the point ones
+    if (pgcsv and pgyearly and not pgfiles):
+        for vfiles, vcsv in groupbyvariable(pgyearly, pgcsv):
+            addmessage('Merging ' + str(len(vfiles)) + ' yearly tables into ' + vcsv)
+            merge(vfiles, vcsv, layout, lambda cdirty: pipeline.merge_yearlytables(vfiles, vcsv))
+
+if __name__ == "__main__":
+    main()
@@ -14,6 +14,10 @@ import arcpy, os, datetime, sys, numpy, re, time
 from arcpy.sa import *
 import pandas
 
+# The NumPy helpers live one folder up, in Py3Version/noaatools.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from noaatools.prefetch import Prefetcher, warm_file, get_filebytes
+
 ######################################################################################
 # DEFINE HELPER FUNCTIONS
 
@@ -312,11 +316,17 @@ def main():
 
     ### 1. MAIN LOOP FOR EXTRACTING DAILY RASTER VALUES.
 
-    # Loop over the files saved in the raster paths.
-    for fileyear in range(startyear, endyear):
-
-        # Grab list of rasters matching year.
+    # Read the next year's rasters into the OS cache on a background
+    # thread while the current year is extracted, at most 256 MB of
+    # rasters ahead.
+    def warmyear(fileyear):
         tiffiles = getrasters(fileyear, allrasters)
+        [warm_file(tiffile) for tiffile in tiffiles]
+        return tiffiles
+
+    # Loop over the files saved in the raster paths.
+    for fileyear, tiffiles in Prefetcher(warmyear, range(startyear, endyear), depth=2,
+                                         maxbytes=256 * 1024 * 1024, sizer=get_filebytes):
 
         # Grab output subfile:
         outputsubfile = getsubfile(fileyear, listofoutputsubpaths)
@@ -0,0 +1,10 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Pure NumPy engines behind the NetCDF Conversion Toolbox.
+
+The toolbox scripts in the parent folder drive ArcMap through arcpy.
+The modules in this package do the same numerical work (reading the
+NOAA Reanalysis cubes, extracting values at features, writing tables)
+with NumPy alone, so they can run on machines without an ArcGIS
+license.
+"""
@@ -0,0 +1,54 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Import arcpy only for the steps that use it.
+
+Importing arcpy and checking out Spatial Analyst takes several seconds,
+so the toolbox scripts no longer do it at the top. The NumPy paths run
+without it; the arcpy-backed steps call get_arcpy() when they start.
+Inside an ArcGIS dialog arcpy is already loaded and messages go to the
+tool's message window, elsewhere they are printed.
+"""
+
+import importlib.util
+import sys
+
+
+# Spatial Analyst has been checked out in this process.
+_spatial = False
+
+
+def in_arcgis():
+    '''True when arcpy is already loaded, e.g. in an ArcGIS script tool.'''
+
+    return 'arcpy' in sys.modules
+
+
+def has_arcpy():
+    '''True when arcpy could be imported (without importing it).'''
+
+    return in_arcgis() or importlib.util.find_spec('arcpy') is not None
+
+
+def get_arcpy(spatial=False):
+    '''
+    Import arcpy on first use.
+
+    :param spatial: also check out the Spatial Analyst extension (once).
+    '''
+
+    global _spatial
+    import arcpy
+    if spatial and not _spatial:
+        arcpy.CheckOutExtension("Spatial")
+        _spatial = True
+
+    return arcpy
+
+
+def addmessage(message):
+    '''Tool message when arcpy is loaded, else printed.'''
+
+    if in_arcgis():
+        sys.modules['arcpy'].AddMessage(message)
+    else:
+        print(message)
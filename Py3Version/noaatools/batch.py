@@ -0,0 +1,324 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Run the toolbox scripts headless, many jobs at a time.
+
+The scripts take their inputs by position, as the .tbx dialogs pass
+them. get_parameter serves those positions from a batch job when the
+script runs under this runner, and from arcpy.GetParameterAsText
+otherwise, so the dialogs keep working unchanged as thin wrappers.
+
+A run expands the given parameters into jobs (years x variables for
+stage 1, variables for 2a-2c) and runs them on one process pool whose
+size is the global concurrency limit. The outputs of 2a-2c are named by
+variable and date only, so several shapefiles run one after the other,
+each as its own stage. So do the variables of 2c on its split-shapefile
+path, which keep their temporary files in the root folder:
+
+    python -m noaatools.batch --processes 4 netcdf --inputpath D:/noaa --startyear 1900 --endyear 1950 --variables prate,air
+    python -m noaatools.batch --processes 4 polygons --root D:/noaa --pgshp nuts2.shp;nuts3.shp --pgvf NUTS_ID --pgsf CNTR_CODE
+    python -m noaatools.batch --processes 4 --jobs run.json
+
+A jobs file is a list of stages run one after the other, each a tool
+with its parameters, e.g.
+
+    [{"tool": "netcdf", "inputpath": "D:/noaa", "startyear": 1900, "endyear": 1950},
+     {"tool": "points", "root": "D:/noaa", "ptshp": "D:/points.shp", "ptvf": "ID", "ptprocesses": "2"},
+     {"tool": "merge", "path": "D:/noaa", "ptcsv": "points.csv", "layout": "long"}]
+"""
+
+import argparse
+import importlib.util
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from . import shapes, variables as noaavariables
+
+
+# Script and positional parameters of each tool, as in the .tbx.
+TOOLS = OrderedDict([
+    ('netcdf', ('1_NetCDFtoGeotiff.py', ['inputpath', 'startyear', 'endyear', 'variables', 'shard',
+                                         'engine'])),
+    ('points', ('2a_Calculate_Statistics_Pt_SHP.py', ['root', 'ptshp', 'ptinter', 'variables', 'shard',
+                                                      'ptprocesses', 'ptvf', 'ptblock', 'inputpath'])),
+    ('convert', ('2b_Convert_SHP_CSV.py', ['root', 'ptshp', 'ptvf', 'delshp', 'variables'])),
+    ('polygons', ('2c_Calculate_Statistics_Pg_SHP.py', ['root', 'pgshp', 'pgvf', 'pgsf', 'variables',
+                                                        'pgsupersample', 'inputpath', 'shard'])),
+    ('merge', ('3_Merge_CSVs.py', ['path', 'ptcsv', 'pgcsv', 'layout'])),
+])
+
+# Parameters a run is split on: one job per value.
+SPLITPARAMETERS = ('variables',)
+
+# Parameters a run is split on into stages run in order: the jobs of two
+# shapefiles would write the same outputs and dependency records.
+STAGEPARAMETERS = ('ptshp', 'pgshp')
+
+SCRIPTPATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+################ 1. Tool parameters.
+
+# Positional parameters of the job running in this process, if any.
+_parameters = None
+
+
+def in_batch():
+    '''True when the script runs as a batch job rather than from a dialog.'''
+
+    return _parameters is not None
+
+
+def get_parameter(index):
+    '''
+    Tool parameter by position: from the batch job when running under
+    this runner, else from the ArcGIS dialog (arcpy.GetParameterAsText).
+    Parameters the .tbx does not define (the variables, shard, worker
+    and NetCDF parameters added after it was made) are empty in the
+    dialog, as they are when a job leaves them out.
+    '''
+
+    if _parameters is not None:
+        return _parameters[index] if index < len(_parameters) else ""
+
+    import arcpy
+    if index >= arcpy.GetArgumentCount():
+        return ""
+    return arcpy.GetParameterAsText(index)
+
+
+def get_flag(index):
+    '''Boolean tool parameter (a checkbox arrives as "true"/"false").'''
+
+    return get_parameter(index).strip().lower() in ('true', '1', 'yes')
+
+
+################ 2. Jobs.
+
+class Job(object):
+    '''
+    One run of a toolbox script.
+
+    :param tool: key of TOOLS, e.g. "netcdf".
+    :param parameters: dict of parameter name -> value (missing ones are empty).
+    '''
+
+    def __init__(self, tool, parameters):
+
+        if tool not in TOOLS:
+            raise ValueError("Unknown tool {} (one of {})".format(tool, ', '.join(TOOLS)))
+        unknown = set(parameters) - set(TOOLS[tool][1])
+        if unknown:
+            raise ValueError("Unknown parameters for {}: {}".format(tool, ', '.join(sorted(unknown))))
+
+        self.tool = tool
+        self.parameters = parameters
+
+    def get_arguments(self):
+        '''Parameter values in tool order, as text.'''
+
+        return ['' if self.parameters.get(name) is None else str(self.parameters[name])
+                for name in TOOLS[self.tool][1]]
+
+    def __repr__(self):
+
+        return '{} {}'.format(self.tool, ' '.join('{}={}'.format(name, value) for name, value
+                                                  in sorted(self.parameters.items()) if value not in (None, '')))
+
+
+def split_values(value):
+    '''A list parameter: a list, or text separated by ";" (as the dialogs pass it) or ",".'''
+
+    if isinstance(value, (list, tuple)):
+        return [str(item) for item in value]
+
+    return [item.strip().strip("'") for item in str(value).replace(',', ';').split(';') if item.strip()]
+
+
+def expand_jobs(tool, parameters):
+    '''
+    Split a run into independent jobs: one per year (stage 1, when
+    start and end year are given) and per variable (not for 2a and 2c
+    reading the NetCDF files).
+
+    :return: list of Job.
+    '''
+
+    jobs = [dict(parameters)]
+    if tool == 'netcdf' and parameters.get('startyear') and parameters.get('endyear'):
+        jobs = [dict(job, startyear=year, endyear=year) for job in jobs
+                for year in range(int(parameters['startyear']), int(parameters['endyear']) + 1)]
+
+    for name in SPLITPARAMETERS:
+        # 2a and 2c with a NetCDF folder share their weights across the
+        # variables in one pass, so they run as one job.
+        if tool in ('points', 'polygons') and parameters.get('inputpath'):
+            continue
+        if name in TOOLS[tool][1] and tool != 'merge' and parameters.get(name):
+            values = split_values(parameters[name])
+            if name == 'variables':
+                values = [variable.get_spec() for variable in noaavariables.parse_variables(';'.join(values))]
+            jobs = [dict(job, **{name: value}) for job in jobs for value in values]
+
+    return [Job(tool, job) for job in jobs]
+
+
+def shares_workspace(tool, parameters):
+    '''
+    True for a 2c run on the split-shapefile path (no NetCDF folder, and
+    no lat/lon shapefile with a split field to group in memory): its
+    resampled raster, temporary tables and split shapefiles are written
+    in the root folder under the same names for every variable.
+    '''
+
+    if tool != 'polygons' or parameters.get('inputpath'):
+        return False
+    pgshp, pgsf = parameters.get('pgshp'), parameters.get('pgsf')
+
+    return not (pgshp and pgsf and shapes.is_geographic(str(pgshp)))
+
+
+def expand_stages(tool, parameters):
+    '''
+    Split a run over several shapefiles into one stage per shapefile,
+    and a 2c run that shares its workspace into one stage per variable.
+
+    :return: list of (tool, parameters).
+    '''
+
+    stages = [dict(parameters)]
+    for name in STAGEPARAMETERS:
+        if name in TOOLS[tool][1] and parameters.get(name):
+            stages = [dict(stage, **{name: value}) for stage in stages
+                      for value in split_values(parameters[name])]
+
+    expanded = []
+    for stage in stages:
+        if shares_workspace(tool, stage):
+            variables = noaavariables.parse_variables(';'.join(split_values(stage.get('variables') or '')))
+            expanded.extend(dict(stage, variables=variable.get_spec()) for variable in variables)
+        else:
+            expanded.append(stage)
+
+    return [(tool, stage) for stage in expanded]
+
+
+def load_script(tool):
+    '''Import a toolbox script as a module (its names start with a digit).'''
+
+    scriptfile = os.path.join(SCRIPTPATH, TOOLS[tool][0])
+    if SCRIPTPATH not in sys.path:
+        sys.path.insert(0, SCRIPTPATH)
+    spec = importlib.util.spec_from_file_location('toolbox_' + tool, scriptfile)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    return module
+
+
+def run_job(tool, arguments):
+    '''
+    Run one job in this process: the script's main() with the job's
+    parameters.
+
+    :return: seconds, error (formatted traceback or None).
+    '''
+
+    global _parameters
+    started = time.time()
+    _parameters = arguments
+    try:
+        load_script(tool).main()
+        return time.time() - started, None
+    except (Exception, SystemExit):
+        return time.time() - started, traceback.format_exc()
+    finally:
+        _parameters = None
+
+
+def run_jobs(jobs, processes=1):
+    '''
+    Run jobs on one process pool of at most `processes` workers (inline
+    when 1). Scripts that start their own workers (the parallel mode of
+    2a) add those to the limit.
+
+    :return: generator of (job, seconds, error) as jobs finish.
+    '''
+
+    if processes <= 1 or len(jobs) <= 1:
+        for job in jobs:
+            seconds, error = run_job(job.tool, job.get_arguments())
+            yield job, seconds, error
+        return
+
+    # Inside ArcMap / ArcGIS Pro sys.executable is the application,
+    # which must not be started once per worker.
+    if os.name == 'nt' and not os.path.basename(sys.executable).lower().startswith('python'):
+        multiprocessing.set_executable(os.path.join(sys.exec_prefix, 'pythonw.exe'))
+
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = dict((pool.submit(run_job, job.tool, job.get_arguments()), job) for job in jobs)
+        for future in as_completed(futures):
+            seconds, error = future.result()
+            yield futures[future], seconds, error
+
+
+def run_stages(stages, processes=1, log=print):
+    '''
+    Run stages in order, the jobs of each stage in parallel; a stage
+    starts when the previous one has finished.
+
+    :param stages: list of (tool, parameters).
+    :return: number of failed jobs.
+    '''
+
+    failed = 0
+    stages = [stage for tool, parameters in stages for stage in expand_stages(tool, parameters)]
+    for tool, parameters in stages:
+        jobs = expand_jobs(tool, parameters)
+        log('{}: {} jobs on {} processes'.format(tool, len(jobs), min(processes, len(jobs))))
+        for job, seconds, error in run_jobs(jobs, processes):
+            if error is None:
+                log('Done {} ({:.1f} s)'.format(job, seconds))
+            else:
+                failed += 1
+                log('Failed {} ({:.1f} s)\n{}'.format(job, seconds, error))
+
+    return failed
+
+
+################ 3. Command line.
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(prog='python -m noaatools.batch', description=__doc__.split('\n')[0])
+    parser.add_argument('--processes', type=int, default=1, help='jobs run at the same time')
+    parser.add_argument('--jobs', help='JSON file with a list of stages ({"tool": ..., parameters})')
+    tools = parser.add_subparsers(dest='tool')
+    for tool, (scriptname, names) in TOOLS.items():
+        toolparser = tools.add_parser(tool, help=scriptname)
+        for name in names:
+            toolparser.add_argument('--' + name, default='')
+    args = parser.parse_args(argv)
+
+    if args.jobs:
+        with open(args.jobs) as f:
+            stages = [(stage.pop('tool'), stage) for stage in json.load(f)]
+    elif args.tool:
+        stages = [(args.tool, dict((name, getattr(args, name)) for name in TOOLS[args.tool][1]))]
+    else:
+        parser.error('give a tool or --jobs')
+
+    sys.exit(1 if run_stages(stages, args.processes) else 0)
+
+
+if __name__ == '__main__':
+    # Run the imported module, not __main__, so that the scripts and
+    # the pool workers see the same job parameters.
+    from noaatools.batch import main
+    main()
@@ -0,0 +1,151 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Band-level checkpoints for stage 1, so a failed year resumes mid-year.
+
+Each year's output folder holds a small checkpoint.json. It records the
+NetCDF file it was made from (size and modification time), the settings
+that change the rasters, the number of bands, and the name, size and
+CRC-32 of every band written so far, in band order:
+
+    {"input": "prate.1900.nc", "inputsize": ..., "inputmtime": ...,
+     "parameters": {"engine": "arcpy", ...}, "nbands": 365,
+     "outputs": [["prate_1900_1_1.tif", 210644, 3735928559], ...]}
+
+A band is committed only after its tif has been written, and the file
+is replaced atomically, so after a crash (a license drop, a full disk,
+an arcpy exception) it lists exactly the bands that finished. A restart
+checks the last committed outputs against their checksums, drops any
+that no longer match, and continues from the first band missing.
+"""
+
+import json
+import os
+import zlib
+
+
+CHECKPOINTFILE = 'checkpoint.json'
+
+
+def get_fingerprint(path):
+    '''Size and modification time (ns) of a file, to notice a replaced input.'''
+
+    stat = os.stat(path)
+
+    return stat.st_size, stat.st_mtime_ns
+
+
+def get_checksum(path, chunksize=1 << 20):
+    '''CRC-32 of a file, read in chunks.'''
+
+    checksum = 0
+    with open(path, 'rb') as f:
+        chunk = f.read(chunksize)
+        while chunk:
+            checksum = zlib.crc32(chunk, checksum)
+            chunk = f.read(chunksize)
+
+    return checksum
+
+
+class BandCheckpoint(object):
+    '''
+    Checkpoint of the bands of one NetCDF year.
+
+    :param outputpath: output folder of the year (checkpoint.json goes there).
+    :param inputfilepath: the year's NetCDF file.
+    :param parameters: settings that change the rasters (e.g. the engine
+                       and resample cell size); other settings than the
+                       checkpoint's start the year over.
+    '''
+
+    def __init__(self, outputpath, inputfilepath, parameters=None):
+
+        self.outputpath = outputpath
+        self.checkpointfile = os.path.join(outputpath, CHECKPOINTFILE)
+        self.inputfilepath = inputfilepath
+        self.inputsize, self.inputmtime = get_fingerprint(inputfilepath)
+        self.parameters = dict((name, str(value)) for name, value in (parameters or {}).items())
+        self.nbands = None
+        self.outputs = []
+
+        if os.path.exists(self.checkpointfile):
+            with open(self.checkpointfile) as f:
+                checkpoint = json.load(f)
+            # A replaced NetCDF file or other settings start the year over.
+            if (checkpoint['input'] == os.path.basename(inputfilepath) and
+                    checkpoint['inputsize'] == self.inputsize and checkpoint['inputmtime'] == self.inputmtime and
+                    checkpoint.get('parameters', {}) == self.parameters):
+                self.nbands = checkpoint['nbands']
+                self.outputs = [tuple(output) for output in checkpoint['outputs']]
+
+    @property
+    def committed(self):
+        '''Number of bands written, i.e. the first band still to export.'''
+
+        return len(self.outputs)
+
+    def is_complete(self):
+        '''True when every band of the year was committed from the current input.'''
+
+        return self.nbands is not None and self.committed == self.nbands
+
+    def verify_output(self, index):
+        '''True when committed output `index` is on disk with its recorded size and checksum.'''
+
+        name, size, checksum = self.outputs[index]
+        outputfile = os.path.join(self.outputpath, name)
+
+        return (os.path.exists(outputfile) and os.path.getsize(outputfile) == size and
+                get_checksum(outputfile) == checksum)
+
+    def resume(self, nbands, verify=1):
+        '''
+        Start (or continue) the year: check the last `verify` committed
+        outputs, walking further back past any that fail, and drop those
+        from the checkpoint so they are written again.
+
+        :param nbands: number of bands of the year.
+        :return: first band to export (0 for a fresh year, nbands when done).
+        '''
+
+        if self.nbands != nbands:
+            self.outputs = []
+        self.nbands = nbands
+
+        index, checked = self.committed - 1, 0
+        while index >= 0 and checked < verify:
+            if self.verify_output(index):
+                checked += 1
+            else:
+                del self.outputs[index:]
+                checked = 0
+            index -= 1
+        self.write()
+
+        return self.committed
+
+    def commit(self, band, outputfile):
+        '''
+        Record that `band` has been written to outputfile. Bands are
+        committed in order.
+        '''
+
+        if band != self.committed:
+            raise ValueError("Band {} committed after band {}".format(band, self.committed - 1))
+
+        self.outputs.append((os.path.basename(outputfile), os.path.getsize(outputfile),
+                             get_checksum(outputfile)))
+        self.write()
+
+    def write(self):
+        '''Write checkpoint.json atomically.'''
+
+        checkpoint = {'input': os.path.basename(self.inputfilepath),
+                      'inputsize': self.inputsize,
+                      'inputmtime': self.inputmtime,
+                      'parameters': self.parameters,
+                      'nbands': self.nbands,
+                      'outputs': [list(output) for output in self.outputs]}
+        with open(self.checkpointfile + '.part', 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(self.checkpointfile + '.part', self.checkpointfile)
@@ -0,0 +1,225 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Streaming day-of-year climatologies and anomalies.
+
+Years are folded in one at a time with Welford updates, so memory is
+366 x grid (or 366 x features) however many years are processed.
+"""
+
+import numpy
+
+from . import cube
+
+
+################ 1. Day-of-year helpers.
+
+DAYSINYEAR = 366
+
+# Cumulative days before each month in a leap year.
+# Day-of-year is always counted on the leap calendar so that
+# March 1 has the same index in every year and Feb 29 gets its own slot.
+_LEAPMONTHSTART = numpy.cumsum([0, 31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30])
+
+
+def get_dayofyear(dates):
+    '''
+    Zero-based day-of-year on the leap calendar (0..365).
+
+    :param dates: datetime64 array.
+    :return: int array of the same length.
+    '''
+
+    dates = numpy.asarray(dates, dtype='datetime64[D]')
+    months = dates.astype('datetime64[M]')
+    monthindex = months.astype(int) % 12
+    dayofmonth = (dates - months).astype(int)
+
+    return _LEAPMONTHSTART[monthindex] + dayofmonth
+
+
+def get_years(dates):
+    '''Calendar year of each datetime64 date.'''
+
+    return numpy.asarray(dates, dtype='datetime64[Y]').astype(int) + 1970
+
+
+def smooth_circular(values, halfwindow):
+    '''
+    Running mean over the day-of-year axis (axis 0), wrapping
+    December into January. NaN days (e.g. Feb 29 without data) are
+    left out of the windows they fall in; a window without any valid
+    day is NaN.
+
+    :param values: (366, ...) array.
+    :param halfwindow: days on each side; 0 leaves values unchanged.
+    '''
+
+    if not halfwindow:
+        return values
+
+    padded = numpy.concatenate([values[-halfwindow:], values, values[:halfwindow]])
+    valid = ~numpy.isnan(padded)
+    zeros = numpy.zeros((1,) + values.shape[1:])
+    running = numpy.concatenate([zeros, numpy.cumsum(numpy.where(valid, padded, 0.0), axis=0,
+                                                     dtype=numpy.float64)])
+    counts = numpy.concatenate([zeros, numpy.cumsum(valid, axis=0, dtype=numpy.float64)])
+    window = 2 * halfwindow + 1
+
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        return (running[window:] - running[:-window]) / (counts[window:] - counts[:-window])
+
+
+################ 2. Climatology builder.
+
+class ClimatologyBuilder(object):
+    '''
+    Accumulate a day-of-year mean and variance per cell or feature.
+
+    Feed it (values, dates) one year at a time with update(); values
+    has time on axis 0 and any grid or feature shape after that.
+    NaNs are skipped cell by cell.
+    '''
+
+    def __init__(self, shape, baseperiod=(1981, 2010)):
+
+        self.shape = tuple(shape)
+        self.baseperiod = baseperiod
+        self.count = numpy.zeros((DAYSINYEAR,) + self.shape, dtype=numpy.int32)
+        self.mean = numpy.zeros((DAYSINYEAR,) + self.shape, dtype=numpy.float64)
+        self.m2 = numpy.zeros((DAYSINYEAR,) + self.shape, dtype=numpy.float64)
+
+    def update(self, values, dates):
+        '''
+        Fold one block of days into the running statistics.
+
+        Dates outside the base period are ignored. Each day-of-year
+        may appear at most once per call, which holds for a year.
+        '''
+
+        dates = numpy.asarray(dates, dtype='datetime64[D]')
+        if self.baseperiod is not None:
+            years = get_years(dates)
+            inbase = (years >= self.baseperiod[0]) & (years <= self.baseperiod[1])
+            if not inbase.any():
+                return
+            if not inbase.all():
+                values, dates = values[inbase], dates[inbase]
+
+        doy = get_dayofyear(dates)
+        if len(numpy.unique(doy)) != len(doy):
+            raise ValueError("update() takes at most one value per day-of-year, pass one year at a time")
+
+        values = numpy.asarray(values, dtype=numpy.float64)
+        valid = ~numpy.isnan(values)
+
+        count = self.count[doy] + valid
+        delta = numpy.where(valid, values - self.mean[doy], 0.0)
+        mean = self.mean[doy] + delta / numpy.maximum(count, 1)
+        self.m2[doy] += delta * numpy.where(valid, values - mean, 0.0)
+        self.mean[doy] = mean
+        self.count[doy] = count
+
+    def finalize(self, smoothing=0):
+        '''
+        Return the climatology.
+
+        :param smoothing: half-width in days of a circular running
+                          mean applied to mean and variance.
+        :return: Climatology
+        '''
+
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            mean = numpy.where(self.count > 0, self.mean, numpy.nan)
+            variance = numpy.where(self.count > 1, self.m2 / (self.count - 1), numpy.nan)
+
+        return Climatology(smooth_circular(mean, smoothing),
+                           smooth_circular(variance, smoothing),
+                           self.count.copy(), self.baseperiod)
+
+
+class Climatology(object):
+    '''Day-of-year mean, variance and sample count arrays of shape (366, ...).'''
+
+    def __init__(self, mean, variance, count, baseperiod=None):
+
+        self.mean = mean
+        self.variance = variance
+        self.count = count
+        self.baseperiod = baseperiod
+
+    def anomalies(self, values, dates, standardize=False):
+        '''
+        Daily anomalies of a block of days against the climatology.
+
+        :param standardize: divide by the day-of-year standard deviation.
+        '''
+
+        doy = get_dayofyear(dates)
+        anomaly = numpy.asarray(values, dtype=numpy.float32) - self.mean[doy]
+        if standardize:
+            with numpy.errstate(invalid='ignore', divide='ignore'):
+                anomaly /= numpy.sqrt(self.variance[doy])
+
+        return anomaly.astype(numpy.float32)
+
+    def save(self, path):
+        '''Save as a .npz archive.'''
+
+        numpy.savez(path, mean=self.mean, variance=self.variance, count=self.count,
+                    baseperiod=numpy.asarray(self.baseperiod or (0, 0)))
+
+    @classmethod
+    def load(cls, path):
+        '''Load a climatology written by save().'''
+
+        archive = numpy.load(path)
+        baseperiod = tuple(int(year) for year in archive['baseperiod'])
+
+        return cls(archive['mean'], archive['variance'], archive['count'],
+                   baseperiod if any(baseperiod) else None)
+
+
+################ 3. Streaming over yearly NetCDF files.
+
+def iter_yearcubes(listofnoaapaths, variable="prate", units=None):
+    '''
+    Yield (cube, dates) for each yearly file, reusing one buffer.
+
+    The yielded cube is overwritten by the next year, so copy
+    anything that has to outlive the loop iteration.
+    '''
+
+    buffer = None
+    for path in listofnoaapaths:
+        buffer, dates = cube.load_yearcube(path, variable, units, out=buffer)
+        yield buffer, dates
+
+
+def build_climatology(yearstream, baseperiod=(1981, 2010), smoothing=0):
+    '''
+    First pass: build a climatology from a stream of (values, dates).
+
+    :param yearstream: e.g. iter_yearcubes(paths, "prate", "mm/day"),
+                       or per-feature (days x features) blocks.
+    :return: Climatology
+    '''
+
+    builder = None
+    for values, dates in yearstream:
+        if builder is None:
+            builder = ClimatologyBuilder(values.shape[1:], baseperiod)
+        builder.update(values, dates)
+
+    if builder is None:
+        raise ValueError("No years to build a climatology from")
+
+    return builder.finalize(smoothing)
+
+
+def iter_anomalies(yearstream, climatology, standardize=False):
+    '''
+    Second pass: yield (anomalies, dates) for each block of the stream.
+    '''
+
+    for values, dates in yearstream:
+        yield climatology.anomalies(values, dates, standardize), dates
@@ -0,0 +1,312 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Compression codecs, predictors and quantization for output files.
+
+Codes follow the TIFF Compression and Predictor tags so the same
+functions serve the GeoTIFF writer and the binary result files.
+"""
+
+import zlib
+
+import numpy
+
+
+################ 1. Codecs.
+
+# TIFF Compression tag values.
+COMPRESSIONS = {'none': 1, 'lzw': 5, 'deflate': 8, 'zstd': 50000}
+
+# TIFF Predictor tag values.
+NOPREDICTOR, HORIZONTAL, FLOATINGPOINT = 1, 2, 3
+
+
+def get_zstd():
+    '''
+    Zstd is optional and only needs the zstandard package when used.
+    '''
+
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("Zstd compression requires the zstandard package")
+
+    return zstandard
+
+
+def compress(data, compression="deflate", level=6):
+    '''
+    Compress a bytes block.
+
+    :param compression: "none", "deflate", "lzw" or "zstd".
+    :param level: deflate/zstd level (lzw has none).
+    '''
+
+    if compression == "none":
+        return bytes(data)
+    if compression == "deflate":
+        return zlib.compress(data, level)
+    if compression == "lzw":
+        return lzw_encode(bytes(data))
+    if compression == "zstd":
+        return get_zstd().ZstdCompressor(level=level).compress(data)
+
+    raise ValueError("Unknown compression {!r}, use one of {}".format(compression, sorted(COMPRESSIONS)))
+
+
+def decompress(data, compression="deflate"):
+    '''Inverse of compress().'''
+
+    if compression == "none":
+        return bytes(data)
+    if compression == "deflate":
+        return zlib.decompress(data)
+    if compression == "lzw":
+        return lzw_decode(bytes(data))
+    if compression == "zstd":
+        return get_zstd().ZstdDecompressor().decompress(data)
+
+    raise ValueError("Unknown compression {!r}, use one of {}".format(compression, sorted(COMPRESSIONS)))
+
+
+################ 2. TIFF LZW.
+
+_CLEAR, _EOI, _FIRSTCODE, _MAXCODE = 256, 257, 258, 4094
+
+
+def lzw_encode(data):
+    '''
+    TIFF flavoured LZW (MSB-first codes, 9 to 12 bits, early change).
+
+    Pure Python, so it holds the GIL; prefer deflate or zstd when
+    writing on a thread pool.
+    '''
+
+    out = bytearray()
+    bitbuffer, bitcount = 0, 0
+
+    def put(code, width):
+        nonlocal bitbuffer, bitcount
+        bitbuffer = (bitbuffer << width) | code
+        bitcount += width
+        while bitcount >= 8:
+            bitcount -= 8
+            out.append((bitbuffer >> bitcount) & 0xFF)
+        bitbuffer &= (1 << bitcount) - 1
+
+    width = 9
+    put(_CLEAR, width)
+    table, nextcode = {}, _FIRSTCODE
+    prefix = None
+
+    for byte in data:
+        if prefix is None:
+            prefix = byte
+            continue
+        key = (prefix << 8) | byte
+        code = table.get(key)
+        if code is not None:
+            prefix = code
+            continue
+
+        put(prefix, width)
+        table[key] = nextcode
+        nextcode += 1
+        if nextcode == _MAXCODE:
+            put(_CLEAR, width)
+            table, nextcode, width = {}, _FIRSTCODE, 9
+        elif nextcode > (1 << width) - 1:
+            width += 1
+        prefix = byte
+
+    if prefix is not None:
+        put(prefix, width)
+        nextcode += 1
+        if nextcode == _MAXCODE:
+            put(_CLEAR, width)
+            width = 9
+        elif nextcode > (1 << width) - 1:
+            width += 1
+    put(_EOI, width)
+    if bitcount:
+        out.append((bitbuffer << (8 - bitcount)) & 0xFF)
+
+    return bytes(out)
+
+
+def lzw_decode(data):
+    '''Decode TIFF LZW data written by lzw_encode or libtiff.'''
+
+    out = bytearray()
+    position, nbits = 0, len(data) * 8
+    data = data + b'\0\0\0'
+    width = 9
+    table = [bytes([i]) for i in range(256)] + [b'', b'']
+    previous = None
+
+    def get(width):
+        nonlocal position
+        if position + width > nbits:
+            return _EOI
+        byteindex = position >> 3
+        chunk = int.from_bytes(data[byteindex:byteindex + 3], 'big')
+        code = (chunk >> (24 - (position & 7) - width)) & ((1 << width) - 1)
+        position += width
+        return code
+
+    while True:
+        code = get(width)
+        if code == _EOI:
+            break
+        if code == _CLEAR:
+            table = table[:_FIRSTCODE]
+            width = 9
+            code = get(width)
+            if code == _EOI:
+                break
+            out += table[code]
+            previous = code
+            continue
+
+        if code < len(table):
+            entry = table[code]
+            table.append(table[previous] + entry[:1])
+        else:
+            entry = table[previous] + table[previous][:1]
+            table.append(entry)
+        out += entry
+        previous = code
+
+        if len(table) == 511:
+            width = 10
+        elif len(table) == 1023:
+            width = 11
+        elif len(table) == 2047:
+            width = 12
+
+    return bytes(out)
+
+
+################ 3. Predictors.
+
+def apply_predictor(block, predictor):
+    '''
+    TIFF horizontal predictors on a (rows, columns) block.
+
+    HORIZONTAL differences neighbouring integer samples along each row;
+    FLOATINGPOINT splits each row of floats into big-endian byte planes
+    and differences the bytes, which compresses smooth fields well.
+
+    :return: bytes ready for compress().
+    '''
+
+    block = numpy.ascontiguousarray(block)
+    if predictor == NOPREDICTOR:
+        return block.tobytes()
+
+    if predictor == HORIZONTAL:
+        if block.dtype.kind not in 'iu':
+            raise ValueError("The horizontal predictor needs integer samples")
+        differenced = block.copy()
+        differenced[:, 1:] -= block[:, :-1]
+        return differenced.tobytes()
+
+    if predictor == FLOATINGPOINT:
+        rows, columns = block.shape
+        itemsize = block.dtype.itemsize
+        planes = block.astype(block.dtype.newbyteorder('>')).view(numpy.uint8)
+        planes = planes.reshape(rows, columns, itemsize).transpose(0, 2, 1).reshape(rows, -1)
+        differenced = planes.copy()
+        differenced[:, 1:] -= planes[:, :-1]
+        return differenced.tobytes()
+
+    raise ValueError("Unknown predictor {}".format(predictor))
+
+
+def undo_predictor(data, dtype, shape, predictor):
+    '''
+    Inverse of apply_predictor.
+
+    :param data: decompressed bytes.
+    :param dtype: native sample dtype.
+    :param shape: (rows, columns) of the block.
+    '''
+
+    dtype = numpy.dtype(dtype)
+    rows, columns = shape
+
+    if predictor == NOPREDICTOR:
+        return numpy.frombuffer(data, dtype=dtype).reshape(shape).copy()
+
+    if predictor == HORIZONTAL:
+        differenced = numpy.frombuffer(data, dtype=dtype).reshape(shape)
+        return numpy.cumsum(differenced, axis=1, dtype=dtype)
+
+    if predictor == FLOATINGPOINT:
+        differenced = numpy.frombuffer(data, dtype=numpy.uint8).reshape(rows, -1)
+        planes = numpy.cumsum(differenced, axis=1, dtype=numpy.uint8)
+        planes = planes.reshape(rows, dtype.itemsize, columns).transpose(0, 2, 1)
+        values = numpy.ascontiguousarray(planes).view(dtype.newbyteorder('>')).reshape(shape)
+        return values.astype(dtype)
+
+    raise ValueError("Unknown predictor {}".format(predictor))
+
+
+def get_predictor(dtype):
+    '''Best predictor for a sample type.'''
+
+    return HORIZONTAL if numpy.dtype(dtype).kind in 'iu' else FLOATINGPOINT
+
+
+################ 4. Precision-bounded quantization.
+
+def quantize(values, precision, missing_value=-32768):
+    '''
+    Store floats as scaled int16 to a fixed precision.
+
+    values ~= packed * scale_factor + add_offset with an absolute error
+    of at most precision / 2 (plus float32 rounding once unpacked).
+    NaN becomes missing_value. Falls back to
+    int32 when the range does not fit in int16 at this precision.
+
+    :param values: float array.
+    :param precision: quantization step, e.g. 0.01 for mm/day.
+    :return: packed array, attributes dict (scale_factor, add_offset,
+             missing_value, errorbound).
+    '''
+
+    values = numpy.asarray(values)
+    valid = ~numpy.isnan(values)
+    if valid.any():
+        low, high = float(values[valid].min()), float(values[valid].max())
+    else:
+        low = high = 0.0
+
+    # Centre the range on zero, on a multiple of the precision.
+    add_offset = round((low + high) / 2.0 / precision) * precision
+    steps = max(abs(high - add_offset), abs(low - add_offset)) / precision
+
+    dtype = numpy.int16
+    if steps > 32766:
+        dtype, missing_value = numpy.int32, -2147483648
+        if steps > 2147483646:
+            raise ValueError("Precision {} is too fine for the range {} .. {}".format(precision, low, high))
+
+    packed = numpy.full(values.shape, missing_value, dtype=dtype)
+    packed[valid] = numpy.rint((values[valid] - add_offset) / precision)
+
+    attributes = {'scale_factor': precision,
+                  'add_offset': add_offset,
+                  'missing_value': missing_value,
+                  'errorbound': precision / 2.0}
+
+    return packed, attributes
+
+
+def dequantize(packed, attributes, dtype=numpy.float32):
+    '''Inverse of quantize(); missing values become NaN.'''
+
+    values = packed.astype(dtype) * dtype(attributes['scale_factor']) + dtype(attributes['add_offset'])
+    if attributes.get('missing_value') is not None:
+        values[packed == attributes['missing_value']] = numpy.nan
+
+    return values
@@ -0,0 +1,207 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Load yearly NOAA Reanalysis NetCDF variables into float32 cubes."""
+
+import numpy
+
+from .packed import PackedArray
+
+
+################ 1. Unit conversions.
+
+# Multipliers from the native NOAA units to the units users ask for.
+# PRATE is stored in kg m-2 s-1, which equals mm/s of water.
+UNITMULTIPLIERS = {'native': 1.0,
+                   'kg/m^2/s': 1.0,
+                   'mm/s': 1.0,
+                   'mm/hour': 3600.0,
+                   'mm/day': 86400.0}
+
+
+def get_unitmultiplier(units):
+    '''
+    Turn a unit name (or a plain number) into a multiplier
+    applied on top of the NetCDF scale_factor/add_offset.
+
+    :param units: None, a key of UNITMULTIPLIERS or a number.
+    :return: multiplier as a float.
+    '''
+
+    if units is None or units == "":
+        return 1.0
+
+    if isinstance(units, (int, float)):
+        return float(units)
+
+    try:
+        return UNITMULTIPLIERS[units]
+    except KeyError:
+        try:
+            return float(units)
+        except ValueError:
+            raise ValueError("Unknown units {!r}, use one of {} or a number".format(
+                units, sorted(UNITMULTIPLIERS)))
+
+
+################ 2. Fused unpacking.
+
+def unpack_inplace(packed,
+                   scale_factor=1.0,
+                   add_offset=0.0,
+                   multiplier=1.0,
+                   missing_value=None,
+                   out=None,
+                   blockbands=16):
+    '''
+    Unpack a packed int16 cube, convert units and cast to float32
+    in one pass over the data.
+
+    scale_factor, add_offset and the unit multiplier are folded into a
+    single float32 slope and intercept, and the cube is processed a
+    few bands at a time so each block stays in cache between the
+    multiply and the add. No float64 copy of the cube is ever made.
+
+    :param packed: (time, lat, lon) integer array.
+    :param scale_factor, add_offset: NetCDF packing attributes.
+    :param multiplier: unit conversion, see get_unitmultiplier.
+    :param missing_value: packed value to turn into NaN.
+    :param out: optional float32 array with the shape of packed.
+    :param blockbands: number of bands unpacked per block.
+    :return: float32 cube.
+    '''
+
+    if out is None:
+        out = numpy.empty(packed.shape, dtype=numpy.float32)
+    elif out.shape != packed.shape or out.dtype != numpy.float32:
+        raise ValueError("out must be a float32 array of shape {}".format(packed.shape))
+
+    slope = numpy.float32(scale_factor * multiplier)
+    intercept = numpy.float32(add_offset * multiplier)
+
+    for start in range(0, packed.shape[0], blockbands):
+        block = slice(start, start + blockbands)
+        numpy.multiply(packed[block], slope, out=out[block], dtype=numpy.float32)
+        if intercept:
+            out[block] += intercept
+        if missing_value is not None:
+            out[block][packed[block] == missing_value] = numpy.nan
+
+    return out
+
+
+################ 3. Reading NetCDF files.
+
+def get_netcdf4():
+    '''
+    Import the netCDF4 package.
+
+    netCDF4 is only needed for the pure NumPy path, so it is
+    imported here rather than at module level.
+    '''
+
+    try:
+        import netCDF4
+    except ImportError:
+        raise ImportError("Reading NetCDF files without arcpy requires the netCDF4 package")
+
+    return netCDF4
+
+
+def open_netcdf(path):
+    '''Open a NetCDF file with the netCDF4 package.'''
+
+    return get_netcdf4().Dataset(path, 'r')
+
+
+def get_packing(variable):
+    '''
+    Read the packing attributes of a NetCDF variable.
+
+    :param variable: netCDF4 variable.
+    :return: scale_factor, add_offset, missing_value
+    '''
+
+    attributes = variable.ncattrs()
+    scale_factor = float(variable.getncattr('scale_factor')) if 'scale_factor' in attributes else 1.0
+    add_offset = float(variable.getncattr('add_offset')) if 'add_offset' in attributes else 0.0
+
+    missing_value = None
+    for name in ('missing_value', '_FillValue'):
+        if name in attributes:
+            missing_value = numpy.asarray(variable.getncattr(name)).ravel()[0]
+            break
+
+    return scale_factor, add_offset, missing_value
+
+
+def read_dates(dataset, dimension_type="time"):
+    '''
+    Convert the time axis of a NetCDF file to datetime64[D].
+
+    :param dataset: open netCDF4 dataset.
+    :return: array of dates, one per band.
+    '''
+
+    import netCDF4
+
+    timevariable = dataset.variables[dimension_type]
+    dates = netCDF4.num2date(timevariable[:], timevariable.units,
+                             getattr(timevariable, 'calendar', 'standard'))
+
+    return numpy.array([d.strftime('%Y-%m-%d') for d in dates], dtype='datetime64[D]')
+
+
+def load_yearcube(path,
+                  variable="prate",
+                  units=None,
+                  out=None,
+                  blockbands=16,
+                  window=None,
+                  packed=False):
+    '''
+    Load one yearly NetCDF variable as a float32 (time, lat, lon) cube.
+
+    The packed int16 values are read a block of bands at a time with
+    netCDF4's own scaling switched off, and unpacked straight into the
+    float32 output by unpack_inplace.
+
+    :param path: path of the yearly NetCDF file, e.g. prate.1900.nc
+    :param variable: NetCDF variable name.
+    :param units: unit conversion, e.g. "mm/day" (see get_unitmultiplier).
+    :param out: optional preallocated float32 cube to reuse across years.
+    :param window: optional grid.Window; only that lat/lon hyperslab is read.
+    :param packed: keep the stored integers and return a PackedArray
+                   whose transform includes the unit conversion.
+    :return: cube, dates
+    '''
+
+    multiplier = get_unitmultiplier(units)
+
+    dataset = open_netcdf(path)
+    try:
+        ncvariable = dataset.variables[variable]
+        ncvariable.set_auto_maskandscale(False)
+        scale_factor, add_offset, missing_value = get_packing(ncvariable)
+
+        shape = ncvariable.shape if window is None else (ncvariable.shape[0],) + window.shape
+
+        if packed:
+            data = ncvariable[:] if window is None else window.read(ncvariable)
+            dates = read_dates(dataset)
+            return PackedArray(data, scale_factor * multiplier, add_offset * multiplier,
+                               missing_value), dates
+
+        if out is None or out.shape != shape:
+            out = numpy.empty(shape, dtype=numpy.float32)
+
+        for start in range(0, ncvariable.shape[0], blockbands):
+            block = slice(start, start + blockbands)
+            raw = ncvariable[block] if window is None else window.read(ncvariable, block)
+            unpack_inplace(raw, scale_factor, add_offset, multiplier,
+                           missing_value, out=out[block], blockbands=blockbands)
+
+        dates = read_dates(dataset)
+    finally:
+        dataset.close()
+
+    return out, dates
@@ -0,0 +1,191 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Read and write the dBASE (.dbf) tables of shapefiles with NumPy.
+
+A .dbf is a header followed by fixed-width text records, so the records
+map directly onto a NumPy structured array with one bytes field per
+column. Reading a column is a slice of that (memory-mapped) array plus
+one vectorized conversion, instead of a cursor or a chain of field
+tools.
+"""
+
+import datetime
+import struct
+
+import numpy
+
+
+################ 1. Reading.
+
+class DbfField(object):
+    '''
+    One column of a .dbf.
+
+    :param name: field name (at most 10 characters).
+    :param fieldtype: 'C' text, 'N'/'F' number, 'L' logical, 'D' date.
+    :param length: width of the field in bytes.
+    :param decimals: decimals of a number field.
+    '''
+
+    def __init__(self, name, fieldtype, length, decimals=0):
+
+        self.name = name
+        self.fieldtype = fieldtype
+        self.length = length
+        self.decimals = decimals
+
+    def __repr__(self):
+
+        return 'DbfField({!r}, {!r}, {}, {})'.format(self.name, self.fieldtype, self.length, self.decimals)
+
+
+def read_dbfheader(inputfile):
+    '''
+    Parse the header of a .dbf.
+
+    :return: number of records, header length, record length, list of DbfField.
+    '''
+
+    with open(inputfile, 'rb') as f:
+        nrecords, headerlength, recordlength = struct.unpack('<xxxxIHH20x', f.read(32))
+        fields = []
+        while True:
+            descriptor = f.read(32)
+            if not descriptor or descriptor[0:1] == b'\r':
+                break
+            name = descriptor[:11].split(b'\0')[0].decode('latin-1')
+            fields.append(DbfField(name, descriptor[11:12].decode('latin-1'), descriptor[16],
+                                   descriptor[17]))
+
+    return nrecords, headerlength, recordlength, fields
+
+
+def get_recorddtype(fields, recordlength=None):
+    '''Structured dtype of a record: the deletion flag, then one bytes field per column.'''
+
+    dtype = numpy.dtype([('_deleted', 'S1')] + [(field.name, 'S{}'.format(field.length))
+                                                for field in fields])
+    if recordlength is not None and recordlength != dtype.itemsize:
+        dtype = numpy.dtype({'names': dtype.names,
+                             'formats': [dtype.fields[name][0] for name in dtype.names],
+                             'offsets': [dtype.fields[name][1] for name in dtype.names],
+                             'itemsize': recordlength})
+
+    return dtype
+
+
+def read_dbf(inputfile, mmap=True):
+    '''
+    Map the records of a .dbf into a structured array of raw bytes
+    fields (see get_column to convert them).
+
+    :param mmap: memory-map the file instead of reading it.
+    :return: records, list of DbfField.
+    '''
+
+    nrecords, headerlength, recordlength, fields = read_dbfheader(inputfile)
+    dtype = get_recorddtype(fields, recordlength)
+
+    if nrecords == 0:
+        return numpy.zeros(0, dtype=dtype), fields
+    if mmap:
+        records = numpy.memmap(inputfile, dtype=dtype, mode='r', offset=headerlength, shape=(nrecords,))
+    else:
+        with open(inputfile, 'rb') as f:
+            f.seek(headerlength)
+            records = numpy.frombuffer(f.read(nrecords * recordlength), dtype=dtype)
+
+    return records, fields
+
+
+def get_column(records, fields, name, skipdeleted=True):
+    '''
+    One column of the records as a vector: float64 for numbers (NaN
+    for blanks and overflow stars; int64 for whole-number fields
+    without blanks), str for text, bool for logicals,
+    datetime64[D] for dates.
+
+    :param name: field name, matched case-insensitively as ArcGIS does.
+    '''
+
+    field = next((field for field in fields if field.name.upper() == name.upper()), None)
+    if field is None:
+        raise KeyError("No field {} in the table".format(name))
+
+    if skipdeleted:
+        records = records[records['_deleted'] != b'*']
+    raw = numpy.char.strip(numpy.asarray(records[field.name]))
+
+    if field.fieldtype in 'NF':
+        blank = (raw == b'') | (numpy.char.find(raw, b'*') >= 0)
+        if field.decimals == 0 and not blank.any():
+            return raw.astype(numpy.int64)
+        return numpy.where(blank, b'nan', raw).astype(numpy.float64)
+    if field.fieldtype == 'L':
+        return numpy.isin(raw, [b'T', b't', b'Y', b'y'])
+    if field.fieldtype == 'D':
+        dates = numpy.full(len(raw), numpy.datetime64('NaT'), dtype='datetime64[D]')
+        valid = numpy.char.str_len(raw) == 8
+        if valid.any():
+            text = raw[valid].astype('U8')
+            dates[valid] = numpy.array([text[i][:4] + '-' + text[i][4:6] + '-' + text[i][6:]
+                                        for i in range(len(text))], dtype='datetime64[D]')
+        return dates
+
+    return numpy.char.decode(raw, 'latin-1')
+
+
+################ 2. Writing.
+
+def format_column(values, field):
+    '''Format a vector as the fixed-width bytes of a field.'''
+
+    values = numpy.asarray(values)
+    if field.fieldtype in 'NF':
+        values = values.astype(numpy.float64)
+        text = numpy.char.mod('%{}.{}f'.format(field.length, field.decimals), values)
+        text = numpy.where(numpy.isnan(values), '', text)
+        text = numpy.char.rjust(text, field.length)
+    elif field.fieldtype == 'L':
+        text = numpy.where(values.astype(bool), 'T', 'F')
+    elif field.fieldtype == 'D':
+        text = numpy.char.replace(values.astype('datetime64[D]').astype('U10'), '-', '')
+    else:
+        text = numpy.char.ljust(values.astype('U'), field.length)
+
+    encoded = numpy.char.encode(text, 'latin-1')
+    if (numpy.char.str_len(encoded) > field.length).any():
+        raise ValueError("Values do not fit in {} ({} bytes)".format(field.name, field.length))
+
+    return encoded.astype('S{}'.format(field.length))
+
+
+def write_dbf(outputfile, fields, columns):
+    '''
+    Write a .dbf from vectors.
+
+    :param fields: list of DbfField.
+    :param columns: one vector per field, all the same length.
+    '''
+
+    nrecords = len(columns[0]) if columns else 0
+    dtype = get_recorddtype(fields)
+    records = numpy.zeros(nrecords, dtype=dtype)
+    records['_deleted'] = b' '
+    for field, values in zip(fields, columns):
+        records[field.name] = format_column(values, field)
+
+    headerlength = 32 + 32 * len(fields) + 1
+    today = datetime.date.today()
+    header = struct.pack('<BBBBIHH20x', 3, today.year - 1900, today.month, today.day,
+                         nrecords, headerlength, dtype.itemsize)
+    descriptors = b''.join(struct.pack('<11sc4xBB14x', field.name.encode('latin-1'),
+                                       field.fieldtype.encode('latin-1'), field.length, field.decimals)
+                           for field in fields)
+
+    with open(outputfile, 'wb') as f:
+        f.write(header + descriptors + b'\r')
+        f.write(records.tobytes())
+        f.write(b'\x1a')
+
+    return outputfile
@@ -0,0 +1,212 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Make-style dependency records, so a rerun only redoes what changed.
+
+Every output (a daily raster's point CSV, a yearly block table, a merged
+table) is recorded with the signature it was made from: the size and
+modification time of each input file and the parameters that change the
+result (ptinterval, pgvf, the resample cell size, ...). A folder keeps
+the records of its outputs in dependencies.json:
+
+    {"../prate_1900_1_1_pg.csv": {"inputs": {"D:/noaa/.../prate_1900_1_1.tif": [210644, 1522...],
+                                             "D:/shp/nuts2.shp": [...], ...},
+                                  "parameters": {"pgvf": "NUTS_ID", ...}}}
+
+An output is current when it exists and its record matches the inputs
+and parameters now. An output without a record is made again: being
+newer than its inputs, as make would take it, says nothing about the
+parameters it was made with (another pgvf, another interval), and a
+copied or restored input can keep an old modification time.
+
+A replaced prate.1899.nc thus restarts its year in stage 1, which
+rewrites that year's rasters, which makes only that year's tables
+dirty in 2a-2c, which are then patched into the merged table by 3.
+"""
+
+import json
+import os
+import time
+import zlib
+
+from .checkpoint import get_fingerprint
+
+
+DEPENDENCYFILE = 'dependencies.json'
+LOCKTIMEOUT = 600
+
+
+################ 1. Signatures.
+
+def get_shapefileinputs(shpfile):
+    '''The files of a shapefile a result depends on: .shp, .dbf and .prj (when there).'''
+
+    base = os.path.splitext(shpfile)[0]
+
+    return [base + '.shp'] + [base + extension for extension in ('.dbf', '.prj')
+                              if os.path.exists(base + extension)]
+
+
+def get_digest(*arrays):
+    '''CRC-32 of numpy arrays, e.g. of a weight matrix, to use as a parameter.'''
+
+    digest = 0
+    for array in arrays:
+        digest = zlib.crc32(array.tobytes(), digest)
+
+    return digest
+
+
+def get_signature(inputs, parameters=None):
+    '''
+    What an output is made from: the fingerprint (size, mtime) of each
+    input file (None when missing) and the parameters as text.
+    '''
+
+    return {'inputs': dict((os.path.abspath(path), list(get_fingerprint(path)) if os.path.exists(path) else None)
+                           for path in inputs),
+            'parameters': dict((name, str(value)) for name, value in (parameters or {}).items())}
+
+
+################ 2. Records of a folder.
+
+class DependencyRecord(object):
+    '''
+    The dependency records of a folder, keyed by output path relative
+    to it. Records are kept in memory until write().
+
+    :param folder: folder of dependencies.json, usually the outputs' folder.
+    '''
+
+    def __init__(self, folder):
+
+        self.folder = folder
+        self.dependencyfile = os.path.join(folder, DEPENDENCYFILE)
+        self.entries = self.read()
+        self.changed = {}
+
+    def read(self):
+
+        if not os.path.exists(self.dependencyfile):
+            return {}
+        with open(self.dependencyfile) as f:
+            return json.load(f)
+
+    def get_key(self, outputfile):
+
+        return os.path.relpath(os.path.abspath(outputfile), os.path.abspath(self.folder)).replace(os.sep, '/')
+
+    def get_entry(self, outputfile):
+        '''Recorded signature of an output, or None.'''
+
+        return self.entries.get(self.get_key(outputfile))
+
+    def is_current(self, outputfile, signature, subset=False):
+        '''
+        True when the output exists and was made from this signature. An
+        output without a record is not current, however new it is.
+
+        :param subset: the record may carry more parameters than the
+                       signature (e.g. a CSV converted from an output with
+                       its own parameters added, see derive).
+        '''
+
+        if not os.path.exists(outputfile):
+            return False
+
+        entry = self.get_entry(outputfile)
+        if entry is None:
+            return False
+
+        parameters = entry['parameters']
+        if subset:
+            parameters = dict((name, parameters.get(name)) for name in signature['parameters'])
+
+        return entry['inputs'] == signature['inputs'] and parameters == signature['parameters']
+
+    def get_dirty(self, outputfile, signature):
+        '''
+        Inputs of an output that changed since it was recorded: all of
+        them when the output is missing, has no record or its parameters
+        changed.
+        '''
+
+        entry = self.get_entry(outputfile)
+        if not os.path.exists(outputfile) or entry is None or entry['parameters'] != signature['parameters']:
+            return list(signature['inputs'])
+
+        return [path for path, fingerprint in signature['inputs'].items()
+                if entry['inputs'].get(path) != fingerprint]
+
+    def derive(self, sourcefile, parameters=None):
+        '''
+        Signature for an output converted from sourcefile (e.g. 2b's CSV
+        from 2a's point shapefile): the source's own record plus the
+        conversion parameters, so the output stays current after the
+        source is deleted. Falls back to the source file itself as input.
+        '''
+
+        entry = self.get_entry(sourcefile)
+        if entry is None:
+            return get_signature(get_shapefileinputs(sourcefile) if sourcefile.endswith('.shp') else [sourcefile],
+                                 parameters)
+
+        signature = get_signature([], parameters)
+        signature['inputs'] = dict(entry['inputs'])
+        signature['parameters'] = dict(entry['parameters'], **signature['parameters'])
+
+        return signature
+
+    def record(self, outputfile, signature):
+        '''Record that outputfile was made from signature.'''
+
+        key = self.get_key(outputfile)
+        self.entries[key] = self.changed[key] = signature
+
+    def write(self):
+        '''
+        Write the records changed since the last write, on top of what is
+        on disk now (another job may have recorded other outputs).
+        '''
+
+        if not self.changed:
+            return
+
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder, exist_ok=True)
+        self.lock()
+        try:
+            entries = self.read()
+            entries.update(self.changed)
+            partfile = '{}.{}.part'.format(self.dependencyfile, os.getpid())
+            with open(partfile, 'w') as f:
+                json.dump(entries, f)
+            os.replace(partfile, self.dependencyfile)
+        finally:
+            os.remove(self.lockfile)
+        self.entries = entries
+        self.changed = {}
+
+    @property
+    def lockfile(self):
+
+        return self.dependencyfile + '.lock'
+
+    def lock(self, timeout=LOCKTIMEOUT, wait=0.05):
+        '''
+        Take the folder's lock file (created exclusively), so jobs writing
+        their records at the same time do not drop each other's. A lock
+        older than timeout seconds is left from a crashed job and taken over.
+        '''
+
+        while True:
+            try:
+                os.close(os.open(self.lockfile, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(self.lockfile) > timeout:
+                        os.remove(self.lockfile)
+                        continue
+                except OSError:
+                    continue
+                time.sleep(wait)
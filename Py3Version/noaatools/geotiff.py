@@ -0,0 +1,482 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Write and read GeoTIFF rasters with NumPy and struct, without arcpy or GDAL.
+
+Files are classic little-endian TIFFs, tiled, with one sample per band
+(planar configuration 2), optional DEFLATE/LZW/Zstd compression with
+the TIFF predictors, GeoKeys for EPSG:4326 and the GDAL nodata and
+scale/offset tags that ArcMap and GDAL understand. The reader maps
+uncompressed rasters straight into memory.
+"""
+
+import re
+import struct
+
+import numpy
+
+from . import compression
+from .packed import PackedArray
+
+
+################ 1. TIFF and GeoTIFF constants.
+
+# Tag ids.
+IMAGEWIDTH, IMAGELENGTH, BITSPERSAMPLE, COMPRESSION = 256, 257, 258, 259
+PHOTOMETRIC, STRIPOFFSETS, SAMPLESPERPIXEL, ROWSPERSTRIP, STRIPBYTECOUNTS = 262, 273, 277, 278, 279
+PLANARCONFIG, PREDICTOR = 284, 317
+TILEWIDTH, TILELENGTH, TILEOFFSETS, TILEBYTECOUNTS = 322, 323, 324, 325
+EXTRASAMPLES, SAMPLEFORMAT = 338, 339
+MODELPIXELSCALE, MODELTIEPOINT, GEOKEYDIRECTORY = 33550, 33922, 34735
+GDALMETADATA, GDALNODATA = 42112, 42113
+
+# Field types: (TIFF type id, struct code).
+SHORT, LONG, DOUBLE, ASCII = (3, 'H'), (4, 'I'), (12, 'd'), (2, 's')
+
+SAMPLEFORMATS = {'u': 1, 'i': 2, 'f': 3}
+
+# Old Adobe code for deflate, still written by some tools.
+OLDDEFLATE = 32946
+
+# GeoKeys: geographic model, pixel-is-area, WGS 84.
+GEOKEYS = [(1024, 0, 1, 2), (1025, 0, 1, 1), (2048, 0, 1, 4326)]
+
+
+################ 2. Georeferencing.
+
+def get_gridgeotransform(lats, lons):
+    '''
+    Geotransform (x0, dx, y0, dy) of a lat/lon grid, as the top-left
+    corner and cell size.
+
+    The Gaussian latitudes of the reanalysis are not evenly spaced; like
+    the ArcGIS NetCDF layer, the rows are laid out evenly between the
+    first and last latitude. Rows are written north to south, so the
+    cube must be flipped first when latitudes increase (see
+    get_northup).
+
+    :param lats, lons: grid axes (grid.Grid.lats / lons).
+    '''
+
+    lats = numpy.asarray(lats, dtype=numpy.float64)
+    lons = numpy.asarray(lons, dtype=numpy.float64)
+    dx = float(lons[1] - lons[0])
+    dy = float(abs(lats[0] - lats[-1]) / (len(lats) - 1))
+
+    return float(lons[0]) - dx / 2.0, dx, float(lats.max()) + dy / 2.0, dy
+
+
+def get_northup(bands, lats):
+    '''Flip a (..., lat, lon) array so the first row is the northernmost.'''
+
+    return bands[..., ::-1, :] if lats[0] < lats[-1] else bands
+
+
+################ 3. Writing.
+
+def _pack_entry(tag, fieldtype, values):
+    '''Encode one IFD entry value as (tag, type id, count, bytes).'''
+
+    typeid, code = fieldtype
+    if fieldtype == ASCII:
+        data = values.encode('ascii') + b'\0'
+        return tag, typeid, len(data), data
+
+    values = list(values) if isinstance(values, (list, tuple, numpy.ndarray)) else [values]
+
+    return tag, typeid, len(values), struct.pack('<{}{}'.format(len(values), code), *values)
+
+
+def _get_gdalmetadata(nbands, scale_factor, add_offset, descriptions):
+    '''GDAL_METADATA XML with per-band scale, offset and descriptions.'''
+
+    items = []
+    for band in range(nbands):
+        if scale_factor is not None:
+            items.append('<Item name="SCALE" sample="{}" role="scale">{!r}</Item>'.format(band, scale_factor))
+            items.append('<Item name="OFFSET" sample="{}" role="offset">{!r}</Item>'.format(band, add_offset))
+        if descriptions:
+            items.append('<Item name="DESCRIPTION" sample="{}" role="description">{}</Item>'.format(
+                band, descriptions[band]))
+
+    return '<GDALMetadata>' + ''.join(items) + '</GDALMetadata>' if items else None
+
+
+def encode_geotiff(bands,
+                   geotransform,
+                   nodata=None,
+                   tilesize=256,
+                   codec="none",
+                   level=6,
+                   predictor=True,
+                   descriptions=None):
+    '''
+    Encode one or more bands as a GeoTIFF.
+
+    :param bands: (rows, columns) or (bands, rows, columns) array, north
+                  up; or a packed.PackedArray, written as its integers
+                  with the scale and offset in the GDAL metadata.
+    :param geotransform: (x0, dx, y0, dy) of the top-left corner.
+    :param nodata: nodata value written to the GDAL_NODATA tag.
+    :param tilesize: tile width and height (multiple of 16); None
+                     writes one strip per band instead of tiles.
+    :param codec: "none", "deflate", "lzw" or "zstd".
+    :param predictor: use the TIFF predictor when compressing.
+    :param descriptions: optional text per band, e.g. the date.
+    :return: bytes of the file.
+    '''
+
+    scale_factor = add_offset = None
+    if isinstance(bands, PackedArray):
+        scale_factor, add_offset = bands.scale_factor, bands.add_offset
+        if nodata is None and bands.missing_value is not None:
+            nodata = bands.missing_value
+        bands = bands.data
+
+    bands = numpy.asarray(bands)
+    if bands.ndim == 2:
+        bands = bands[None]
+    nbands, rows, columns = bands.shape
+    dtype = bands.dtype.newbyteorder('<')
+
+    usepredictor = compression.NOPREDICTOR
+    if predictor and codec != "none":
+        usepredictor = compression.get_predictor(dtype)
+
+    # Cut each band into tiles (padded at the right and bottom edges)
+    # or a single strip, and compress them.
+    if tilesize:
+        tilewidth = tilelength = tilesize
+    else:
+        tilewidth, tilelength = columns, rows
+    tilesacross = -(-columns // tilewidth)
+    tilesdown = -(-rows // tilelength)
+
+    payloads = []
+    for band in bands:
+        for tilerow in range(tilesdown):
+            for tilecolumn in range(tilesacross):
+                tile = numpy.zeros((tilelength, tilewidth), dtype=dtype)
+                block = band[tilerow * tilelength:(tilerow + 1) * tilelength,
+                             tilecolumn * tilewidth:(tilecolumn + 1) * tilewidth]
+                tile[:block.shape[0], :block.shape[1]] = block
+                payloads.append(compression.compress(compression.apply_predictor(tile, usepredictor),
+                                                     codec, level))
+
+    x0, dx, y0, dy = geotransform
+    entries = [(IMAGEWIDTH, LONG, columns),
+               (IMAGELENGTH, LONG, rows),
+               (BITSPERSAMPLE, SHORT, [dtype.itemsize * 8] * nbands),
+               (COMPRESSION, SHORT, compression.COMPRESSIONS[codec]),
+               (PHOTOMETRIC, SHORT, 1),
+               (SAMPLESPERPIXEL, SHORT, nbands),
+               (PLANARCONFIG, SHORT, 2),
+               (SAMPLEFORMAT, SHORT, [SAMPLEFORMATS[dtype.kind]] * nbands),
+               (MODELPIXELSCALE, DOUBLE, [dx, dy, 0.0]),
+               (MODELTIEPOINT, DOUBLE, [0.0, 0.0, 0.0, x0, y0, 0.0]),
+               (GEOKEYDIRECTORY, SHORT, [1, 1, 0, len(GEOKEYS)] + [v for key in GEOKEYS for v in key])]
+    if usepredictor != compression.NOPREDICTOR:
+        entries.append((PREDICTOR, SHORT, usepredictor))
+    if nbands > 1:
+        entries.append((EXTRASAMPLES, SHORT, [0] * (nbands - 1)))
+    if nodata is not None:
+        entries.append((GDALNODATA, ASCII, repr(float(nodata)) if dtype.kind == 'f' else str(int(nodata))))
+    metadata = _get_gdalmetadata(nbands, scale_factor, add_offset, descriptions)
+    if metadata:
+        entries.append((GDALMETADATA, ASCII, metadata))
+
+    # Image data goes right after the 8-byte header, the IFD after it.
+    offsets, position = [], 8
+    for payload in payloads:
+        offsets.append(position)
+        position += len(payload) + (len(payload) & 1)
+    bytecounts = [len(payload) for payload in payloads]
+
+    if tilesize:
+        entries += [(TILEWIDTH, LONG, tilewidth), (TILELENGTH, LONG, tilelength),
+                    (TILEOFFSETS, LONG, offsets), (TILEBYTECOUNTS, LONG, bytecounts)]
+    else:
+        entries += [(ROWSPERSTRIP, LONG, rows),
+                    (STRIPOFFSETS, LONG, offsets), (STRIPBYTECOUNTS, LONG, bytecounts)]
+
+    packed = sorted(_pack_entry(*entry) for entry in entries)
+    ifdoffset = position
+    ifdsize = 2 + 12 * len(packed) + 4
+
+    # Values longer than 4 bytes live after the IFD.
+    ifd = [struct.pack('<H', len(packed))]
+    extra, extraposition = [], ifdoffset + ifdsize
+    for tag, typeid, count, data in packed:
+        if len(data) <= 4:
+            ifd.append(struct.pack('<HHI', tag, typeid, count) + data.ljust(4, b'\0'))
+        else:
+            ifd.append(struct.pack('<HHII', tag, typeid, count, extraposition))
+            extra.append(data + b'\0' * (len(data) & 1))
+            extraposition += len(data) + (len(data) & 1)
+    ifd.append(struct.pack('<I', 0))
+
+    body = b''.join(payload + b'\0' * (len(payload) & 1) for payload in payloads)
+
+    return b''.join([b'II', struct.pack('<HI', 42, ifdoffset), body] + ifd + extra)
+
+
+def write_geotiff(outputfile, bands, geotransform, **options):
+    '''
+    Write a GeoTIFF (see encode_geotiff for the options).
+
+    :return: outputfile
+    '''
+
+    with open(outputfile, 'wb') as f:
+        f.write(encode_geotiff(bands, geotransform, **options))
+
+    return outputfile
+
+
+################ 4. Reading.
+
+# TIFF field types: id -> (struct code, size).
+FIELDTYPES = {1: ('B', 1), 2: ('s', 1), 3: ('H', 2), 4: ('I', 4), 5: ('II', 8), 6: ('b', 1),
+              7: ('B', 1), 8: ('h', 2), 9: ('i', 4), 10: ('ii', 8), 11: ('f', 4), 12: ('d', 8)}
+
+
+def read_tags(inputfile):
+    '''
+    Parse the header and first IFD of a classic TIFF.
+
+    :return: byte order ('<' or '>'), dict of tag id -> tuple of values
+             (or a string for ASCII tags).
+    '''
+
+    with open(inputfile, 'rb') as f:
+        header = f.read(8)
+        if header[:2] not in (b'II', b'MM'):
+            raise ValueError("{} is not a TIFF file".format(inputfile))
+        byteorder = '<' if header[:2] == b'II' else '>'
+        version, ifdoffset = struct.unpack(byteorder + 'HI', header[2:])
+        if version != 42:
+            raise ValueError("{} is a BigTIFF, only classic TIFF is supported".format(inputfile))
+
+        f.seek(ifdoffset)
+        count = struct.unpack(byteorder + 'H', f.read(2))[0]
+        entries = [struct.unpack(byteorder + 'HHI4s', f.read(12)) for _ in range(count)]
+
+        tags = {}
+        for tag, typeid, valuecount, valuefield in entries:
+            code, size = FIELDTYPES.get(typeid, ('B', 1))
+            nbytes = size * valuecount
+            if nbytes > 4:
+                f.seek(struct.unpack(byteorder + 'I', valuefield)[0])
+                data = f.read(nbytes)
+            else:
+                data = valuefield[:nbytes]
+
+            if typeid == 2:
+                tags[tag] = data.rstrip(b'\0').decode('ascii', 'replace')
+            else:
+                tags[tag] = struct.unpack('{}{}{}'.format(byteorder, valuecount * len(code), code[0]), data)
+
+    return byteorder, tags
+
+
+class GeoTiff(object):
+    '''
+    Minimal GeoTIFF reader.
+
+    Uncompressed files are exposed as numpy.memmap views, so point and
+    window reads only touch the pages they need: stripped files as a
+    (bands, rows, columns) memmap, tiled files as a
+    (bands, tilesdown, tilesacross, tilelength, tilewidth) memmap of
+    tiles. Compressed files are decoded in full on first access.
+
+    :param inputfile: path of the .tif
+    '''
+
+    def __init__(self, inputfile):
+
+        self.inputfile = inputfile
+        self.byteorder, self.tags = read_tags(inputfile)
+        tags = self.tags
+
+        self.width = tags[IMAGEWIDTH][0]
+        self.height = tags[IMAGELENGTH][0]
+        self.nbands = tags.get(SAMPLESPERPIXEL, (1,))[0]
+        self.planar = tags.get(PLANARCONFIG, (1,))[0]
+        # Compressions we cannot decode (e.g. PackBits, 32773) would be
+        # read as raw bytes, so they are refused here.
+        tiffcompression = tags.get(COMPRESSION, (1,))[0]
+        self.codec = dict((v, k) for k, v in compression.COMPRESSIONS.items()).get(
+            tiffcompression, 'deflate' if tiffcompression == OLDDEFLATE else None)
+        if self.codec is None:
+            raise ValueError("Unsupported TIFF compression {} in {}, use one of {}".format(
+                tiffcompression, inputfile, sorted(compression.COMPRESSIONS)))
+        self.predictor = tags.get(PREDICTOR, (1,))[0]
+
+        kind = {1: 'u', 2: 'i', 3: 'f'}[tags.get(SAMPLEFORMAT, (1,))[0]]
+        self.dtype = numpy.dtype('{}{}{}'.format(self.byteorder, kind, tags[BITSPERSAMPLE][0] // 8))
+
+        self.tiled = TILEOFFSETS in tags
+        if self.tiled:
+            self.blockwidth, self.blocklength = tags[TILEWIDTH][0], tags[TILELENGTH][0]
+            self.offsets, self.bytecounts = tags[TILEOFFSETS], tags[TILEBYTECOUNTS]
+        else:
+            self.blockwidth = self.width
+            self.blocklength = tags.get(ROWSPERSTRIP, (self.height,))[0]
+            self.offsets, self.bytecounts = tags[STRIPOFFSETS], tags[STRIPBYTECOUNTS]
+        self.blocksacross = -(-self.width // self.blockwidth)
+        self.blocksdown = -(-self.height // self.blocklength)
+
+        self.nodata = float(tags[GDALNODATA]) if GDALNODATA in tags else None
+        self.scale_factor, self.add_offset = self._get_scaleoffset()
+
+        self._blocks = None
+        self._decoded = None
+
+    ################ Georeferencing.
+
+    @property
+    def geotransform(self):
+        '''(x0, dx, y0, dy) of the top-left corner, or None.'''
+
+        if MODELPIXELSCALE not in self.tags or MODELTIEPOINT not in self.tags:
+            return None
+        dx, dy = self.tags[MODELPIXELSCALE][:2]
+        i, j, _, x, y, _ = self.tags[MODELTIEPOINT][:6]
+
+        return x - i * dx, dx, y + j * dy, dy
+
+    def get_pixel(self, x, y):
+        '''Row and column of the pixels containing map coordinates.'''
+
+        x0, dx, y0, dy = self.geotransform
+        rows = numpy.floor((y0 - numpy.asarray(y, dtype=numpy.float64)) / dy).astype(numpy.int64)
+        columns = numpy.floor((numpy.asarray(x, dtype=numpy.float64) - x0) / dx).astype(numpy.int64)
+
+        return rows, columns
+
+    def _get_scaleoffset(self):
+
+        metadata = self.tags.get(GDALMETADATA, '')
+        scale = re.search(r'role="scale">([^<]+)<', metadata)
+        offset = re.search(r'role="offset">([^<]+)<', metadata)
+
+        return (float(scale.group(1)) if scale else None,
+                float(offset.group(1)) if offset else None)
+
+    ################ Pixel access.
+
+    def _get_mappedshape(self):
+        '''
+        Block shape under which the pixel data can be memory-mapped, or
+        None when it is compressed or not stored back to back. Stripped
+        bands are mapped whole, as a single block each, so a short last
+        strip does not matter.
+        '''
+
+        if self.codec != "none":
+            return None
+        offsets = numpy.asarray(self.offsets, dtype=numpy.int64)
+        counts = numpy.asarray(self.bytecounts, dtype=numpy.int64)
+        if not numpy.array_equal(offsets[1:], offsets[:-1] + counts[:-1]):
+            return None
+
+        nbands = self.nbands if self.planar == 2 else 1
+        if self.tiled:
+            shape = (nbands, self.blocksdown, self.blocksacross, self.blocklength, self.blockwidth)
+        else:
+            shape = (nbands, 1, 1, self.height, self.width)
+        if counts.sum() != int(numpy.prod(shape)) * self.dtype.itemsize:
+            return None
+
+        return shape
+
+    def get_blocks(self):
+        '''
+        All blocks as a (bands, blocksdown, blocksacross, blocklength,
+        blockwidth) array: a zero-copy memmap for uncompressed files
+        whose blocks are stored back to back, decoded otherwise.
+        '''
+
+        if self._blocks is not None:
+            return self._blocks
+
+        if self.planar != 2 and self.nbands > 1:
+            raise ValueError("Interleaved multi-band files are not supported")
+
+        mappedshape = self._get_mappedshape()
+        if mappedshape is not None:
+            self.blocklength, self.blockwidth = mappedshape[3:]
+            self.blocksdown, self.blocksacross = mappedshape[1:3]
+            self._blocks = numpy.memmap(self.inputfile, dtype=self.dtype, mode='r',
+                                        offset=self.offsets[0], shape=mappedshape)
+            return self._blocks
+
+        shape = (self.nbands, self.blocksdown, self.blocksacross, self.blocklength, self.blockwidth)
+        blocks = numpy.zeros(shape, dtype=self.dtype.newbyteorder('='))
+        with open(self.inputfile, 'rb') as f:
+            for index, (offset, count) in enumerate(zip(self.offsets, self.bytecounts)):
+                f.seek(offset)
+                raw = compression.decompress(f.read(count), self.codec)
+                band, rest = divmod(index, self.blocksdown * self.blocksacross)
+                blockrow, blockcolumn = divmod(rest, self.blocksacross)
+                rows = len(raw) // (self.blockwidth * self.dtype.itemsize)
+                block = compression.undo_predictor(raw, self.dtype, (rows, self.blockwidth),
+                                                   self.predictor)
+                blocks[band, blockrow, blockcolumn, :rows] = block
+        self._blocks = blocks
+
+        return blocks
+
+    def read_window(self, rows=slice(None), columns=slice(None), band=0):
+        '''
+        Read a window of one band, touching only the blocks it covers.
+
+        :param rows, columns: slices of pixel rows and columns.
+        '''
+
+        row0, row1, _ = rows.indices(self.height)
+        col0, col1, _ = columns.indices(self.width)
+        blocks = self.get_blocks()[band]
+        out = numpy.empty((row1 - row0, col1 - col0), dtype=self.dtype.newbyteorder('='))
+
+        for blockrow in range(row0 // self.blocklength, -(-row1 // self.blocklength)):
+            for blockcolumn in range(col0 // self.blockwidth, -(-col1 // self.blockwidth)):
+                top, left = blockrow * self.blocklength, blockcolumn * self.blockwidth
+                r0, r1 = max(row0, top), min(row1, top + self.blocklength)
+                c0, c1 = max(col0, left), min(col1, left + self.blockwidth)
+                out[r0 - row0:r1 - row0, c0 - col0:c1 - col0] = \
+                    blocks[blockrow, blockcolumn, r0 - top:r1 - top, c0 - left:c1 - left]
+
+        return out
+
+    def read_pixels(self, rows, columns, band=0):
+        '''Values at pixel (row, column) pairs; only their pages are read.'''
+
+        rows, columns = numpy.asarray(rows), numpy.asarray(columns)
+        blocks = self.get_blocks()[band]
+
+        return numpy.asarray(blocks[rows // self.blocklength, columns // self.blockwidth,
+                                    rows % self.blocklength, columns % self.blockwidth])
+
+    def read_points(self, x, y, band=0):
+        '''Value of the pixel under each map coordinate (NaN outside).'''
+
+        rows, columns = self.get_pixel(x, y)
+        inside = (rows >= 0) & (rows < self.height) & (columns >= 0) & (columns < self.width)
+        values = numpy.full(len(rows), numpy.nan)
+        values[inside] = self.read_pixels(rows[inside], columns[inside], band)
+        if self.nodata is not None:
+            values[values == self.nodata] = numpy.nan
+
+        return values
+
+    def read(self, band=0):
+        '''
+        The whole band. For uncompressed stripped files this is a
+        memmap view; tiled files are assembled into a new array.
+        '''
+
+        blocks = self.get_blocks()[band]
+        if blocks.shape[:2] == (1, 1) and blocks.shape[2:] == (self.height, self.width):
+            return blocks[0, 0]
+
+        return self.read_window(band=band)
@@ -0,0 +1,210 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""The reanalysis lat/lon grid and the mapping of features onto it."""
+
+import numpy
+
+from . import cube
+from .extract import WeightMatrix
+
+
+class Window(object):
+    '''
+    A rectangular block of grid rows and (possibly wrapping) columns.
+
+    A window over Europe on a 0..360 grid crosses the prime meridian,
+    so its columns are read as up to two contiguous ranges.
+
+    :param rows: slice of grid rows.
+    :param columns: grid column of each window column, in order.
+    :param fullshape: shape of the whole grid.
+    '''
+
+    def __init__(self, rows, columns, fullshape):
+
+        self.rows = rows
+        self.columns = numpy.asarray(columns, dtype=numpy.int64)
+        self.fullshape = tuple(fullshape)
+
+    @property
+    def shape(self):
+
+        return self.rows.stop - self.rows.start, len(self.columns)
+
+    @property
+    def columnranges(self):
+        '''Contiguous (start, stop) column ranges, in window order.'''
+
+        breaks = numpy.flatnonzero(numpy.diff(self.columns) != 1) + 1
+        pieces = numpy.split(self.columns, breaks)
+
+        return [(int(piece[0]), int(piece[-1]) + 1) for piece in pieces]
+
+    def get_key(self):
+
+        return self.rows.start, self.rows.stop, tuple(self.columnranges)
+
+    def read(self, variable, bands=slice(None)):
+        '''
+        Read the window from a (time, lat, lon) array or NetCDF variable,
+        one hyperslab per contiguous column range.
+        '''
+
+        pieces = [variable[bands, self.rows, start:stop] for start, stop in self.columnranges]
+        if len(pieces) == 1:
+            return pieces[0]
+
+        return numpy.concatenate(pieces, axis=-1)
+
+
+class Grid(object):
+    '''
+    A lat/lon grid such as the 192 x 94 Gaussian grid of the
+    20th Century Reanalysis.
+
+    Latitudes may be irregular (Gaussian) and in either order;
+    longitudes are regular and wrap around the globe.
+
+    :param lats: latitude of each row.
+    :param lons: longitude of each column.
+    '''
+
+    def __init__(self, lats, lons):
+
+        self.lats = numpy.asarray(lats, dtype=numpy.float64)
+        self.lons = numpy.asarray(lons, dtype=numpy.float64)
+        self.dlon = float(self.lons[1] - self.lons[0])
+
+    @classmethod
+    def from_netcdf(cls, path):
+        '''Read the lat/lon axes of a NetCDF file.'''
+
+        dataset = cube.open_netcdf(path)
+        try:
+            return cls(dataset.variables['lat'][:], dataset.variables['lon'][:])
+        finally:
+            dataset.close()
+
+    @classmethod
+    def from_geotransform(cls, geotransform, shape):
+        '''Grid of the cell centres of a north-up raster (geotiff.GeoTiff.geotransform).'''
+
+        x0, dx, y0, dy = geotransform
+        rows, columns = shape
+
+        return cls(y0 - dy * (numpy.arange(rows) + 0.5), x0 + dx * (numpy.arange(columns) + 0.5))
+
+    @property
+    def shape(self):
+
+        return len(self.lats), len(self.lons)
+
+    @property
+    def size(self):
+
+        return len(self.lats) * len(self.lons)
+
+    ################ Column and row lookups.
+
+    def get_columnposition(self, x):
+        '''Fractional column position of longitudes, wrapped to the grid.'''
+
+        return numpy.mod((numpy.asarray(x, dtype=numpy.float64) - self.lons[0]) / self.dlon,
+                         len(self.lons))
+
+    def get_rowposition(self, y):
+        '''
+        Fractional row position of latitudes, clamped to the outermost
+        rows (the Gaussian grid stops short of the poles).
+        '''
+
+        y = numpy.asarray(y, dtype=numpy.float64)
+        rows = numpy.arange(len(self.lats), dtype=numpy.float64)
+        if self.lats[0] > self.lats[-1]:
+            return numpy.interp(-y, -self.lats, rows)
+
+        return numpy.interp(y, self.lats, rows)
+
+    ################ Area of interest.
+
+    def get_window(self, x, y, margin=1):
+        '''
+        Smallest window covering a set of coordinates (points or
+        polygon vertices), plus a margin of cells on every side so
+        bilinear interpolation and partly covered cells stay inside.
+
+        Longitudes are treated as circular: the window spans the
+        shortest arc holding all of them, which may cross the edge
+        of the grid.
+
+        :param x, y: longitudes and latitudes.
+        :param margin: extra cells on each side.
+        :return: Window
+        '''
+
+        # Null shapes (NaN coordinates) do not count.
+        x, y = numpy.asarray(x, dtype=numpy.float64), numpy.asarray(y, dtype=numpy.float64)
+        valid = numpy.isfinite(x) & numpy.isfinite(y)
+        x, y = x[valid], y[valid]
+
+        nlat, nlon = self.shape
+        rows = self.get_rowposition(y)
+        row0 = max(int(numpy.floor(rows.min())) - margin, 0)
+        row1 = min(int(numpy.ceil(rows.max())) + margin + 1, nlat)
+
+        # The window is the complement of the widest empty gap between
+        # the sorted column positions around the circle.
+        columns = numpy.unique(self.get_columnposition(x))
+        gaps = numpy.diff(numpy.concatenate([columns, [columns[0] + nlon]]))
+        widest = int(numpy.argmax(gaps))
+        first = columns[(widest + 1) % len(columns)]
+        span = nlon - gaps[widest]
+
+        col0 = int(numpy.floor(first)) - margin
+        ncolumns = min(int(numpy.ceil(first + span)) + margin + 1 - col0, nlon)
+        if ncolumns == nlon:
+            col0 = 0
+
+        return Window(slice(row0, row1), numpy.mod(col0 + numpy.arange(ncolumns), nlon), self.shape)
+
+    ################ Feature mappings.
+
+    def locate_points(self, x, y, interpolate=False):
+        '''
+        Map points onto grid cells.
+
+        :param x, y: point longitudes and latitudes (any longitude range).
+        :param interpolate: bilinear weights from the four surrounding
+                            cell centres (the INTERPOLATE option of
+                            ExtractValuesToPoints) instead of the
+                            nearest cell.
+        :return: WeightMatrix with one row per point; points with NaN
+                 coordinates (null shapes) get no cells, hence NaN.
+        '''
+
+        x, y = numpy.asarray(x, dtype=numpy.float64), numpy.asarray(y, dtype=numpy.float64)
+        valid = numpy.isfinite(x) & numpy.isfinite(y)
+        columns = self.get_columnposition(x[valid])
+        rows = self.get_rowposition(y[valid])
+        nlon = len(self.lons)
+        indptr = numpy.concatenate([[0], numpy.cumsum(valid)])
+
+        if not interpolate:
+            cells = numpy.rint(rows).astype(numpy.int64) * nlon + \
+                numpy.rint(columns).astype(numpy.int64) % nlon
+            return WeightMatrix(indptr, cells, numpy.ones(len(cells), dtype=numpy.float32), self.shape)
+
+        row0 = numpy.minimum(numpy.floor(rows).astype(numpy.int64), len(self.lats) - 2)
+        col0 = numpy.floor(columns).astype(numpy.int64)
+        fy = (rows - row0)[:, None]
+        fx = (columns - col0)[:, None]
+
+        cells = numpy.column_stack([row0 * nlon + col0 % nlon,
+                                    row0 * nlon + (col0 + 1) % nlon,
+                                    (row0 + 1) * nlon + col0 % nlon,
+                                    (row0 + 1) * nlon + (col0 + 1) % nlon])
+        weights = numpy.column_stack([(1 - fy) * (1 - fx), (1 - fy) * fx,
+                                      fy * (1 - fx), fy * fx])
+
+        return WeightMatrix(4 * indptr, cells.ravel(),
+                            weights.ravel().astype(numpy.float32), self.shape)
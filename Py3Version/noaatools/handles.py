@@ -0,0 +1,121 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""A small LRU pool of open file handles with cached header metadata.
+
+Opening every yearly NetCDF file up front holds one descriptor per year
+and parses all headers before the first band is processed. The pool
+opens files on first use, keeps at most `maxopen` of them open and
+closes the least recently used one when full. Header metadata (band
+count, time axis) is read once per file and kept after the handle is
+closed, so it stays cheap to ask for again.
+"""
+
+from collections import OrderedDict
+
+
+class HandlePool(object):
+    '''
+    LRU pool of open handles.
+
+    :param opener: function opening a path, e.g. cube.open_netcdf or
+                   arcpy.NetCDFFileProperties.
+    :param headerreader: optional function handle -> metadata (any
+                         object), cached per path by get_header.
+    :param maxopen: handles kept open at the same time.
+    :param closer: function closing a handle; by default its close()
+                   method is called when it has one.
+    '''
+
+    def __init__(self, opener, headerreader=None, maxopen=4, closer=None):
+
+        self.opener = opener
+        self.headerreader = headerreader
+        self.maxopen = maxopen
+        self.closer = closer
+
+        self._handles = OrderedDict()
+        self._headers = {}
+
+    def _close(self, handle):
+
+        if self.closer is not None:
+            self.closer(handle)
+        elif hasattr(handle, 'close'):
+            handle.close()
+
+    def get(self, path):
+        '''Open handle for a path, opening it (and evicting the LRU one) if needed.'''
+
+        if path in self._handles:
+            self._handles.move_to_end(path)
+            return self._handles[path]
+
+        handle = self.opener(path)
+        self._handles[path] = handle
+        while len(self._handles) > self.maxopen:
+            _, evicted = self._handles.popitem(last=False)
+            self._close(evicted)
+
+        return handle
+
+    def get_header(self, path):
+        '''Cached header metadata of a path (opens it only the first time).'''
+
+        if path not in self._headers:
+            self._headers[path] = self.headerreader(self.get(path))
+
+        return self._headers[path]
+
+    def release(self, path):
+        '''Close the handle of a path now; its header stays cached.'''
+
+        handle = self._handles.pop(path, None)
+        if handle is not None:
+            self._close(handle)
+
+    def close(self):
+        '''Close every open handle.'''
+
+        while self._handles:
+            _, handle = self._handles.popitem(last=False)
+            self._close(handle)
+
+    def __len__(self):
+
+        return len(self._handles)
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, *exc_info):
+
+        self.close()
+
+
+def iter_opened(pool, items, key=lambda item: item, onerror=None):
+    '''
+    Lazily yield (item, handle, header) for each item, opening files
+    only when reached.
+
+    A file that cannot be opened or whose header cannot be read (e.g.
+    a corrupt year) is passed to onerror(item, exception) and skipped,
+    so one bad year does not abort the run. Without onerror the
+    exception is raised.
+
+    :param key: function giving the path of an item.
+    '''
+
+    for item in items:
+        path = key(item)
+        try:
+            handle = pool.get(path)
+            header = pool.get_header(path) if pool.headerreader is not None else None
+        except Exception as exception:
+            pool.release(path)
+            if onerror is None:
+                raise
+            onerror(item, exception)
+            continue
+
+        yield item, handle, header
@@ -0,0 +1,151 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""ETCCDI precipitation indices on (days x features) arrays.
+
+Every index is computed for all features at once with reduceat over
+the period boundaries, so there is no loop over features or rows.
+Values are expected in mm/day (see cube.get_unitmultiplier).
+"""
+
+import csv
+
+import numpy
+
+
+INDEXNAMES = ['rx1day', 'rx5day', 'r10mm', 'r20mm', 'r95p', 'r99p', 'cdd', 'cwd']
+
+# ETCCDI wet-day threshold in mm/day.
+WETDAY = 1.0
+
+
+################ 1. Period helpers.
+
+def get_periods(dates, frequency="annual"):
+    '''
+    Split a sorted run of daily dates into years or months.
+
+    :param dates: datetime64[D] array, one per row of the values.
+    :param frequency: "annual" or "monthly".
+    :return: period labels (strings), start row of each period.
+    '''
+
+    unit = {'annual': 'datetime64[Y]', 'monthly': 'datetime64[M]'}[frequency]
+    periods = numpy.asarray(dates, dtype='datetime64[D]').astype(unit)
+
+    starts = numpy.flatnonzero(numpy.concatenate([[True], periods[1:] != periods[:-1]]))
+
+    return periods[starts].astype(str), starts
+
+
+def get_runlengths(condition, starts):
+    '''
+    Length of the run of True ending at each day, restarting at
+    each period start.
+
+    :param condition: (days x features) boolean array.
+    :param starts: period start rows.
+    :return: (days x features) int array.
+    '''
+
+    running = numpy.cumsum(condition, axis=0)
+    resets = numpy.where(condition, 0, running)
+
+    # Runs may not carry over from the previous period.
+    boundaries = starts[starts > 0]
+    resets[boundaries] = numpy.maximum(resets[boundaries], running[boundaries - 1])
+
+    return running - numpy.maximum.accumulate(resets, axis=0)
+
+
+def get_basepercentiles(values, dates, baseperiod=(1961, 1990), percentiles=(95, 99), wetday=WETDAY):
+    '''
+    Per-feature percentiles of wet-day precipitation in the base period.
+
+    :return: (len(percentiles) x features) array.
+    '''
+
+    years = numpy.asarray(dates, dtype='datetime64[Y]').astype(int) + 1970
+    inbase = (years >= baseperiod[0]) & (years <= baseperiod[1])
+    if not inbase.any():
+        raise ValueError("No days fall in the base period {}-{}".format(*baseperiod))
+
+    basevalues = values[inbase].astype(numpy.float64)
+    basevalues[~(basevalues >= wetday)] = numpy.nan
+
+    with numpy.errstate(all='ignore'):
+        return numpy.nanpercentile(basevalues, percentiles, axis=0)
+
+
+################ 2. Indices.
+
+def compute_indices(values,
+                    dates,
+                    frequency="annual",
+                    baseperiod=(1961, 1990),
+                    basepercentiles=None,
+                    wetday=WETDAY):
+    '''
+    Compute Rx1day, Rx5day, R10mm, R20mm, R95p, R99p, CDD and CWD.
+
+    :param values: (days x features) daily precipitation in mm/day,
+                   sorted by date and without gaps.
+    :param dates: datetime64[D] array matching the rows.
+    :param frequency: "annual" or "monthly".
+    :param baseperiod: years used for the R95p/R99p percentiles.
+    :param basepercentiles: precomputed (2 x features) percentiles,
+                            e.g. when values only hold recent years.
+    :return: period labels, dict of index name -> (periods x features)
+    '''
+
+    values = numpy.asarray(values, dtype=numpy.float32)
+    periods, starts = get_periods(dates, frequency)
+
+    valid = ~numpy.isnan(values)
+    filled = numpy.where(valid, values, 0.0)
+    wet = valid & (values >= wetday)
+    dry = valid & (values < wetday)
+
+    indices = {}
+    indices['rx1day'] = numpy.fmax.reduceat(values, starts, axis=0)
+
+    # Five-day totals ending on each day, from one cumulative sum.
+    cumulative = numpy.cumsum(filled, axis=0, dtype=numpy.float64)
+    fiveday = numpy.full(values.shape, numpy.nan)
+    fiveday[4:] = cumulative[4:] - numpy.concatenate([numpy.zeros((1,) + values.shape[1:]),
+                                                      cumulative[:-5]])
+    indices['rx5day'] = numpy.fmax.reduceat(fiveday, starts, axis=0)
+
+    indices['r10mm'] = numpy.add.reduceat((valid & (values >= 10.0)).astype(numpy.int32), starts, axis=0)
+    indices['r20mm'] = numpy.add.reduceat((valid & (values >= 20.0)).astype(numpy.int32), starts, axis=0)
+
+    if basepercentiles is None:
+        basepercentiles = get_basepercentiles(values, dates, baseperiod, (95, 99), wetday)
+    for name, threshold in zip(['r95p', 'r99p'], basepercentiles):
+        above = wet & (values > threshold)
+        indices[name] = numpy.add.reduceat(numpy.where(above, filled, 0.0), starts, axis=0)
+
+    indices['cdd'] = numpy.maximum.reduceat(get_runlengths(dry, starts), starts, axis=0)
+    indices['cwd'] = numpy.maximum.reduceat(get_runlengths(wet, starts), starts, axis=0)
+
+    return periods, indices
+
+
+################ 3. Output.
+
+def write_indextable(outputfile, periods, indices, featureids, names=None):
+    '''
+    Write indices as a compact long table:
+    one row per (feature, period) with one column per index.
+
+    :param featureids: one id per feature column (e.g. the ptvf field).
+    '''
+
+    names = names or [name for name in INDEXNAMES if name in indices]
+
+    with open(outputfile, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['feature_id', 'period'] + names)
+        for column, featureid in enumerate(featureids):
+            rows = zip(*[indices[name][:, column] for name in names])
+            for period, row in zip(periods, rows):
+                writer.writerow([featureid, period] + ['{:g}'.format(value) for value in row])
@@ -0,0 +1,117 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Load-test a running query server (noaatools.server) from this machine.
+
+A number of client threads send the given request paths round-robin
+and the script reports throughput, latency percentiles, errors and the
+server's cache statistics:
+
+    python -m noaatools.loadtest --url http://127.0.0.1:8765 --requests 2000 --concurrency 16 \\
+        "/series?store=prate_pg&ids=FR101&start=1950-01-01&end=1959-12-31" \\
+        "/point?variable=prate&lat=48.85&lon=2.35&start=1950-01-01&end=1950-12-31"
+
+    python -m noaatools.loadtest --socket /tmp/noaa.sock "/series?store=prate_pt&ids=10"
+"""
+
+import argparse
+import http.client
+import json
+import threading
+import time
+from urllib.parse import urlsplit
+
+import numpy
+
+from .server import UnixHTTPConnection
+
+
+def get_connection(url=None, socketpath=None):
+    '''A new connection to the server at url (http://host:port) or on a Unix socket.'''
+
+    if socketpath:
+        return UnixHTTPConnection(socketpath)
+    parts = urlsplit(url)
+
+    return http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=60)
+
+
+def request(connection, path):
+    '''GET a path on an open connection: status, body.'''
+
+    connection.request('GET', path)
+    response = connection.getresponse()
+
+    return response.status, response.read()
+
+
+def run_load(paths, nrequests=1000, concurrency=8, url=None, socketpath=None):
+    '''
+    Send nrequests requests over concurrency keep-alive connections.
+
+    :return: dict with seconds, requests per second, latency
+             percentiles in milliseconds and the error count.
+    '''
+
+    latencies = numpy.zeros(nrequests)
+    errors = []
+    counter = iter(range(nrequests))
+    lock = threading.Lock()
+
+    def client():
+        connection = get_connection(url, socketpath)
+        while True:
+            with lock:
+                index = next(counter, None)
+            if index is None:
+                break
+            started = time.perf_counter()
+            try:
+                status, body = request(connection, paths[index % len(paths)])
+                if status != 200:
+                    errors.append((status, body[:200]))
+            except (OSError, http.client.HTTPException) as error:
+                errors.append((None, str(error)))
+                connection.close()
+                connection = get_connection(url, socketpath)
+            latencies[index] = time.perf_counter() - started
+        connection.close()
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - started
+
+    percentiles = numpy.percentile(latencies * 1000.0, [50, 95, 99])
+
+    return {'seconds': round(seconds, 3),
+            'requestspersecond': round(nrequests / seconds, 1),
+            'p50ms': round(percentiles[0], 2),
+            'p95ms': round(percentiles[1], 2),
+            'p99ms': round(percentiles[2], 2),
+            'maxms': round(latencies.max() * 1000.0, 2),
+            'errors': len(errors),
+            'firsterror': repr(errors[0]) if errors else None}
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(prog='python -m noaatools.loadtest', description=__doc__.split('\n')[0])
+    parser.add_argument('paths', nargs='+', help='request paths, sent round-robin')
+    parser.add_argument('--url', default='http://127.0.0.1:8765')
+    parser.add_argument('--socket', help='Unix socket of the server instead of --url')
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args(argv)
+
+    result = run_load(args.paths, args.requests, args.concurrency, args.url, args.socket)
+    connection = get_connection(args.url, args.socket)
+    result['cache'] = json.loads(request(connection, '/stats')[1].decode('utf-8'))
+    connection.close()
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
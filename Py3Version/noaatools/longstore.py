@@ -0,0 +1,287 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Long (feature, date, value) storage of extracted series.
+
+The merged wide tables have one column per day, ~60,000 for a 165-year
+run. A long store keeps the same values as rows sorted by feature then
+date, in a folder such as output/prate_pt.lts:
+
+    store.json            id field, feature ids and the list of segments
+    segment_00000.npy     records (feature, date, value), feature-major
+    segment_00000.idx.npy offsets (features + 1): feature i is records
+                          offsets[i]:offsets[i + 1] of the segment
+
+Every append of new days writes one new segment (typically one year),
+so existing rows are never rewritten, and a feature's series is one
+contiguous memory-mapped slice per segment. LongStore.to_csv exports
+the tidy table with a per-feature byte offset index for pandas or a
+database.
+"""
+
+import csv
+import json
+import os
+import re
+
+import numpy
+
+from . import tables
+
+
+# One row of the store.
+RECORDDTYPE = numpy.dtype([('feature', '<i4'), ('date', '<M8[D]'), ('value', '<f4')])
+
+MANIFEST = 'store.json'
+
+
+################ 1. The store.
+
+class LongStore(object):
+    '''
+    An existing long store folder (see create_store).
+
+    :param path: folder of the store, e.g. output/prate_pt.lts.
+    '''
+
+    def __init__(self, path):
+
+        self.path = path
+        with open(os.path.join(path, MANIFEST)) as f:
+            manifest = json.load(f)
+        self.idfield = manifest['idfield']
+        self.featureids = manifest['featureids']
+        self.segments = manifest['segments']
+        self.featureindex = dict((featureid, index) for index, featureid in enumerate(self.featureids))
+
+    @property
+    def nfeatures(self):
+
+        return len(self.featureids)
+
+    def get_dates(self):
+        '''All dates in the store, in segment order.'''
+
+        return numpy.concatenate([numpy.zeros(0, dtype='datetime64[D]')] +
+                                 [self.read_segment(segment)[0] for segment in self.segments])
+
+    def write_manifest(self):
+
+        manifestfile = os.path.join(self.path, MANIFEST)
+        with open(manifestfile + '.tmp', 'w') as f:
+            json.dump({'idfield': self.idfield,
+                       'featureids': self.featureids,
+                       'segments': self.segments}, f)
+        os.replace(manifestfile + '.tmp', manifestfile)
+
+    def get_records(self, segment):
+        '''Memory-mapped records and feature offsets of a segment.'''
+
+        name = os.path.join(self.path, segment['name'])
+
+        return numpy.load(name + '.npy', mmap_mode='r'), numpy.load(name + '.idx.npy', mmap_mode='r')
+
+    def read_segment(self, segment, feature=0):
+        '''Dates and values of one feature (by index) in a segment.'''
+
+        records, offsets = self.get_records(segment)
+        rows = records[offsets[feature]:offsets[feature + 1]]
+
+        return numpy.array(rows['date']), numpy.array(rows['value'])
+
+    def read_feature(self, featureid):
+        '''
+        Whole series of one feature.
+
+        :return: dates, values (float32), in date order.
+        '''
+
+        feature = self.featureindex[str(featureid)]
+        parts = [self.read_segment(segment, feature) for segment in self.segments]
+        if not parts:
+            return numpy.zeros(0, dtype='datetime64[D]'), numpy.zeros(0, dtype=numpy.float32)
+
+        return numpy.concatenate([part[0] for part in parts]), numpy.concatenate([part[1] for part in parts])
+
+    def append(self, dates, values, featureids=None, replace=False):
+        '''
+        Add days as one new segment. Days already in the store are left
+        out, so rerunning a merge only appends what is new.
+
+        :param values: (days x features) values, as in the wide tables.
+        :param featureids: ids of the value columns; must match the store.
+        :param replace: overwrite days already stored instead (e.g. a year
+                        recomputed from a replaced NetCDF file): segments
+                        holding any of the days are rewritten into the new
+                        one, with their other days kept.
+        :return: the new segment, or None when every day was stored already.
+        '''
+
+        if featureids is not None and [str(featureid) for featureid in featureids] != self.featureids:
+            raise ValueError("The table has other features than the store")
+
+        dates = numpy.asarray(dates, dtype='datetime64[D]')
+        values = numpy.asarray(values, dtype=numpy.float32)
+
+        stale = []
+        if replace:
+            for segment in self.segments:
+                records = self.get_records(segment)[0]
+                segmentdates = numpy.array(records['date'][:segment['ndays']])
+                if numpy.isin(segmentdates, dates).any():
+                    other = ~numpy.isin(segmentdates, dates)
+                    segmentvalues = numpy.array(records['value']).reshape(self.nfeatures, segment['ndays']).T
+                    dates = numpy.concatenate([dates, segmentdates[other]])
+                    values = numpy.concatenate([values, segmentvalues[other]])
+                    stale.append(segment)
+            self.segments = [segment for segment in self.segments if segment not in stale]
+
+        keep = ~numpy.isin(dates, self.get_dates())
+        order = numpy.argsort(dates[keep], kind='stable')
+        dates, values = dates[keep][order], values[keep][order]
+        if not len(dates):
+            return None
+
+        ndays = len(dates)
+        records = numpy.empty(self.nfeatures * ndays, dtype=RECORDDTYPE)
+        records['feature'] = numpy.repeat(numpy.arange(self.nfeatures), ndays)
+        records['date'] = numpy.tile(dates, self.nfeatures)
+        records['value'] = values.T.ravel()
+
+        # Names are never reused, so caches keyed by name stay valid.
+        number = max([int(segment['name'].split('_')[1]) + 1 for segment in self.segments + stale] or [0])
+        segment = {'name': 'segment_{:05d}'.format(number),
+                   'start': str(dates[0]),
+                   'end': str(dates[-1]),
+                   'ndays': ndays,
+                   'consecutive': bool((numpy.diff(dates) == numpy.timedelta64(1, 'D')).all())}
+        name = os.path.join(self.path, segment['name'])
+        numpy.save(name + '.npy', records)
+        numpy.save(name + '.idx.npy', numpy.arange(self.nfeatures + 1, dtype=numpy.int64) * ndays)
+
+        # The segment only counts once it is in the manifest; segments
+        # stay in date order when a replaced one comes back.
+        self.segments.append(segment)
+        self.segments.sort(key=lambda item: item['start'])
+        self.write_manifest()
+        for item in stale:
+            for extension in ('.npy', '.idx.npy'):
+                os.remove(os.path.join(self.path, item['name'] + extension))
+
+        return segment
+
+    def to_csv(self, outputfile, indexfile=None):
+        '''
+        Export the tidy table: id field, date, value, sorted by feature
+        then date. The index (default outputfile with _index.csv) gives
+        the byte offset and row count of every feature, so one series
+        is a seek and a contiguous read.
+
+        :return: outputfile
+        '''
+
+        if indexfile is None:
+            indexfile = re.sub(r'\.csv$', '', outputfile) + '_index.csv'
+
+        with open(outputfile, 'wb') as f, open(indexfile, 'w', newline='') as g:
+            index = csv.writer(g)
+            index.writerow([self.idfield, 'offset', 'rows'])
+            f.write('{},date,value\n'.format(self.idfield).encode('utf-8'))
+            for featureid in self.featureids:
+                dates, values = self.read_feature(featureid)
+                text = numpy.char.mod('%g', values)
+                text = numpy.where(numpy.isnan(values), '', text)
+                lines = numpy.char.add(numpy.char.add(featureid + ',', dates.astype('U10')),
+                                       numpy.char.add(',', text))
+                index.writerow([featureid, f.tell(), len(dates)])
+                if len(lines):
+                    f.write(('\n'.join(lines) + '\n').encode('utf-8'))
+
+        return outputfile
+
+
+def create_store(path, featureids, idfield="ID"):
+    '''
+    Create an empty long store, or open the one already there (its
+    features must match).
+
+    :return: LongStore
+    '''
+
+    if os.path.exists(os.path.join(path, MANIFEST)):
+        store = LongStore(path)
+        if store.featureids != [str(featureid) for featureid in featureids]:
+            raise ValueError("{} holds other features".format(path))
+        return store
+
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    with open(os.path.join(path, MANIFEST), 'w') as f:
+        json.dump({'idfield': idfield,
+                   'featureids': [str(featureid) for featureid in featureids],
+                   'segments': []}, f)
+
+    return LongStore(path)
+
+
+################ 2. Building a store from the toolbox tables.
+
+def get_idfield(inputfile):
+    '''
+    Feature id column of a daily CSV: the last column before the dates
+    other than OID (the zone field for grouped 2c tables, which also
+    carry the split field).
+    '''
+
+    with open(inputfile, newline='') as f:
+        header = next(csv.reader(f))
+
+    return [column for column in header if column != 'OID' and tables.parse_datecolumn(column) is None][-1]
+
+
+def get_tableyear(inputfile):
+    '''Year in the name of a daily or yearly table, e.g. 1900 for prate_1900_1_31_pg.csv.'''
+
+    match = re.search(r'(?:^|\D)(\d{4})_', os.path.basename(inputfile))
+
+    return int(match.group(1)) if match else None
+
+
+def append_tables(storepath, tablefiles, readtable=None, replace=()):
+    '''
+    Append daily CSVs (2b/2c) or yearly tables to a long store, one
+    segment per year, creating the store on the first table.
+
+    :param readtable: function returning featureids, dates, values,
+                      idfield of a table (e.g. pipeline.read_yearlytable);
+                      defaults to reading a daily CSV.
+    :param replace: tables whose days overwrite the stored ones (tables
+                    recomputed since the last merge, see LongStore.append).
+    :return: LongStore
+    '''
+
+    def readdaily(tablefile):
+        idfield = get_idfield(tablefile)
+        featureids, dates, values = tables.read_widetable(tablefile, idfield)
+        return featureids, dates, values, idfield
+
+    readtable = readtable or readdaily
+    years = {}
+    for tablefile in tablefiles:
+        years.setdefault(get_tableyear(tablefile), []).append(tablefile)
+
+    replace = set(replace)
+    store = None
+    for year in sorted(years, key=lambda year: (year is None, year)):
+        dates, values = [], []
+        for tablefile in years[year]:
+            featureids, tabledates, tablevalues, idfield = readtable(tablefile)
+            if store is None:
+                store = create_store(storepath, featureids, idfield)
+            elif [str(featureid) for featureid in featureids] != store.featureids:
+                raise ValueError("{} has other features than the rest".format(tablefile))
+            dates.append(tabledates)
+            values.append(tablevalues)
+        store.append(numpy.concatenate(dates), numpy.concatenate(values),
+                     replace=bool(replace.intersection(years[year])))
+
+    return store
@@ -0,0 +1,92 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Packed integer arrays that carry their scale_factor/add_offset along.
+
+The 20CR files store most variables as int16 with a scale and offset.
+Keeping them packed through reading, storage and the gather/weight
+kernels halves the bytes moved; the affine transform is applied only
+to the final, much smaller per-feature result. Because the transform
+is linear, nearest-cell values and weighted means come out the same as
+if the cube had been unpacked first.
+"""
+
+import numpy
+
+
+class PackedArray(object):
+    '''
+    Integer data with the affine transform that unpacks it:
+    value = data * scale_factor + add_offset, missing_value -> NaN.
+
+    Unit conversions are folded into scale_factor and add_offset.
+
+    :param data: integer ndarray.
+    :param scale_factor, add_offset: unpacking transform.
+    :param missing_value: packed value meaning no data, or None.
+    '''
+
+    def __init__(self, data, scale_factor=1.0, add_offset=0.0, missing_value=None):
+
+        self.data = data
+        self.scale_factor = float(scale_factor)
+        self.add_offset = float(add_offset)
+        self.missing_value = missing_value
+
+    @property
+    def shape(self):
+
+        return self.data.shape
+
+    @property
+    def dtype(self):
+
+        return self.data.dtype
+
+    @property
+    def nbytes(self):
+
+        return self.data.nbytes
+
+    def __len__(self):
+
+        return len(self.data)
+
+    def __getitem__(self, index):
+
+        return PackedArray(self.data[index], self.scale_factor, self.add_offset, self.missing_value)
+
+    def get_packing(self):
+        '''Packing attributes, in the form written to file headers.'''
+
+        return {'scale_factor': self.scale_factor,
+                'add_offset': self.add_offset,
+                'missing_value': None if self.missing_value is None else int(self.missing_value)}
+
+    def unpack(self):
+        '''
+        Apply the transform to the whole array, in float32 so a cube
+        never gets a float64 copy (see cube.unpack_inplace).
+        '''
+
+        out = numpy.multiply(self.data, numpy.float32(self.scale_factor), dtype=numpy.float32)
+        out += numpy.float32(self.add_offset)
+        if self.missing_value is not None:
+            out[self.data == self.missing_value] = numpy.nan
+
+        return out
+
+
+def unpack_values(values, scale_factor, add_offset, missing_value=None, dtype=numpy.float32):
+    '''
+    Apply an unpacking transform to packed integers or to results
+    computed from them (e.g. weighted means of packed values).
+
+    The multiply-add runs in float64 on the (small) result and is
+    rounded once to dtype.
+    '''
+
+    unpacked = (numpy.asarray(values, dtype=numpy.float64) * scale_factor + add_offset).astype(dtype)
+    if missing_value is not None and numpy.asarray(values).dtype.kind in 'iu':
+        unpacked[values == missing_value] = numpy.nan
+
+    return unpacked
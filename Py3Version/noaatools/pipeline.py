@@ -0,0 +1,362 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Run many variables and feature sets over the yearly NetCDF files in one pass."""
+
+import os
+import re
+
+import numpy
+
+from . import cube, depends, shard as sharding, tables
+from . import variables as noaavariables
+from .grid import Grid
+from .prefetch import Prefetcher
+from .writers import ParallelWriter, read_array
+
+
+class Extraction(object):
+    '''
+    A feature set to extract: its weight matrix on the grid and the
+    feature ids written in the output tables.
+
+    :param name: used in output file names, e.g. "pt" or "pg".
+    :param weights: extract.WeightMatrix (from Grid.locate_points,
+                    WeightMatrix.from_labels or rasterize.get_zoneweights).
+    :param featureids: one id per feature (the ptvf/pgvf field values).
+    :param idfield: name of the id column in the output.
+    '''
+
+    def __init__(self, name, weights, featureids, idfield="ID"):
+
+        if len(featureids) != weights.nfeatures:
+            raise ValueError("{} feature ids for {} features".format(len(featureids), weights.nfeatures))
+
+        self.name = name
+        self.weights = weights
+        self.featureids = featureids
+        self.idfield = idfield
+
+
+def find_years(inputpath, variables):
+    '''Years that have a yearly NetCDF file of any of the variables in inputpath, sorted.'''
+
+    years = set()
+    for name in os.listdir(inputpath):
+        for variable in variables:
+            match = re.match(r'^{}\.(\d{{4}})\.nc$'.format(re.escape(variable.fileprefix)), name)
+            if match:
+                years.add(int(match.group(1)))
+
+    return sorted(years)
+
+
+def get_grid(inputpath, variables, years):
+    '''Grid of the first yearly file found, shared by all the variables.'''
+
+    for year in years:
+        for variable in variables:
+            if os.path.exists(variable.get_filepath(inputpath, year)):
+                return Grid.from_netcdf(variable.get_filepath(inputpath, year))
+
+    raise IOError("No NetCDF files in {}".format(inputpath))
+
+
+def get_outputfile(outputpath, variable, year, extraction, outputformat="csv"):
+    '''
+    Yearly output table, e.g. output/air.2m.1900/air_1900_pt_yearly.csv,
+    next to the folders stage 1 writes its rasters to. The _yearly
+    suffix keeps 3_Merge_CSVs.py from mistaking it for a daily CSV.
+
+    :param outputformat: "csv" or "nca" (compressed array file, see writers).
+    '''
+
+    folder = os.path.join(outputpath, '.'.join([variable.fileprefix, str(year)]))
+
+    return os.path.join(folder, '_'.join([variable.name, str(year), extraction.name, 'yearly']) +
+                        '.' + outputformat)
+
+
+def write_extraction(outputpath, variable, year, extraction, values, dates, writer=None):
+    '''
+    Apply one feature set to a loaded cube and write its yearly table.
+
+    :param writer: optional writers.ParallelWriter; the result is then
+                   stored as a compressed (features x days) array file
+                   on the writer's threads instead of a CSV.
+    :return: output file.
+    '''
+
+    if extraction.weights.gridshape != values.shape[1:]:
+        raise ValueError("{} {} is on a {} grid, features were mapped to {}".format(
+            variable.name, year, values.shape[1:], extraction.weights.gridshape))
+
+    outputfile = get_outputfile(outputpath, variable, year, extraction,
+                                "csv" if writer is None else "nca")
+    if not os.path.isdir(os.path.dirname(outputfile)):
+        os.makedirs(os.path.dirname(outputfile))
+
+    result = extraction.weights.apply(values)
+    if writer is None:
+        tables.write_widetable(outputfile, extraction.featureids, dates, result, extraction.idfield)
+    else:
+        attributes = {'variable': variable.name,
+                      'units': variable.units,
+                      'idfield': extraction.idfield,
+                      'featureids': [str(featureid) for featureid in extraction.featureids],
+                      'dates': [str(date) for date in dates]}
+        writer.submit(outputfile, numpy.ascontiguousarray(result.T), attributes=attributes)
+
+    return outputfile
+
+
+def get_extractionsignature(inputfile, extraction, packed=False):
+    '''
+    What a yearly table is made from (see depends): the NetCDF file,
+    the feature set (a digest of its weights and ids) and packing.
+    '''
+
+    weights = extraction.weights
+    featureids = numpy.array([str(featureid) for featureid in extraction.featureids])
+    window = None if weights.window is None else weights.window.get_key()
+
+    return depends.get_signature([inputfile], {'extraction': extraction.name,
+                                               'weights': depends.get_digest(weights.indptr, weights.cells,
+                                                                             weights.weights, featureids),
+                                               'window': window,
+                                               'idfield': extraction.idfield,
+                                               'packed': packed})
+
+
+def run_extractions(inputpath,
+                    outputpath,
+                    variables,
+                    years,
+                    extractions,
+                    prefetch=2,
+                    maxbytes=None,
+                    outputformat="csv",
+                    writeoptions=None,
+                    packed=False,
+                    shard=None,
+                    incremental=True,
+                    manifestname=None):
+    '''
+    Extract every variable for every feature set, year by year.
+
+    The feature weights are built once by the caller and shared by all
+    variables. Only the window hyperslab is read when the weights carry
+    one, and extractions on the same window share one read.
+
+    :param inputpath: folder with the yearly NetCDF files.
+    :param outputpath: folder for the yearly tables.
+    :param variables: list of variables.NoaaVariable.
+    :param years: iterable of years.
+    :param extractions: list of Extraction.
+    :param prefetch: cubes loaded ahead on a background thread while
+                     the current one is extracted; 0 reads inline and
+                     reuses one buffer per window.
+    :param maxbytes: memory cap of the cubes loaded ahead.
+    :param outputformat: "csv" tables, or "nca" compressed array files
+                         written on a thread pool.
+    :param writeoptions: ParallelWriter options for "nca", e.g.
+                         {'codec': 'zstd', 'precision': 0.01, 'maxworkers': 4}.
+    :param packed: keep the cubes as packed int16 (cube.load_yearcube)
+                   and unpack only the per-feature results.
+    :param shard: (i, N) from shard.parse_shard to process only this
+                  machine's share of the (variable, year) files; a
+                  manifest is written at the end for merge_shards.
+    :param incremental: skip the (variable, year) files whose tables
+                        are current, i.e. were made from the same NetCDF
+                        file and feature sets (depends); they are still
+                        listed in the shard manifest.
+    :param manifestname: name of the shard manifest (shard.get_manifestfile).
+    :return: list of output files written.
+    '''
+
+    writer = ParallelWriter(**(writeoptions or {})) if outputformat == "nca" else None
+    outputfiles = []
+    written = []
+    uptodate = []
+    buffers = {}
+
+    # Extractions whose weights were moved onto the same window
+    # (WeightMatrix.to_window) share one hyperslab read.
+    windows = {}
+    for extraction in extractions:
+        window = extraction.weights.window
+        key = None if window is None else window.get_key()
+        windows.setdefault(key, (window, []))[1].append(extraction)
+
+    # Shard on the full list of (variable, year) files, found or not,
+    # so that every machine computes the same assignment.
+    yearfiles = [(year, variable) for year in years for variable in variables]
+    yearfiles = sharding.select_shard(yearfiles, shard,
+                                      key=lambda yearfile: '{}.{}'.format(yearfile[1].name, yearfile[0]),
+                                      weight=lambda yearfile: sharding.get_yearweight(yearfile[0]))
+
+    # Dependency records of the yearly output folders.
+    records = {}
+
+    def get_record(outputfile):
+        folder = os.path.dirname(outputfile)
+        if folder not in records:
+            records[folder] = depends.DependencyRecord(folder)
+        return records[folder]
+
+    def is_current(inputfile, variable, year, key):
+        for extraction in windows[key][1]:
+            outputfile = get_outputfile(outputpath, variable, year, extraction, outputformat)
+            signature = get_extractionsignature(inputfile, extraction, packed)
+            if not get_record(outputfile).is_current(outputfile, signature):
+                return False
+        return True
+
+    tasks = []
+    for year, variable in yearfiles:
+        inputfile = variable.get_filepath(inputpath, year)
+        if not os.path.exists(inputfile):
+            print('Skipping {} (not found)'.format(inputfile))
+            continue
+        for key in windows:
+            if incremental and is_current(inputfile, variable, year, key):
+                print('Skipping {} (up to date)'.format(inputfile))
+                uptodate.extend(get_outputfile(outputpath, variable, year, extraction, outputformat)
+                                for extraction in windows[key][1])
+                continue
+            tasks.append((inputfile, variable, year, key))
+
+    def loadtask(task):
+        inputfile, variable, year, key = task
+        print('Reading {}'.format(inputfile))
+        return cube.load_yearcube(inputfile, variable.name, variable.units,
+                                  out=None if prefetch else buffers.get(key),
+                                  window=windows[key][0], packed=packed)
+
+    try:
+        for (inputfile, variable, year, key), (values, dates) in Prefetcher(loadtask, tasks,
+                                                                             prefetch, maxbytes):
+            if not (prefetch or packed):
+                buffers[key] = values
+
+            for extraction in windows[key][1]:
+                outputfiles.append(write_extraction(outputpath, variable, year, extraction,
+                                                    values, dates, writer))
+                written.append((outputfiles[-1], get_extractionsignature(inputfile, extraction, packed)))
+    finally:
+        if writer is not None:
+            writer.close()
+
+    # Recorded once the writer has finished the files.
+    for outputfile, signature in written:
+        get_record(outputfile).record(outputfile, signature)
+    for record in records.values():
+        record.write()
+
+    if shard is not None:
+        sharding.write_manifest(outputpath, shard,
+                                ['{}.{}'.format(variable.name, year) for year, variable in yearfiles],
+                                uptodate + outputfiles, manifestname)
+
+    return outputfiles
+
+
+################ Merging yearly tables.
+
+def read_yearlytable(inputfile):
+    '''
+    Read a yearly table written by write_extraction, CSV or array file,
+    a daily CSV of 2a/2b (OID, id field, one date column) or of 2c
+    (OID, split field, zone field, one date column). Several id fields
+    make one id, e.g. DE_DE11 in a CNTR_NUTS_ID column, as the NetCDF
+    mode of 2c names its zones.
+
+    :return: featureids, dates, values (days x features), idfield
+    '''
+
+    if inputfile.endswith('.nca'):
+        values, header = read_array(inputfile)
+        attributes = header['attributes']
+        return (attributes['featureids'], numpy.array(attributes['dates'], dtype='datetime64[D]'),
+                values.T, attributes['idfield'])
+
+    with open(inputfile) as f:
+        idfields = [column.strip() for column in f.readline().split(',')
+                    if column.strip() != 'OID' and tables.parse_datecolumn(column.strip()) is None]
+    featureids, dates, values = tables.read_widetable(inputfile, idfields)
+
+    return featureids, dates, values, '_'.join(idfields)
+
+
+def merge_yearlytables(yearlyfiles, mergedfile):
+    '''
+    Merge the yearly tables (or daily CSVs) of one variable and feature
+    set into one wide table (one row per feature, one dYYY_MM_DD column per day, as
+    3_Merge_CSVs.py produces), in date order.
+
+    :return: mergedfile
+    '''
+
+    featureids = idfield = None
+    dates, values = [], []
+    for yearlyfile in yearlyfiles:
+        yearids, yeardates, yearvalues, idfield = read_yearlytable(yearlyfile)
+        if featureids is None:
+            featureids = list(yearids)
+        elif list(yearids) != featureids:
+            raise ValueError("{} has other features than the rest".format(yearlyfile))
+        dates.append(yeardates)
+        values.append(yearvalues)
+
+    dates, values = numpy.concatenate(dates), numpy.concatenate(values)
+    order = numpy.argsort(dates, kind='stable')
+    tables.write_widetable(mergedfile, featureids, dates[order], values[order], idfield)
+
+    return mergedfile
+
+
+def get_foldervariable(outputfile):
+    '''Variable name of an output in a yearly folder, e.g. air for air.2m.1900/1900_1_31_pt.csv.'''
+
+    folder = os.path.basename(os.path.dirname(outputfile))
+
+    return noaavariables.get_variable(re.sub(r'\.\d{4}$', '', folder)).name
+
+
+def merge_shards(outputpath, nshards, names=None):
+    '''
+    Assemble the tables of N finished shards into one wide table per
+    variable and feature set, e.g. output/prate_pt_merged.csv: the
+    yearly tables (run_extractions, batched 2a), the daily point CSVs
+    (parallel 2a, or 2b from the point shapefiles of 2a) and the daily
+    polygon CSVs of 2c (e.g. prate_1900_1_31_pg.csv). The rasters of
+    stage 1 are only checked for completeness.
+
+    :param names: shard manifests to merge (default: all, see shard.read_manifests).
+    :return: list of merged tables.
+    '''
+
+    groups = {}
+    for outputfile in sharding.read_manifests(outputpath, nshards, names):
+        outputname = os.path.basename(outputfile)
+        yearly = re.match(r'^(.*)_(\d{4})_(.+)_yearly\.(csv|nca)$', outputname)
+        polygondaily = re.match(r'^(.+)_\d{4}_\d{1,2}_\d{1,2}_pg\.csv$', outputname)
+        if yearly:
+            groups.setdefault((yearly.group(1), yearly.group(3)), []).append(outputfile)
+        elif re.match(r'^.+_\d{4}_\d{1,2}_\d{1,2}\.shp$', outputname):
+            # Point shapefile of 2a, converted by 2b to e.g. 1900_1_31_pt.csv
+            dailyfile = os.path.join(os.path.dirname(outputfile),
+                                     outputname.split('_', 1)[1].replace('.shp', '_pt.csv'))
+            if not os.path.exists(dailyfile):
+                raise IOError("{} has not been converted to {} (2b)".format(outputfile, dailyfile))
+            groups.setdefault((get_foldervariable(outputfile), 'pt'), []).append(dailyfile)
+        elif re.match(r'^\d{4}_\d{1,2}_\d{1,2}_pt\.csv$', outputname):
+            groups.setdefault((get_foldervariable(outputfile), 'pt'), []).append(outputfile)
+        elif polygondaily:
+            groups.setdefault((polygondaily.group(1), 'pg'), []).append(outputfile)
+
+    mergedfiles = []
+    for (variablename, extractionname), outputfiles in sorted(groups.items()):
+        mergedfile = os.path.join(outputpath, '_'.join([variablename, extractionname, 'merged']) + '.csv')
+        mergedfiles.append(merge_yearlytables(outputfiles, mergedfile))
+
+    return mergedfiles
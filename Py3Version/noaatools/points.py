@@ -0,0 +1,297 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Extract daily raster values at points on a pool of worker processes.
+
+This is the parallel mode of 2a. Instead of one ExtractValuesToPoints
+call per raster, each of which reloads the point shapefile, every
+worker process gets the point coordinates once when it starts and maps
+them onto the raster grid the first time it sees that grid. Workers
+then pull batches of rasters from the pool's task queue, read them with
+geotiff.GeoTiff and return (raster, date, values) to the calling
+process, the single writer.
+
+In the batched mode each task is a block of B days, extracted with a
+single gather over the stacked bands into a (days x points) array, and
+only those values are written, next to one shared point table.
+"""
+
+import csv
+import multiprocessing
+import os
+import re
+import sys
+
+import numpy
+
+from .geotiff import GeoTiff
+from .extract import WeightMatrix
+from .grid import Grid
+
+
+# Value written for points off the raster or on NoData, as
+# ExtractValuesToPoints does.
+NODATA = -9999
+
+
+################ 1. Rasters and their dates.
+
+def get_rasterdate(tiffile):
+    '''
+    Date of a daily raster from its name, e.g. prate_1900_1_31.tif.
+
+    :return: numpy.datetime64, or None if the name has no date.
+    '''
+
+    match = re.search(r'_(\d{4})_(\d{1,2})_(\d{1,2})\.tif$', os.path.basename(tiffile))
+    if not match:
+        return None
+
+    return numpy.datetime64('{:04d}-{:02d}-{:02d}'.format(*[int(part) for part in match.groups()]), 'D')
+
+
+def read_band(raster):
+    '''First band of a GeoTiff with its NoData cells set to NaN.'''
+
+    band = raster.read()
+    if raster.nodata is not None and not numpy.isnan(raster.nodata):
+        band = numpy.where(band == raster.nodata, numpy.nan, band)
+
+    return band
+
+
+def read_cells(raster, cells):
+    '''
+    Values of some cells (flat indices) of the first band of a GeoTiff,
+    NoData as NaN. Only these cells are gathered and masked, so an
+    uncompressed (memory-mapped) raster is read only where they are.
+    '''
+
+    values = raster.read().reshape(-1)[cells]
+    nodata = values == raster.nodata if raster.nodata is not None and not numpy.isnan(raster.nodata) else None
+    values = values.astype(numpy.float32)
+    if nodata is not None:
+        values[nodata] = numpy.nan
+
+    return values
+
+
+def get_outside(geotransform, shape, x, y):
+    '''
+    Points off a north-up raster (geotiff.GeoTiff.geotransform), which
+    ExtractValuesToPoints gives NoData. Longitudes wrap only on a raster
+    that goes all the way round.
+    '''
+
+    x0, dx, y0, dy = geotransform
+    rows, columns = shape
+    outside = (y > y0) | (y < y0 - dy * rows)
+    if dx * columns < 360.0 - dx / 2.0:
+        outside |= numpy.mod(x - x0, 360.0) > dx * columns
+
+    return outside
+
+
+def get_sampleweights(weights, outside):
+    '''
+    Point weights on the cells they use only: features in `outside` get
+    no cells (NaN), and the cells are renumbered into the list of the
+    cells sampled, so a band is gathered once and only there.
+
+    :return: WeightMatrix on a (1, cells) grid, flat cell indices.
+    '''
+
+    counts = numpy.diff(weights.indptr)
+    keep = numpy.repeat(~outside, counts)
+    indptr = numpy.concatenate([[0], numpy.cumsum(numpy.where(outside, 0, counts))])
+    cells, positions = numpy.unique(weights.cells[keep], return_inverse=True)
+
+    return WeightMatrix(indptr, positions, weights.weights[keep], (1, len(cells))), cells
+
+
+################ 2. Worker processes.
+
+# Per-process state set by init_worker: the point coordinates and
+# the weights of the points on each raster grid seen so far.
+_worker = {}
+
+
+def init_worker(x, y, interpolate=False):
+    '''Pool initializer: keep the point coordinates for the life of the worker.'''
+
+    _worker['x'] = numpy.asarray(x, dtype=numpy.float64)
+    _worker['y'] = numpy.asarray(y, dtype=numpy.float64)
+    _worker['interpolate'] = interpolate
+    _worker['weights'] = {}
+
+
+def get_weights(raster):
+    '''
+    Point weights on the grid of a raster and the cells they sample
+    (get_sampleweights), computed once per grid and worker. Points off
+    the raster get NaN, written as NoData.
+    '''
+
+    key = (raster.geotransform, raster.height, raster.width)
+    if key not in _worker['weights']:
+        shape = (raster.height, raster.width)
+        grid = Grid.from_geotransform(raster.geotransform, shape)
+        weights = grid.locate_points(_worker['x'], _worker['y'], _worker['interpolate'])
+        outside = get_outside(raster.geotransform, shape, _worker['x'], _worker['y'])
+        _worker['weights'][key] = get_sampleweights(weights, outside)
+
+    return _worker['weights'][key]
+
+
+def extract_raster(tiffile):
+    '''
+    Values of all points on one raster (NaN on NoData or off the
+    raster). Uncompressed rasters are memory mapped, so only the pages
+    under the points are read.
+    '''
+
+    raster = GeoTiff(tiffile)
+    weights, cells = get_weights(raster)
+
+    return weights.apply(read_cells(raster, cells)[None, None])[0]
+
+
+def extract_batch(tiffiles):
+    '''Worker task: (tiffile, date, values, error) for each raster of a batch.'''
+
+    results = []
+    for tiffile in tiffiles:
+        try:
+            results.append((tiffile, get_rasterdate(tiffile), extract_raster(tiffile), None))
+        except Exception as exception:
+            results.append((tiffile, get_rasterdate(tiffile), None, str(exception)))
+
+    return results
+
+
+def extract_block(tiffiles):
+    '''
+    Worker task: extract a block of B daily rasters at once, with one
+    gather of the sampled cells and weighted sum over the stacked (B, cells)
+    samples of each grid instead of one per raster.
+
+    :return: tiffiles, dates, (B x points) values with NaN rows for
+             unreadable rasters, list of (tiffile, error).
+    '''
+
+    values = numpy.full((len(tiffiles), len(_worker['x'])), numpy.nan, dtype=numpy.float32)
+    errors, grids = [], {}
+    for index, tiffile in enumerate(tiffiles):
+        try:
+            raster = GeoTiff(tiffile)
+            weights, cells = get_weights(raster)
+            grids.setdefault(id(weights), (weights, [], []))
+            grids[id(weights)][1].append(index)
+            grids[id(weights)][2].append(read_cells(raster, cells))
+        except Exception as exception:
+            errors.append((tiffile, str(exception)))
+
+    for weights, indices, samples in grids.values():
+        values[indices] = weights.apply(numpy.stack(samples)[:, None])
+
+    return tiffiles, [get_rasterdate(tiffile) for tiffile in tiffiles], values, errors
+
+
+################ 3. Running the pool.
+
+def run_pool(task, batches, x, y, interpolate=False, processes=None):
+    '''
+    Run a worker task over batches of rasters, in order, on a pool whose
+    workers were given the points once; processes=0 runs inline.
+    '''
+
+    if processes == 0:
+        init_worker(x, y, interpolate)
+        for batch in batches:
+            yield task(batch)
+        return
+
+    # Inside ArcMap / ArcGIS Pro sys.executable is the application,
+    # which must not be started once per worker.
+    if os.name == 'nt' and not os.path.basename(sys.executable).lower().startswith('python'):
+        multiprocessing.set_executable(os.path.join(sys.exec_prefix, 'pythonw.exe'))
+
+    pool = multiprocessing.Pool(processes, initializer=init_worker, initargs=(x, y, interpolate))
+    try:
+        for result in pool.imap(task, batches):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def extract_rasters(tiffiles, x, y, interpolate=False, processes=None, batchsize=16):
+    '''
+    Extract point values from many rasters on a process pool.
+
+    Results come back in the order of tiffiles, so the caller can write
+    them as they arrive. A raster that cannot be read is returned with
+    values None and the error message instead of stopping the run.
+
+    :param tiffiles: daily GeoTIFFs, all on the same grid or not.
+    :param x, y: point longitudes and latitudes (WGS 84).
+    :param interpolate: bilinear interpolation (ExtractValuesToPoints
+                        INTERPOLATE) instead of the cell value.
+    :param processes: worker processes (default: all cores); 0 runs in
+                      the calling process.
+    :param batchsize: rasters per task sent to a worker.
+    :return: iterator of (tiffile, date, values, error).
+    '''
+
+    tiffiles = list(tiffiles)
+    batches = [tiffiles[i:i + batchsize] for i in range(0, len(tiffiles), batchsize)]
+
+    for results in run_pool(extract_batch, batches, x, y, interpolate, processes):
+        for result in results:
+            yield result
+
+
+def extract_blocks(tiffiles, x, y, interpolate=False, processes=0, blocksize=32):
+    '''
+    Extract point values in blocks of days, ExtractMultiValuesToPoints
+    style: each block of `blocksize` rasters becomes one
+    (days x points) array, with no per-day output.
+
+    :param processes: worker processes; 0 (default) runs in the
+                      calling process, None uses all cores.
+    :return: iterator of (tiffiles, dates, values, errors) per block
+             (see extract_block).
+    '''
+
+    tiffiles = list(tiffiles)
+    blocks = [tiffiles[i:i + blocksize] for i in range(0, len(tiffiles), blocksize)]
+
+    return run_pool(extract_block, blocks, x, y, interpolate, processes)
+
+
+def write_pointcsv(outputfile, featureids, column, values, idfield="FID"):
+    '''
+    Write one day of point values in the layout 2b produces from the
+    point shapefiles: OID, the point id field and one date column
+    (e.g. d900_1_31, as getptcolumn in 2a makes it), NoData as -9999.
+    '''
+
+    with open(outputfile, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['OID', idfield, column])
+        for oid, (featureid, value) in enumerate(zip(featureids, values)):
+            writer.writerow([oid, featureid, NODATA if numpy.isnan(value) else '{:g}'.format(value)])
+
+
+def write_pointtable(outputfile, featureids, x, y, idfield="FID"):
+    '''
+    Write the shared point table of the batched mode: OID, the point
+    id field and the WGS 84 coordinates, once for all the value tables
+    that refer to the points by id.
+    '''
+
+    with open(outputfile, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['OID', idfield, 'x', 'y'])
+        for oid, row in enumerate(zip(featureids, x, y)):
+            writer.writerow([oid] + list(row))
@@ -0,0 +1,150 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Load the next years on a background thread while the current one is processed.
+
+Reading and decompressing a yearly NetCDF file releases the GIL, so a
+single reader thread overlaps I/O with the compute of the main loop.
+"""
+
+import os
+import threading
+from collections import deque
+
+
+def get_nbytes(result):
+    '''Approximate memory held by a loaded result (arrays, packed arrays, tuples).'''
+
+    if isinstance(result, (tuple, list)):
+        return sum(get_nbytes(item) for item in result)
+
+    return getattr(result, 'nbytes', 0)
+
+
+def get_filebytes(paths):
+    '''
+    Size of files warmed into the OS page cache (a path or a list of
+    paths), which the loaders that only warm files count toward maxbytes.
+    '''
+
+    if isinstance(paths, (tuple, list)):
+        return sum(get_filebytes(path) for path in paths)
+
+    return os.path.getsize(paths) if paths and os.path.exists(paths) else 0
+
+
+def warm_file(path, chunksize=1 << 20):
+    '''
+    Read a file once so it sits in the OS page cache when arcpy
+    opens it. Used to prefetch inputs that arcpy reads itself.
+
+    :return: number of bytes read.
+    '''
+
+    nbytes = 0
+    with open(path, 'rb') as f:
+        chunk = f.read(chunksize)
+        while chunk:
+            nbytes += len(chunk)
+            chunk = f.read(chunksize)
+
+    return nbytes
+
+
+class Prefetcher(object):
+    '''
+    Iterate over loader(item) for each item, loading up to `depth`
+    items ahead on a background thread.
+
+    Iterating yields (item, result) in order. An exception raised by
+    the loader is re-raised when its item is reached, so earlier items
+    are still processed. Any other BaseException (SystemExit,
+    KeyboardInterrupt) also stops the loader there.
+
+    :param loader: function taking one item (e.g. a NetCDF path).
+    :param items: items to load, in processing order.
+    :param depth: number of loaded items kept ahead; 0 loads inline.
+    :param maxbytes: optional cap on the memory of loaded items waiting
+                     to be processed. One item is always allowed, so a
+                     single year larger than the cap still goes through.
+    :param sizer: memory of a loaded result, get_nbytes by default;
+                  get_filebytes for loaders that warm files for arcpy.
+    '''
+
+    def __init__(self, loader, items, depth=2, maxbytes=None, sizer=get_nbytes):
+
+        self.loader = loader
+        self.items = list(items)
+        self.depth = depth
+        self.maxbytes = maxbytes
+        self.sizer = sizer
+
+        self._ready = deque()
+        self._nbytes = 0
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def _is_full(self):
+
+        if len(self._ready) >= self.depth:
+            return True
+
+        return bool(self._ready) and self.maxbytes is not None and self._nbytes >= self.maxbytes
+
+    def _run(self):
+
+        for item in self.items:
+            with self._condition:
+                while self._is_full() and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+
+            # Whatever the loader raises must reach the consumer, or it
+            # would wait for this item forever.
+            try:
+                result, error = self.loader(item), None
+                nbytes = self.sizer(result)
+            except BaseException as exception:
+                result, error, nbytes = None, exception, 0
+
+            with self._condition:
+                self._ready.append((item, result, error, nbytes))
+                self._nbytes += nbytes
+                self._condition.notify_all()
+
+            if error is not None and not isinstance(error, Exception):
+                return
+
+    def __iter__(self):
+
+        if self.depth <= 0:
+            for item in self.items:
+                yield item, self.loader(item)
+            return
+
+        self._thread = threading.Thread(target=self._run, name="noaatools-prefetch")
+        self._thread.daemon = True
+        self._thread.start()
+
+        try:
+            for _ in self.items:
+                with self._condition:
+                    while not self._ready:
+                        self._condition.wait()
+                    item, result, error, nbytes = self._ready.popleft()
+                    self._nbytes -= nbytes
+                    self._condition.notify_all()
+
+                if error is not None:
+                    raise error
+                yield item, result
+        finally:
+            self.close()
+
+    def close(self):
+        '''Stop the background thread after its current load.'''
+
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
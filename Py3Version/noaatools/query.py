@@ -0,0 +1,178 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Query extracted series from a long store by feature and date window.
+
+Instead of parsing the merged CSVs, a query looks the features up in
+the store's id -> index hash table, picks the segments overlapping the
+date window and, since a segment of consecutive days holds day d of a
+feature at offsets[feature] + (d - start), reads only that slice of the
+memory-mapped records. Decoded (segment, feature) blocks are kept in an
+LRU cache so repeated interactive queries skip the disk altogether:
+
+    >>> query = SeriesQuery('output/prate_pt.lts')
+    >>> dates, values = query.get_series(['FR101', 'FR102'], '1950-01-01', '1959-12-31')
+    >>> means = query.get_series(['FR101', 'FR102'], '1950-01-01', '1959-12-31', agg='mean')
+"""
+
+from collections import OrderedDict
+
+import numpy
+
+from .longstore import LongStore
+from .points import NODATA
+
+
+# Aggregations over the date window; NaN (and NoData) days are left out.
+AGGREGATIONS = {'mean': numpy.nanmean,
+                'sum': numpy.nansum,
+                'min': numpy.nanmin,
+                'max': numpy.nanmax,
+                'count': lambda values, axis: numpy.sum(~numpy.isnan(values), axis=axis)}
+
+
+class BlockCache(object):
+    '''
+    LRU cache of decoded blocks.
+
+    :param maxblocks: blocks kept; the least recently used is dropped
+                      when full.
+    '''
+
+    def __init__(self, maxblocks=256):
+
+        self.maxblocks = maxblocks
+        self.hits = self.misses = 0
+        self._blocks = OrderedDict()
+
+    def get(self, key, loader):
+        '''The block of a key, calling loader() only when it is not cached.'''
+
+        if key in self._blocks:
+            self.hits += 1
+            self._blocks.move_to_end(key)
+            return self._blocks[key]
+
+        self.misses += 1
+        block = loader()
+        self._blocks[key] = block
+        while len(self._blocks) > self.maxblocks:
+            self._blocks.popitem(last=False)
+
+        return block
+
+    def clear(self):
+
+        self._blocks.clear()
+
+
+class SeriesQuery(object):
+    '''
+    Date-window queries on a long store (longstore.LongStore).
+
+    :param store: LongStore, or the path of its folder.
+    :param cacheblocks: (segment, feature) blocks kept in the LRU cache.
+    '''
+
+    def __init__(self, store, cacheblocks=256):
+
+        self.store = store if isinstance(store, LongStore) else LongStore(store)
+        self.cache = BlockCache(cacheblocks)
+
+    def get_features(self, featureids):
+        '''Store index of every feature id (KeyError for unknown ids).'''
+
+        try:
+            return [self.store.featureindex[str(featureid)] for featureid in featureids]
+        except KeyError as error:
+            raise KeyError("Feature {} is not in {}".format(error.args[0], self.store.path))
+
+    def get_block(self, segment, feature):
+        '''Dates and values (NoData as NaN) of one feature in one segment, cached.'''
+
+        def load():
+            dates, values = self.store.read_segment(segment, feature)
+            values[values == NODATA] = numpy.nan
+            return dates, values
+
+        return self.cache.get((segment['name'], feature), load)
+
+    def get_rows(self, segment, start, end):
+        '''Rows of a segment between start and end (inclusive), by offset arithmetic.'''
+
+        ndays = segment['ndays']
+        if segment['consecutive']:
+            first = numpy.datetime64(segment['start'], 'D')
+            low = 0 if start is None else int((start - first).astype(int))
+            high = ndays if end is None else int((end - first).astype(int)) + 1
+            return slice(min(max(low, 0), ndays), min(max(high, 0), ndays))
+
+        dates = self.get_block(segment, 0)[0]
+        low = 0 if start is None else numpy.searchsorted(dates, start, 'left')
+        high = ndays if end is None else numpy.searchsorted(dates, end, 'right')
+
+        return slice(low, high)
+
+    def get_series(self, featureids, start=None, end=None, agg=None, frame=False):
+        '''
+        Series of some features over a date window.
+
+        :param featureids: one feature id or a list of them.
+        :param start: first date (inclusive), e.g. '1950-01-01'; None
+                      from the first stored day.
+        :param end: last date (inclusive); None up to the last stored day.
+        :param agg: None for the daily values, or 'mean', 'sum', 'min',
+                    'max', 'count' (or a function values, axis -> result)
+                    to reduce the window to one value per feature.
+        :param frame: return a pandas DataFrame (dates x features) or,
+                      with agg, a Series indexed by feature id.
+        :return: dates, (days x features) float32 values; or the
+                 aggregated values, one per feature.
+        '''
+
+        single = isinstance(featureids, (str, int, numpy.integer))
+        featureids = [featureids] if single else list(featureids)
+        features = self.get_features(featureids)
+        start = None if start is None else numpy.datetime64(start, 'D')
+        end = None if end is None else numpy.datetime64(end, 'D')
+
+        segments = [segment for segment in self.store.segments
+                    if (end is None or numpy.datetime64(segment['start'], 'D') <= end) and
+                    (start is None or numpy.datetime64(segment['end'], 'D') >= start)]
+
+        dates = [numpy.zeros(0, dtype='datetime64[D]')]
+        values = [numpy.zeros((0, len(features)), dtype=numpy.float32)]
+        for segment in segments:
+            rows = self.get_rows(segment, start, end)
+            dates.append(self.get_block(segment, features[0])[0][rows])
+            values.append(numpy.stack([self.get_block(segment, feature)[1][rows]
+                                       for feature in features], axis=1))
+        dates, values = numpy.concatenate(dates), numpy.concatenate(values)
+
+        if agg is not None:
+            function = AGGREGATIONS[agg] if isinstance(agg, str) else agg
+            with numpy.errstate(invalid='ignore'):
+                result = numpy.asarray(function(values, axis=0)) if len(values) else \
+                    numpy.full(len(features), numpy.nan)
+            if frame:
+                import pandas
+                return pandas.Series(result, index=featureids, name=agg if isinstance(agg, str) else None)
+            return result[0] if single else result
+
+        if frame:
+            import pandas
+            return pandas.DataFrame(values, index=pandas.DatetimeIndex(dates, name='date'),
+                                    columns=featureids)
+        return dates, values[:, 0] if single else values
+
+
+# One SeriesQuery (and cache) per store for get_series.
+_queries = {}
+
+
+def get_series(storepath, featureids, start=None, end=None, agg=None, frame=False):
+    '''SeriesQuery.get_series on the store at storepath, keeping its cache between calls.'''
+
+    if storepath not in _queries:
+        _queries[storepath] = SeriesQuery(storepath)
+
+    return _queries[storepath].get_series(featureids, start, end, agg, frame)
@@ -0,0 +1,239 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Burn polygons onto a lat/lon grid with a vectorized scanline rasterizer.
+
+Each grid cell is split into supersample x supersample sub-cells. For
+every row of sub-cell centres the crossings of all polygon edges are
+computed at once, sorted per (feature, row) and paired even-odd into
+inside spans, so holes and multi-part features need no special cases.
+The spans then give either a label grid at sub-cell resolution or, per
+feature and grid cell, the number of covered sub-cells, the sub-cell
+precision that 2c got by resampling every daily raster to 0.04 degrees.
+
+Grids may have irregular (Gaussian) rows; their edges are placed half
+way between the row centres. Longitudes of a global grid wrap, so
+polygons in -180..180 burn onto a 0..360 grid.
+"""
+
+import numpy
+
+from .extract import WeightMatrix
+from .shapes import get_ranges, read_polygons
+
+
+################ 1. Sampling the grid.
+
+def get_rowedges(lats):
+    '''
+    Latitude edges of the grid rows (len(lats) + 1 values, in row
+    order), half way between row centres and clamped to the poles.
+    '''
+
+    lats = numpy.asarray(lats, dtype=numpy.float64)
+    middles = (lats[1:] + lats[:-1]) / 2.0
+    first = lats[0] - (middles[0] - lats[0])
+    last = lats[-1] + (lats[-1] - middles[-1])
+
+    return numpy.clip(numpy.concatenate([[first], middles, [last]]), -90.0, 90.0)
+
+
+def get_samplerows(lats, supersample):
+    '''Latitude of the centre of every sub-cell row, in row order.'''
+
+    edges = get_rowedges(lats)
+    fractions = (numpy.arange(supersample) + 0.5) / supersample
+
+    return (edges[:-1, None] + (edges[1:] - edges[:-1])[:, None] * fractions).ravel()
+
+
+################ 2. Scanline spans.
+
+def get_edges(polygons):
+    '''
+    All ring edges as arrays x0, y0, x1, y1 and the feature of each.
+    Every ring is closed by an edge from its last to its first vertex
+    (zero length when the ring is already closed).
+    '''
+
+    coords = polygons.coords
+    ringfeatures = polygons.get_ringfeatures()
+    ringsizes = numpy.diff(polygons.ringoffsets)
+
+    following = numpy.arange(1, len(coords) + 1)
+    lastvertices = polygons.ringoffsets[1:] - 1
+    following[lastvertices[ringsizes > 0]] = polygons.ringoffsets[:-1][ringsizes > 0]
+
+    return (coords[:, 0], coords[:, 1], coords[following, 0], coords[following, 1],
+            numpy.repeat(ringfeatures, ringsizes))
+
+
+def get_spans(polygons, sampley):
+    '''
+    Inside spans of every feature along horizontal sample lines.
+
+    A sample line at y crosses an edge when min(y0, y1) <= y < max(y0, y1),
+    which counts vertices on the line once.
+
+    :param sampley: y of each sample line (any order).
+    :return: feature, line index, x start, x end of each span.
+    '''
+
+    x0, y0, x1, y1, features = get_edges(polygons)
+    order = numpy.argsort(sampley)
+    sortedy = numpy.asarray(sampley, dtype=numpy.float64)[order]
+
+    ymin, ymax = numpy.minimum(y0, y1), numpy.maximum(y0, y1)
+    first = numpy.searchsorted(sortedy, ymin, 'left')
+    counts = numpy.searchsorted(sortedy, ymax, 'left') - first
+
+    edges = numpy.repeat(numpy.arange(len(x0)), counts)
+    lines = get_ranges(first, counts)
+    y = sortedy[lines]
+    crossx = x0[edges] + (y - y0[edges]) * (x1[edges] - x0[edges]) / (y1[edges] - y0[edges])
+    crossfeatures = features[edges]
+    lines = order[lines]
+
+    # Sort crossings by feature, line and x; consecutive pairs within a
+    # (feature, line) group are the inside spans.
+    sort = numpy.lexsort((crossx, lines, crossfeatures))
+    crossx, lines, crossfeatures = crossx[sort], lines[sort], crossfeatures[sort]
+
+    groups = crossfeatures.astype(numpy.int64) * len(sortedy) + lines
+    groupstart = numpy.flatnonzero(numpy.concatenate([[True], groups[1:] != groups[:-1]]))
+    rank = numpy.arange(len(groups)) - numpy.repeat(groupstart, numpy.diff(numpy.append(groupstart,
+                                                                                       len(groups))))
+    starts = numpy.flatnonzero(rank % 2 == 0)
+    starts = starts[starts + 1 < len(groups)]
+    starts = starts[groups[starts + 1] == groups[starts]]
+
+    return crossfeatures[starts], lines[starts], crossx[starts], crossx[starts + 1]
+
+
+def get_samplecolumns(lons, supersample, xstart, xend):
+    '''
+    Sub-cell columns whose centres fall in [xstart, xend), wrapping
+    around a global grid.
+
+    :return: span index, first column, end column (exclusive) of each
+             column range; a span crossing the grid edge gives two.
+    '''
+
+    lons = numpy.asarray(lons, dtype=numpy.float64)
+    dlon = float(lons[1] - lons[0])
+    origin = lons[0] - dlon / 2.0
+    step = dlon / supersample
+    ncolumns = len(lons) * supersample
+
+    shifts = [0.0]
+    if abs(len(lons) * dlon - 360.0) < dlon / 2.0:
+        shifts = [-720.0, -360.0, 0.0, 360.0]
+
+    spans, firsts, ends = [], [], []
+    index = numpy.arange(len(xstart))
+    for shift in shifts:
+        first = numpy.ceil((xstart + shift - origin) / step - 0.5).astype(numpy.int64)
+        end = numpy.ceil((xend + shift - origin) / step - 0.5).astype(numpy.int64)
+        first, end = numpy.clip(first, 0, ncolumns), numpy.clip(end, 0, ncolumns)
+        keep = end > first
+        spans.append(index[keep])
+        firsts.append(first[keep])
+        ends.append(end[keep])
+
+    return numpy.concatenate(spans), numpy.concatenate(firsts), numpy.concatenate(ends)
+
+
+def get_gridspans(polygons, grid, supersample):
+    '''Spans of every feature as (feature, sub-cell row, first column, end column).'''
+
+    features, rows, xstart, xend = get_spans(polygons, get_samplerows(grid.lats, supersample))
+    spans, firsts, ends = get_samplecolumns(grid.lons, supersample, xstart, xend)
+
+    return features[spans], rows[spans], firsts, ends
+
+
+################ 3. Labels and coverage.
+
+def rasterize_labels(polygons, grid, supersample=1):
+    '''
+    Label grid at sub-cell resolution: the index of the feature
+    covering each sub-cell centre, -1 outside all features. Where
+    features overlap the higher index wins.
+
+    :param grid: grid.Grid (regular or Gaussian rows).
+    :return: (rows * supersample, columns * supersample) int32 array.
+    '''
+
+    nrows, ncolumns = grid.shape
+    labels = numpy.full((nrows * supersample, ncolumns * supersample), -1, dtype=numpy.int32)
+
+    features, rows, firsts, ends = get_gridspans(polygons, grid, supersample)
+    order = numpy.argsort(features, kind='stable')
+    features, rows, firsts, ends = features[order], rows[order], firsts[order], ends[order]
+
+    counts = ends - firsts
+    labels[numpy.repeat(rows, counts), get_ranges(firsts, counts)] = numpy.repeat(features, counts)
+
+    return labels
+
+
+def rasterize_coverage(polygons, grid, supersample=4):
+    '''
+    Number of covered sub-cells of every feature in every grid cell.
+
+    :param grid: grid.Grid (regular or Gaussian rows).
+    :return: features, flat cell indices, counts (0 < count <=
+             supersample ** 2), sorted by feature then cell.
+    '''
+
+    nrows, ncolumns = grid.shape
+    features, rows, firsts, ends = get_gridspans(polygons, grid, supersample)
+
+    # Split each span at cell boundaries and count its sub-cells per cell.
+    firstcells = firsts // supersample
+    ncells = (ends - 1) // supersample - firstcells + 1
+    spans = numpy.repeat(numpy.arange(len(features)), ncells)
+    cellcolumns = get_ranges(firstcells, ncells)
+    counts = numpy.minimum(ends[spans], (cellcolumns + 1) * supersample) - \
+        numpy.maximum(firsts[spans], cellcolumns * supersample)
+
+    keys = (features[spans].astype(numpy.int64) * nrows + rows[spans] // supersample) * ncolumns + cellcolumns
+    keys, inverse = numpy.unique(keys, return_inverse=True)
+    totals = numpy.bincount(inverse, weights=counts).astype(numpy.int64)
+
+    return keys // grid.size, keys % grid.size, totals
+
+
+def get_zoneweights(polygons, grid, supersample=4, zones=None, nzones=None):
+    '''
+    Zonal-mean weights of polygon features: each cell weighted by the
+    share of it the feature covers. Unlike a label grid, a cell shared
+    by several features counts towards each of them.
+
+    :param polygons: shapes.Polygons, or the path of a polygon shapefile.
+    :param zones: optional zone index of every feature (-1 to leave it
+                  out); features of one zone are averaged together, like
+                  features sharing a zone field value in
+                  ZonalStatisticsAsTable. Defaults to one zone per feature.
+    :param nzones: number of zones (default: max zone + 1).
+    :return: extract.WeightMatrix on the grid, one row per zone.
+    '''
+
+    if isinstance(polygons, str):
+        polygons = read_polygons(polygons)
+    if zones is None:
+        zones = numpy.arange(polygons.nfeatures)
+    zones = numpy.asarray(zones, dtype=numpy.int64)
+    if nzones is None:
+        nzones = int(zones.max()) + 1 if len(zones) else 0
+
+    features, cells, counts = rasterize_coverage(polygons, grid, supersample)
+
+    # Sum the coverage of the features of a zone per cell.
+    features = zones[features]
+    keep = features >= 0
+    keys, inverse = numpy.unique(features[keep] * grid.size + cells[keep], return_inverse=True)
+    counts = numpy.bincount(inverse, weights=counts[keep])
+    features, cells = keys // grid.size, keys % grid.size
+
+    return WeightMatrix(numpy.searchsorted(features, numpy.arange(nzones + 1)), cells,
+                        counts / float(supersample ** 2), grid.shape)
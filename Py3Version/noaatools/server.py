@@ -0,0 +1,411 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""A small local query server over the NetCDF cubes and long stores.
+
+Analysts on other machines ask for series over HTTP (or a Unix socket
+on the same machine) instead of copying and parsing the merged CSVs:
+
+    /point?variable=prate&lat=48.85&lon=2.35&start=1950-01-01&end=1950-12-31[&interpolate=1]
+    /series?store=prate_pg&ids=FR101,FR102&start=1950-01-01&end=1959-12-31[&agg=mean]
+    /polygon?variable=prate&shp=/data/nuts2.shp&start=1950-01-01&end=1950-12-31[&supersample=8]
+    /polygon?variable=prate&coords=2,48,3,48,3,49,2,49&start=1950-01-01&end=1950-01-31
+    /stats
+
+Points and polygons are read from the yearly NetCDF files (only the
+window around them, see grid.Grid.get_window); feature ids from the
+long stores (longstore, query) in the store folder. Responses are JSON.
+
+Encoded responses are kept in an LRU cache bounded by their size in
+bytes, and identical requests arriving while one is being computed
+wait for that result instead of computing it again.
+
+    python -m noaatools.server --inputpath D:\\noaa --storepath D:\\noaa\\output --port 8765
+    python -m noaatools.server --storepath /data/output --socket /tmp/noaa.sock
+"""
+
+import argparse
+import http.client
+import json
+import os
+import socket
+import socketserver
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+import numpy
+
+from . import cube, query, rasterize, shapes, variables as noaavariables
+from .grid import Grid
+
+
+################ 1. Response cache.
+
+class ResponseCache(object):
+    '''
+    Thread-safe LRU cache of encoded responses, evicting by total size.
+    Identical requests that arrive while one is being computed wait for
+    its result (request coalescing); errors are passed on, not cached.
+
+    :param maxbytes: total size of the cached responses.
+    '''
+
+    def __init__(self, maxbytes=64 * 2 ** 20):
+
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self.hits = self.misses = self.coalesced = 0
+        self._entries = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, compute):
+        '''The response of a key, calling compute() once however many threads ask.'''
+
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            pending = self._pending.get(key)
+            owner = pending is None
+            if owner:
+                self.misses += 1
+                pending = self._pending[key] = {'done': threading.Event(), 'value': None, 'error': None}
+            else:
+                self.coalesced += 1
+
+        if not owner:
+            pending['done'].wait()
+            if pending['error'] is not None:
+                raise pending['error']
+            return pending['value']
+
+        try:
+            pending['value'] = value = compute()
+            with self._lock:
+                if len(value) <= self.maxbytes:
+                    self._entries[key] = value
+                    self.nbytes += len(value)
+                while self.nbytes > self.maxbytes:
+                    _, evicted = self._entries.popitem(last=False)
+                    self.nbytes -= len(evicted)
+            return value
+        except Exception as error:
+            pending['error'] = error
+            raise
+        finally:
+            with self._lock:
+                del self._pending[key]
+            pending['done'].set()
+
+    def get_stats(self):
+
+        with self._lock:
+            return {'entries': len(self._entries), 'nbytes': self.nbytes, 'maxbytes': self.maxbytes,
+                    'hits': self.hits, 'misses': self.misses, 'coalesced': self.coalesced}
+
+
+################ 2. Queries.
+
+def get_dateparameter(params, name):
+    '''A date parameter as numpy.datetime64 (required).'''
+
+    if not params.get(name):
+        raise ValueError("Missing parameter {}".format(name))
+
+    return numpy.datetime64(params[name], 'D')
+
+
+def get_jsonvalues(values):
+    '''Floats for JSON, NaN as null.'''
+
+    values = numpy.asarray(values, dtype=numpy.float64)
+
+    return numpy.where(numpy.isnan(values), None, values.round(6)).tolist()
+
+
+class QueryService(object):
+    '''
+    Answers the server's requests.
+
+    :param inputpath: folder with the yearly NetCDF files (points, polygons).
+    :param storepath: folder searched for long stores (*.lts) by name.
+    '''
+
+    def __init__(self, inputpath=None, storepath=None):
+
+        self.inputpath = inputpath
+        self.storepath = storepath
+        self._grids = {}
+        self._zoneweights = {}
+        self._queries = {}
+        self._zonelock = threading.Lock()
+        self._querylock = threading.Lock()
+        self._netcdflock = threading.Lock()
+
+    def get_grid(self, variable, years):
+        '''Grid of a variable, read once from its first yearly file found.'''
+
+        if self.inputpath is None:
+            raise ValueError("The server has no NetCDF input folder")
+
+        if variable.name not in self._grids:
+            paths = [variable.get_filepath(self.inputpath, year) for year in years]
+            paths = [path for path in paths if os.path.exists(path)]
+            if not paths:
+                raise ValueError("No {} files for {}-{}".format(variable.name, years[0], years[-1]))
+            with self._netcdflock:
+                self._grids[variable.name] = Grid.from_netcdf(paths[0])
+
+        return self._grids[variable.name]
+
+    def read_cube(self, variable, weights, x, y, start, end):
+        '''
+        Weighted series of the features of a WeightMatrix between two
+        dates, reading only the window around x, y of each year.
+
+        :return: dates, (days x features) values.
+        '''
+
+        years = list(range(start.astype(object).year, end.astype(object).year + 1))
+        grid = self.get_grid(variable, years)
+        window = grid.get_window(x, y)
+        weights = weights.to_window(window)
+
+        dates, values = [], []
+        for year in years:
+            path = variable.get_filepath(self.inputpath, year)
+            if not os.path.exists(path):
+                continue
+            # The netCDF/HDF5 libraries are not safe to call from several threads.
+            with self._netcdflock:
+                yearcube, yeardates = cube.load_yearcube(path, variable.name, variable.units, window=window)
+            keep = (yeardates >= start) & (yeardates <= end)
+            if not keep.any():
+                continue
+            dates.append(yeardates[keep])
+            values.append(weights.apply(yearcube[keep]))
+
+        if not dates:
+            return numpy.zeros(0, dtype='datetime64[D]'), numpy.zeros((0, weights.nfeatures))
+
+        return numpy.concatenate(dates), numpy.concatenate(values)
+
+    def get_point(self, params):
+
+        variable = noaavariables.get_variable(params.get('variable', 'prate'))
+        start, end = get_dateparameter(params, 'start'), get_dateparameter(params, 'end')
+        x, y = numpy.array([float(params['lon'])]), numpy.array([float(params['lat'])])
+
+        grid = self.get_grid(variable, list(range(start.astype(object).year, end.astype(object).year + 1)))
+        weights = grid.locate_points(x, y, params.get('interpolate', '0') not in ('0', 'false', ''))
+        dates, values = self.read_cube(variable, weights, x, y, start, end)
+
+        return {'variable': variable.name, 'units': variable.units, 'lat': y[0], 'lon': x[0],
+                'dates': [str(date) for date in dates], 'values': get_jsonvalues(values[:, 0])}
+
+    def get_polygon(self, params):
+
+        variable = noaavariables.get_variable(params.get('variable', 'prate'))
+        start, end = get_dateparameter(params, 'start'), get_dateparameter(params, 'end')
+        supersample = int(params.get('supersample', 8))
+
+        if params.get('shp'):
+            polygons = shapes.read_polygons(params['shp'])
+        elif params.get('coords'):
+            coords = numpy.array([float(value) for value in params['coords'].split(',')]).reshape(-1, 2)
+            polygons = shapes.Polygons(coords, numpy.array([0, len(coords)]), numpy.array([0, 1]),
+                                       numpy.array([[coords[:, 0].min(), coords[:, 1].min(),
+                                                     coords[:, 0].max(), coords[:, 1].max()]]))
+        else:
+            raise ValueError("Give a polygon shapefile (shp) or coordinates (coords)")
+
+        grid = self.get_grid(variable, list(range(start.astype(object).year, end.astype(object).year + 1)))
+        # A shapefile replaced on disk gets new weights.
+        key = (params.get('shp') or params['coords'], os.path.getmtime(params['shp']) if params.get('shp') else None,
+               variable.name, supersample)
+        with self._zonelock:
+            if key not in self._zoneweights:
+                self._zoneweights[key] = rasterize.get_zoneweights(polygons, grid, supersample)
+        dates, values = self.read_cube(variable, self._zoneweights[key], polygons.coords[:, 0],
+                                       polygons.coords[:, 1], start, end)
+
+        return {'variable': variable.name, 'units': variable.units,
+                'dates': [str(date) for date in dates],
+                'values': [get_jsonvalues(column) for column in values.T]}
+
+    def get_query(self, name):
+        '''SeriesQuery of the store called name (e.g. prate_pt for prate_pt.lts).'''
+
+        if name not in self._queries:
+            storefolder = None
+            for path, subdirs, files in os.walk(self.storepath or '.'):
+                if name + '.lts' in subdirs:
+                    storefolder = os.path.join(path, name + '.lts')
+                    break
+            if storefolder is None:
+                raise KeyError("No store {}".format(name))
+            self._queries[name] = query.SeriesQuery(storefolder)
+
+        return self._queries[name]
+
+    def get_series(self, params):
+
+        featureids = [featureid for featureid in params.get('ids', '').split(',') if featureid]
+        if not featureids:
+            raise ValueError("Missing parameter ids")
+        agg = params.get('agg') or None
+        if agg is not None and agg not in query.AGGREGATIONS:
+            raise ValueError("Unknown aggregation {}".format(agg))
+
+        # SeriesQuery and its block cache are not thread-safe.
+        with self._querylock:
+            seriesquery = self.get_query(params.get('store', ''))
+            result = seriesquery.get_series(featureids, params.get('start') or None,
+                                            params.get('end') or None, agg)
+
+        if agg is not None:
+            return {'store': params['store'], 'agg': agg,
+                    'values': dict(zip(featureids, get_jsonvalues(result)))}
+        dates, values = result
+
+        return {'store': params['store'], 'dates': [str(date) for date in dates],
+                'values': dict(zip(featureids, [get_jsonvalues(column) for column in values.T]))}
+
+    def handle(self, endpoint, params):
+        '''Result of a request as a JSON-serialisable dict.'''
+
+        handlers = {'/point': self.get_point, '/polygon': self.get_polygon, '/series': self.get_series}
+        if endpoint not in handlers:
+            raise KeyError("Unknown endpoint {}".format(endpoint))
+
+        return handlers[endpoint](params)
+
+
+################ 3. Server.
+
+class QueryHandler(BaseHTTPRequestHandler):
+    '''GET handler; the server carries the service and the cache.'''
+
+    def do_GET(self):
+
+        url = urlsplit(self.path)
+        params = dict(parse_qsl(url.query))
+
+        if url.path == '/stats':
+            return self.send(200, json.dumps(self.server.cache.get_stats()).encode('utf-8'))
+
+        key = (url.path, tuple(sorted(params.items())))
+        try:
+            body = self.server.cache.get(key, lambda: json.dumps(self.server.service.handle(url.path, params),
+                                                                 allow_nan=False).encode('utf-8'))
+        except (KeyError, ValueError) as error:
+            return self.send(404 if isinstance(error, KeyError) else 400,
+                             json.dumps({'error': str(error)}).encode('utf-8'))
+        except Exception as error:
+            return self.send(500, json.dumps({'error': repr(error)}).encode('utf-8'))
+
+        self.send(200, body)
+
+    def send(self, status, body):
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+
+        if not self.server.quiet:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class QueryHTTPServer(ThreadingHTTPServer):
+    '''Threaded HTTP server with room for many waiting connections.'''
+
+    request_queue_size = 128
+
+
+# Unix sockets are not available on Windows; serve on host:port there.
+if hasattr(socketserver, 'UnixStreamServer'):
+
+    class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        '''HTTP over a Unix socket, for clients on the same machine.'''
+
+        daemon_threads = True
+        request_queue_size = 128
+
+        def get_request(self):
+
+            request, _ = socketserver.UnixStreamServer.get_request(self)
+            return request, ('unix', 0)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    '''http.client connection to a UnixHTTPServer socket.'''
+
+    def __init__(self, socketpath, timeout=60):
+
+        http.client.HTTPConnection.__init__(self, 'localhost', timeout=timeout)
+        self.socketpath = socketpath
+
+    def connect(self):
+
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socketpath)
+
+
+def make_server(service, host='127.0.0.1', port=8765, socketpath=None, cachebytes=64 * 2 ** 20,
+                quiet=False):
+    '''
+    A threaded HTTP server (or Unix socket server when socketpath is
+    given) answering with a QueryService through a ResponseCache.
+    Call serve_forever() on it.
+    '''
+
+    if socketpath:
+        if os.path.exists(socketpath):
+            os.remove(socketpath)
+        server = UnixHTTPServer(socketpath, QueryHandler)
+    else:
+        server = QueryHTTPServer((host, port), QueryHandler)
+    server.service = service
+    server.cache = ResponseCache(cachebytes)
+    server.quiet = quiet
+
+    return server
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(prog='python -m noaatools.server', description=__doc__.split('\n')[0])
+    parser.add_argument('--inputpath', help='folder with the yearly NetCDF files')
+    parser.add_argument('--storepath', help='folder with the long stores (*.lts)')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--socket', help='serve on this Unix socket instead of host:port')
+    parser.add_argument('--cachemb', type=float, default=64, help='response cache size in MB')
+    parser.add_argument('--quiet', action='store_true', help='do not log requests')
+    args = parser.parse_args(argv)
+
+    server = make_server(QueryService(args.inputpath, args.storepath), args.host, args.port, args.socket,
+                         int(args.cachemb * 2 ** 20), args.quiet)
+    print('Serving on {}'.format(args.socket or '{}:{}'.format(args.host, args.port)))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
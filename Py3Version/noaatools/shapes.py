@@ -0,0 +1,236 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Read shapefile geometry (.shp/.shx) into flat NumPy arrays.
+
+The .shp is memory-mapped and the record offsets come from the .shx,
+so coordinates are gathered for all features at once instead of being
+turned into one Python object per feature:
+
+    points   -> (n, 2) float64 x/y
+    polygons -> coords (m, 2), ringoffsets (rings + 1) into coords and
+                featureoffsets (n + 1) into rings (CSR style)
+
+These feed grid.Grid.locate_points, Grid.get_window and the rasterizer
+directly. Coordinates are returned as stored; the extraction stages
+expect WGS 84 longitudes and latitudes.
+"""
+
+import os
+import struct
+
+import numpy
+
+
+# Shape types.
+NULLSHAPE = 0
+POINTTYPES = (1, 11, 21)
+POLYLINETYPES = (3, 13, 23)
+POLYGONTYPES = (5, 15, 25)
+
+# Files that make up a shapefile besides the .shp.
+SIDECARS = ('.shx', '.dbf', '.prj', '.cpg', '.sbn', '.sbx', '.qix', '.fbn', '.fbx', '.ain', '.aih',
+            '.atx', '.ixs', '.mxs', '.shp.xml')
+
+
+################ 1. Records.
+
+def get_ranges(starts, counts):
+    '''Concatenated aranges: starts[i] .. starts[i] + counts[i] for every i.'''
+
+    counts = numpy.asarray(counts, dtype=numpy.int64)
+    total = int(counts.sum())
+    if total == 0:
+        return numpy.zeros(0, dtype=numpy.int64)
+    ends = numpy.cumsum(counts)
+
+    return numpy.repeat(numpy.asarray(starts, dtype=numpy.int64) - (ends - counts), counts) + \
+        numpy.arange(total, dtype=numpy.int64)
+
+
+def gather(buffer, starts, counts, dtype):
+    '''
+    Read counts[i] little-endian values of dtype at byte offset
+    starts[i] of a buffer, for every i, into one flat array.
+
+    Shapefile records are only 2-byte aligned, so the buffer is viewed
+    once per alignment and each view gathered with an index array.
+    '''
+
+    dtype = numpy.dtype(dtype).newbyteorder('<')
+    size = dtype.itemsize
+    starts = numpy.asarray(starts, dtype=numpy.int64)
+    counts = numpy.asarray(counts, dtype=numpy.int64)
+    positions = numpy.concatenate([[0], numpy.cumsum(counts)])[:-1]
+
+    out = numpy.empty(int(counts.sum()), dtype=dtype.newbyteorder('='))
+    for residue in numpy.unique(starts % size):
+        selected = numpy.flatnonzero(starts % size == residue)
+        view = numpy.frombuffer(buffer, dtype, count=(len(buffer) - residue) // size, offset=int(residue))
+        out[get_ranges(positions[selected], counts[selected])] = \
+            view[get_ranges((starts[selected] - residue) // size, counts[selected])]
+
+    return out
+
+
+def read_shpheader(shpfile):
+    '''
+    :return: shape type, bounding box (xmin, ymin, xmax, ymax).
+    '''
+
+    with open(shpfile, 'rb') as f:
+        header = f.read(100)
+    if struct.unpack('>i', header[:4])[0] != 9994:
+        raise ValueError("{} is not a shapefile".format(shpfile))
+
+    return struct.unpack('<i', header[32:36])[0], struct.unpack('<4d', header[36:68])
+
+
+def read_recordoffsets(shpfile):
+    '''
+    Byte offset of the content of every record (after its 8-byte
+    header), from the .shx index, or by walking the record headers of
+    the .shp when there is no .shx.
+    '''
+
+    shxfile = os.path.splitext(shpfile)[0] + '.shx'
+    if os.path.exists(shxfile):
+        index = numpy.fromfile(shxfile, dtype='>i4', offset=100).reshape(-1, 2)
+        return index[:, 0].astype(numpy.int64) * 2 + 8
+
+    offsets, position = [], 100
+    size = os.path.getsize(shpfile)
+    with open(shpfile, 'rb') as f:
+        while position + 8 <= size:
+            f.seek(position)
+            length = struct.unpack('>ii', f.read(8))[1]
+            offsets.append(position + 8)
+            position += 8 + 2 * length
+
+    return numpy.array(offsets, dtype=numpy.int64)
+
+
+def open_shp(shpfile):
+    '''Memory-map a .shp: the buffer, record offsets and the type of each record.'''
+
+    buffer = numpy.memmap(shpfile, dtype=numpy.uint8, mode='r')
+    offsets = read_recordoffsets(shpfile)
+    shapetypes = gather(buffer, offsets, numpy.ones(len(offsets)), numpy.int32)
+
+    return buffer, offsets, shapetypes
+
+
+################ 2. Points and polygons.
+
+def read_points(shpfile):
+    '''
+    Point coordinates of a point shapefile.
+
+    :return: (n, 2) float64 array of x, y; NaN for null shapes.
+    '''
+
+    buffer, offsets, shapetypes = open_shp(shpfile)
+    points = numpy.full((len(offsets), 2), numpy.nan)
+    valid = numpy.isin(shapetypes, POINTTYPES)
+    if valid.any():
+        points[valid] = gather(buffer, offsets[valid] + 4, numpy.full(valid.sum(), 2),
+                               numpy.float64).reshape(-1, 2)
+    if not numpy.isin(shapetypes, POINTTYPES + (NULLSHAPE,)).all():
+        raise ValueError("{} does not hold points".format(shpfile))
+
+    return points
+
+
+class Polygons(object):
+    '''
+    Polygon (or polyline) features as flat arrays.
+
+    :param coords: (m, 2) vertices of all rings.
+    :param ringoffsets: ring r is coords[ringoffsets[r]:ringoffsets[r + 1]].
+    :param featureoffsets: feature i has rings featureoffsets[i] .. featureoffsets[i + 1] - 1.
+    :param bboxes: (n, 4) xmin, ymin, xmax, ymax of each feature (NaN for null shapes).
+    '''
+
+    def __init__(self, coords, ringoffsets, featureoffsets, bboxes):
+
+        self.coords = coords
+        self.ringoffsets = ringoffsets
+        self.featureoffsets = featureoffsets
+        self.bboxes = bboxes
+
+    @property
+    def nfeatures(self):
+
+        return len(self.featureoffsets) - 1
+
+    @property
+    def nrings(self):
+
+        return len(self.ringoffsets) - 1
+
+    def get_ringfeatures(self):
+        '''Feature index of every ring.'''
+
+        return numpy.repeat(numpy.arange(self.nfeatures), numpy.diff(self.featureoffsets))
+
+    def get_feature(self, index):
+        '''The rings of one feature, as a list of (k, 2) arrays.'''
+
+        rings = range(self.featureoffsets[index], self.featureoffsets[index + 1])
+
+        return [self.coords[self.ringoffsets[ring]:self.ringoffsets[ring + 1]] for ring in rings]
+
+
+def read_polygons(shpfile):
+    '''
+    Geometry of a polygon (or polyline) shapefile, without one Python
+    object per feature.
+
+    :return: Polygons
+    '''
+
+    buffer, offsets, shapetypes = open_shp(shpfile)
+    if not numpy.isin(shapetypes, POLYGONTYPES + POLYLINETYPES + (NULLSHAPE,)).all():
+        raise ValueError("{} does not hold polygons".format(shpfile))
+
+    valid = shapetypes != NULLSHAPE
+    starts = offsets[valid]
+    nvalid = int(valid.sum())
+
+    bboxes = numpy.full((len(offsets), 4), numpy.nan)
+    bboxes[valid] = gather(buffer, starts + 4, numpy.full(nvalid, 4), numpy.float64).reshape(-1, 4)
+    counts = gather(buffer, starts + 36, numpy.full(nvalid, 2), numpy.int32).reshape(-1, 2)
+    nparts = numpy.zeros(len(offsets), dtype=numpy.int64)
+    nparts[valid] = counts[:, 0]
+    npoints = counts[:, 1].astype(numpy.int64)
+
+    # Part starts are relative to the feature's first point.
+    parts = gather(buffer, starts + 44, nparts[valid], numpy.int32).astype(numpy.int64)
+    coords = gather(buffer, starts + 44 + 4 * nparts[valid], 2 * npoints, numpy.float64).reshape(-1, 2)
+
+    featureoffsets = numpy.concatenate([[0], numpy.cumsum(nparts)])
+    pointoffsets = numpy.concatenate([[0], numpy.cumsum(npoints)])
+    ringoffsets = numpy.append(parts + numpy.repeat(pointoffsets[:-1], nparts[valid]), len(coords))
+
+    return Polygons(coords, ringoffsets, featureoffsets, bboxes)
+
+
+def delete_shapefile(shpfile):
+    '''
+    Delete a shapefile and its sidecar files, as Delete_management
+    does; missing files are ignored.
+    '''
+
+    base = os.path.splitext(shpfile)[0]
+    for path in [base + '.shp'] + [base + extension for extension in SIDECARS]:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def is_geographic(shpfile):
+    '''True when the .prj of a shapefile is a geographic (lat/lon) system.'''
+
+    prjfile = os.path.splitext(shpfile)[0] + '.prj'
+    if not os.path.exists(prjfile):
+        return False
+    with open(prjfile) as f:
+        return f.read().lstrip().upper().startswith('GEOGCS')
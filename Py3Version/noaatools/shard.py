@@ -0,0 +1,213 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Split a run over several machines with `--shard i/N`.
+
+Every invocation builds the same task list (e.g. the NetCDF years of
+each variable), weighs each task by its number of bands and keeps the
+tasks of its own shard. The assignment only depends on the task names
+and weights, so N independent invocations with shards 1/N .. N/N cover
+every task exactly once, with about the same number of bands each.
+
+Each shard records what it did in a small manifest, named after the
+step and variables when several steps share an output folder (e.g.
+shards/pt_prate_shard_2_of_4.json from 2a). merge-shards checks that
+all N manifests of every step are there and assembles the results:
+
+    python -m noaatools.shard merge-shards outputfolder N
+"""
+
+import calendar
+import heapq
+import json
+import os
+import re
+import sys
+
+
+################ 1. Assigning tasks to shards.
+
+def parse_shard(text):
+    '''
+    Parse "i/N" (1 <= i <= N) into (i, N); an empty text means no sharding.
+
+    :return: (i, N), or None.
+    '''
+
+    if not text:
+        return None
+
+    match = re.match(r'^\s*(\d+)\s*/\s*(\d+)\s*$', str(text))
+    if not match:
+        raise ValueError("Shard must look like i/N, e.g. 2/4, not {!r}".format(text))
+    shard, nshards = int(match.group(1)), int(match.group(2))
+    if not 1 <= shard <= nshards:
+        raise ValueError("Shard {} is not between 1 and {}".format(shard, nshards))
+
+    return shard, nshards
+
+
+def pop_shardargument(argv):
+    '''
+    Remove "--shard i/N" (or "--shard=i/N") from a command line, so the
+    positional arguments keep their places.
+
+    :return: the remaining arguments, (i, N) or None.
+    '''
+
+    argv, remaining, shard = list(argv), [], None
+    while argv:
+        argument = argv.pop(0)
+        if argument == '--shard' and argv:
+            shard = parse_shard(argv.pop(0))
+        elif argument.startswith('--shard='):
+            shard = parse_shard(argument.split('=', 1)[1])
+        else:
+            remaining.append(argument)
+
+    return remaining, shard
+
+
+def get_yearweight(year):
+    '''Number of daily bands in a year, the cost of one yearly file.'''
+
+    return 366 if calendar.isleap(int(year)) else 365
+
+
+def get_assignment(keys, weights, nshards):
+    '''
+    Assign tasks to shards, largest first, each to the least loaded
+    shard (ties go to the lower shard). Sorting by (weight, key) first
+    makes the result independent of the order of the tasks.
+
+    :param keys: unique, sortable task names.
+    :param weights: cost of each task (e.g. its band count).
+    :return: dict key -> shard number (1..nshards).
+    '''
+
+    loads = [(0, shard) for shard in range(1, nshards + 1)]
+    assignment = {}
+    for weight, key in sorted(zip(weights, keys), key=lambda task: (-task[0], task[1])):
+        load, shard = heapq.heappop(loads)
+        assignment[key] = shard
+        heapq.heappush(loads, (load + weight, shard))
+
+    return assignment
+
+
+def select_shard(items, shard, key=str, weight=lambda item: 1):
+    '''
+    Items of one shard, in their original order.
+
+    :param shard: (i, N) from parse_shard, or None for all items.
+    :param key: function giving the unique task name of an item.
+    :param weight: function giving the cost of an item.
+    '''
+
+    items = list(items)
+    if shard is None:
+        return items
+
+    keys = [key(item) for item in items]
+    assignment = get_assignment(keys, [weight(item) for item in items], shard[1])
+
+    return [item for item, itemkey in zip(items, keys) if assignment[itemkey] == shard[0]]
+
+
+################ 2. Manifests.
+
+def get_manifestfile(outputpath, shard, name=None):
+    '''
+    Manifest of a shard, e.g. output/shards/shard_2_of_4.json, or
+    output/shards/pt_prate_shard_2_of_4.json for name "pt_prate".
+    '''
+
+    return os.path.join(outputpath, 'shards', (name + '_' if name else '') +
+                        'shard_{}_of_{}.json'.format(*shard))
+
+
+def write_manifest(outputpath, shard, tasks, outputfiles, name=None):
+    '''
+    Record the tasks and output files of a finished shard. Written
+    last, so a shard without a manifest did not complete.
+
+    :param tasks: task names (keys) processed by the shard.
+    :param name: step the shard belongs to, see get_manifestfile.
+    '''
+
+    manifestfile = get_manifestfile(outputpath, shard, name)
+    if not os.path.isdir(os.path.dirname(manifestfile)):
+        os.makedirs(os.path.dirname(manifestfile))
+
+    manifest = {'shard': list(shard),
+                'tasks': list(tasks),
+                'outputfiles': [os.path.relpath(path, outputpath) for path in outputfiles]}
+    with open(manifestfile + '.part', 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(manifestfile + '.part', manifestfile)
+
+    return manifestfile
+
+
+def get_manifestnames(outputpath, nshards):
+    '''Names of the steps with a manifest of N shards in outputpath (None for unnamed ones).'''
+
+    names = set()
+    folder = os.path.join(outputpath, 'shards')
+    for filename in (os.listdir(folder) if os.path.isdir(folder) else []):
+        match = re.match(r'^(?:(.+)_)?shard_\d+_of_{}\.json$'.format(nshards), filename)
+        if match:
+            names.add(match.group(1))
+
+    return sorted(names, key=lambda name: name or '')
+
+
+def read_manifests(outputpath, nshards, names=None):
+    '''
+    Read the manifests of all shards of every step and check that
+    every shard finished and no task of a step was done twice.
+
+    :param names: steps to read (default: all found, see get_manifestnames).
+    :return: list of output files of all shards.
+    '''
+
+    if names is None:
+        names = get_manifestnames(outputpath, nshards) or [None]
+
+    outputfiles = []
+    for name in names:
+        seen = {}
+        for shard in range(1, nshards + 1):
+            manifestfile = get_manifestfile(outputpath, (shard, nshards), name)
+            if not os.path.exists(manifestfile):
+                raise IOError("Shard {}/{} has not finished ({} is missing)".format(
+                    shard, nshards, manifestfile))
+            with open(manifestfile) as f:
+                manifest = json.load(f)
+            for task in manifest['tasks']:
+                if task in seen:
+                    raise ValueError("Task {} was done by shards {} and {}".format(task, seen[task], shard))
+                seen[task] = shard
+            outputfiles.extend(os.path.join(outputpath, path) for path in manifest['outputfiles'])
+
+    return outputfiles
+
+
+################ 3. Command line.
+
+def main(argv=None):
+    '''python -m noaatools.shard merge-shards outputfolder N [manifest name]'''
+
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) not in (3, 4) or argv[0] != 'merge-shards':
+        print("Usage: python -m noaatools.shard merge-shards outputfolder N [manifest name, e.g. pt_prate]")
+        return 2
+
+    from .pipeline import merge_shards
+    for mergedfile in merge_shards(argv[1], int(argv[2]), argv[3:] or None):
+        print('Wrote {}'.format(mergedfile))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
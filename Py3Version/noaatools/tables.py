@@ -0,0 +1,93 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Read and write the CSV tables of the toolbox as NumPy arrays."""
+
+import csv
+
+import numpy
+
+
+def get_datecolumn(date):
+    '''
+    Column name used for a date in the output tables, e.g. d900_1_31
+    for 1900-01-31: the first digit of the year becomes "d" and month
+    and day are not padded, as in the rasters 2b/2c name them after.
+    '''
+
+    year, month, day = str(numpy.datetime64(date, 'D')).split('-')
+
+    return "d{}_{}_{}".format(year[1:], int(month), int(day))
+
+
+def parse_datecolumn(column):
+    '''
+    Turn a date column name written by 2b/2c (e.g. d900_01_31 or
+    d900_1_31) back into a date.
+
+    The first digit of the year was replaced by "d" to get a valid
+    field name, so the century is recovered from the next digit:
+    8 and 9 are the 1800s and 1900s, anything else the 2000s.
+
+    :param column: column name.
+    :return: numpy.datetime64 date, or None for non-date columns.
+    '''
+
+    parts = column.split('_')
+    if len(parts) != 3 or not column.startswith('d') or not all(p.isdigit() for p in
+                                                                [parts[0][1:]] + parts[1:]):
+        return None
+
+    year = parts[0][1:]
+    millennium = '1' if year[0] in '89' else '2'
+
+    return numpy.datetime64('{:04d}-{:02d}-{:02d}'.format(int(millennium + year), int(parts[1]),
+                                                       int(parts[2])), 'D')
+
+
+def read_widetable(inputfile, idfield=None):
+    '''
+    Read a merged table from 3_Merge_CSVs.py (one row per feature,
+    one dYYY_MM_DD column per day) as a (days x features) array.
+
+    :param idfield: feature id column, defaults to the first non-date column;
+                    a list of columns gives ids joined by "_" (e.g. the
+                    split field and zone field of 2c, DE_DE11).
+    :return: featureids, dates, values
+    '''
+
+    with open(inputfile, newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        rows = list(reader)
+
+    dates = [parse_datecolumn(column) for column in header]
+    datecolumns = [i for i, date in enumerate(dates) if date is not None]
+    if idfield is None:
+        idcolumns = [next(i for i, date in enumerate(dates) if date is None and header[i] != 'OID')]
+    else:
+        idcolumns = [header.index(field) for field in ([idfield] if isinstance(idfield, str) else idfield)]
+
+    featureids = ['_'.join(row[i] for i in idcolumns) for row in rows]
+    values = numpy.array([[float(row[i]) if row[i] not in ('', ' ') else numpy.nan
+                           for i in datecolumns] for row in rows], dtype=numpy.float32)
+    dates = numpy.array([dates[i] for i in datecolumns], dtype='datetime64[D]')
+
+    # Columns are appended in whatever order os.walk found the files.
+    order = numpy.argsort(dates, kind='stable')
+
+    return featureids, dates[order], values.T[order]
+
+
+def write_widetable(outputfile, featureids, dates, values, idfield="ID"):
+    '''
+    Write (days x features) values as a wide table with one row per
+    feature and one dYYY_MM_DD column per day, the layout of the
+    merged tables from 3_Merge_CSVs.py.
+    '''
+
+    with open(outputfile, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow([idfield] + [get_datecolumn(date) for date in dates])
+        for featureid, column in zip(featureids, numpy.asarray(values).T):
+            writer.writerow([featureid] + ['' if numpy.isnan(value) else '{:g}'.format(value)
+                                           for value in column])
@@ -0,0 +1,93 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""NOAA Reanalysis variables the toolbox knows how to find and read."""
+
+import os
+
+
+class NoaaVariable(object):
+    '''
+    One reanalysis variable.
+
+    :param name: NetCDF variable name, e.g. "air".
+    :param fileprefix: yearly file prefix, e.g. "air.2m" for air.2m.1900.nc
+    :param units: unit conversion for cube.load_yearcube; None keeps
+                  the native NetCDF units, as the stage 1 rasters do.
+    '''
+
+    def __init__(self, name, fileprefix=None, units=None):
+
+        self.name = name
+        self.fileprefix = fileprefix or name
+        self.units = units
+
+    def get_filename(self, year):
+        '''Yearly NetCDF file name, e.g. prate.1900.nc'''
+
+        return '.'.join(map(str, [self.fileprefix, year, 'nc']))
+
+    def get_filepath(self, inputpath, year):
+
+        return os.path.join(inputpath, self.get_filename(year))
+
+    def get_rasterpattern(self):
+        '''fnmatch pattern of the daily rasters written by stage 1.'''
+
+        return self.name + "_*.tif"
+
+    def get_spec(self):
+        '''Name as parse_variables reads it back, e.g. "prate:mm/day".'''
+
+        return self.fileprefix if self.units is None else ':'.join([self.fileprefix, str(self.units)])
+
+    def __repr__(self):
+
+        return "NoaaVariable({!r}, {!r})".format(self.name, self.fileprefix)
+
+
+# Daily 20th Century Reanalysis files, keyed by variable name. Values
+# stay in the native units (PRATE in kg m-2 s-1) unless a conversion
+# is asked for, so the NetCDF and raster paths give the same numbers.
+NOAAVARIABLES = dict((variable.name, variable) for variable in [
+    NoaaVariable("prate", "prate"),
+    NoaaVariable("air", "air.2m"),
+    NoaaVariable("tmax", "tmax.2m"),
+    NoaaVariable("tmin", "tmin.2m"),
+    NoaaVariable("rhum", "rhum.sig995"),
+    NoaaVariable("shum", "shum.2m"),
+    NoaaVariable("pres", "pres.sfc"),
+    NoaaVariable("uwnd", "uwnd.10m"),
+    NoaaVariable("vwnd", "vwnd.10m"),
+])
+
+
+def get_variable(name, units=None):
+    '''
+    Look up a variable by name or by file prefix ("air" or "air.2m").
+    Unknown names are assumed to use the name as file prefix.
+
+    :param units: opt-in unit conversion, e.g. "mm/day" for prate.
+    '''
+
+    variable = NOAAVARIABLES.get(name)
+    if variable is None:
+        variable = next((variable for variable in NOAAVARIABLES.values() if variable.fileprefix == name),
+                        None) or NoaaVariable(name.split('.')[0], name)
+
+    if units is None:
+        return variable
+
+    return NoaaVariable(variable.name, variable.fileprefix, units)
+
+
+def parse_variables(text):
+    '''
+    Parse a toolbox multivalue parameter ("prate;air;tmax") or a
+    comma separated list into NoaaVariable objects. Empty means prate.
+    A unit conversion follows the name after a colon, e.g. "prate:mm/day".
+    '''
+
+    names = [name.strip().strip("'") for name in text.replace(',', ';').split(';')] if text else []
+    names = [name for name in names if name] or ["prate"]
+
+    return [get_variable(*name.split(':', 1)) for name in names]
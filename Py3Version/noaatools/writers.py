@@ -0,0 +1,218 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Chunked, compressed binary array files written on a thread pool.
+
+A file holds one 2-D array (e.g. features x days) split into row
+chunks that are compressed independently, so a reader can decode only
+the rows it needs. Layout:
+
+    b'NCA1' | uint32 header length | JSON header | chunk payloads
+
+The JSON header records dtype, shape, codec, predictor, the byte range
+of every chunk and any attributes, including the quantization scale,
+offset and error bound when values were stored as scaled integers.
+"""
+
+import json
+import os
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+
+from . import compression
+from .packed import PackedArray
+
+
+MAGIC = b'NCA1'
+
+
+################ 1. Writing and reading one file.
+
+def encode_array(array,
+                 codec="deflate",
+                 level=6,
+                 predictor=True,
+                 precision=None,
+                 chunkrows=256,
+                 attributes=None):
+    '''
+    Quantize, predict and compress an array into the file layout.
+
+    :param array: 2-D array (a 1-D array is stored as one row), or a
+                  packed.PackedArray, stored as is with its packing.
+    :param codec: "none", "deflate", "lzw" or "zstd".
+    :param predictor: apply the TIFF-style horizontal predictor.
+    :param precision: store floats as scaled int16 to this step
+                      (absolute error <= precision / 2).
+    :param chunkrows: rows per independently compressed chunk.
+    :param attributes: extra JSON-serialisable metadata.
+    :return: bytes of the whole file.
+    '''
+
+    packing = None
+    if isinstance(array, PackedArray):
+        packing = array.get_packing()
+        array = array.data
+
+    array = numpy.asarray(array)
+    if array.ndim == 1:
+        array = array[None, :]
+
+    header = {'shape': list(array.shape),
+              'codec': codec,
+              'chunkrows': chunkrows,
+              'attributes': dict(attributes or {})}
+
+    if packing is not None:
+        header['packing'] = packing
+    elif precision is not None:
+        array, packing = compression.quantize(array, precision)
+        header['packing'] = packing
+
+    header['dtype'] = array.dtype.str
+    header['predictor'] = compression.get_predictor(array.dtype) if predictor else compression.NOPREDICTOR
+
+    payloads, chunks, offset = [], [], 0
+    for start in range(0, array.shape[0], chunkrows):
+        payload = compression.compress(compression.apply_predictor(array[start:start + chunkrows],
+                                                                   header['predictor']),
+                                       codec, level)
+        payloads.append(payload)
+        chunks.append([offset, len(payload)])
+        offset += len(payload)
+    header['chunks'] = chunks
+
+    headerbytes = json.dumps(header).encode('utf-8')
+
+    return b''.join([MAGIC, struct.pack('<I', len(headerbytes)), headerbytes] + payloads)
+
+
+def write_array(outputfile, array, **options):
+    '''
+    Write an array file (see encode_array for options).
+    The file is written under a temporary name and renamed, so an
+    interrupted run never leaves a truncated file behind.
+    '''
+
+    data = encode_array(array, **options)
+    temporaryfile = outputfile + '.part'
+    with open(temporaryfile, 'wb') as f:
+        f.write(data)
+    os.replace(temporaryfile, outputfile)
+
+    return outputfile
+
+
+def read_header(inputfile):
+    '''
+    Read the JSON header of an array file.
+
+    :return: header dict, byte offset of the first chunk.
+    '''
+
+    with open(inputfile, 'rb') as f:
+        if f.read(4) != MAGIC:
+            raise ValueError("{} is not an array file".format(inputfile))
+        length = struct.unpack('<I', f.read(4))[0]
+        header = json.loads(f.read(length).decode('utf-8'))
+
+    return header, 8 + length
+
+
+def decode_chunk(data, header, index):
+    '''Decompress one chunk of an array file into its packed rows.'''
+
+    rows = min(header['chunkrows'], header['shape'][0] - index * header['chunkrows'])
+    raw = compression.decompress(data, header['codec'])
+
+    return compression.undo_predictor(raw, header['dtype'], (rows, header['shape'][1]),
+                                      header['predictor'])
+
+
+def read_array(inputfile, rows=None, unpack=True):
+    '''
+    Read an array file, or only some of its rows.
+
+    :param rows: optional slice of rows; only the chunks covering it
+                 are read and decompressed.
+    :param unpack: turn quantized or packed values back into float32;
+                   False returns the stored integers.
+    :return: array, header
+    '''
+
+    header, dataoffset = read_header(inputfile)
+    nrows, chunkrows = header['shape'][0], header['chunkrows']
+    start, stop, _ = (rows or slice(None)).indices(nrows)
+
+    pieces = []
+    with open(inputfile, 'rb') as f:
+        for index in range(start // chunkrows, (stop - 1) // chunkrows + 1 if stop > start else 0):
+            offset, length = header['chunks'][index]
+            f.seek(dataoffset + offset)
+            pieces.append(decode_chunk(f.read(length), header, index))
+
+    first = (start // chunkrows) * chunkrows
+    array = numpy.concatenate(pieces)[start - first:stop - first] if pieces else \
+        numpy.empty((0, header['shape'][1]), dtype=header['dtype'])
+
+    if unpack and 'packing' in header:
+        array = compression.dequantize(array, header['packing'])
+
+    return array, header
+
+
+################ 2. Parallel writing.
+
+class ParallelWriter(object):
+    '''
+    Compress and write array files on a thread pool so that encoding
+    overlaps with the computation of the next block.
+
+    zlib and zstandard release the GIL while compressing; the pure
+    Python LZW codec does not, so use deflate or zstd here.
+
+    :param maxworkers: compression threads.
+    :param maxpending: files queued before submit() blocks, which
+                       bounds the memory held by pending arrays.
+    :param options: default encode_array options for every file.
+    '''
+
+    def __init__(self, maxworkers=2, maxpending=8, **options):
+
+        self.options = options
+        self._executor = ThreadPoolExecutor(max_workers=maxworkers)
+        self._slots = threading.BoundedSemaphore(maxpending)
+        self._futures = []
+
+    def submit(self, outputfile, array, **options):
+        '''Queue a file; the array must not be modified afterwards.'''
+
+        merged = dict(self.options, **options)
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(write_array, outputfile, array, **merged)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        self._futures.append(future)
+
+        return future
+
+    def close(self):
+        '''Wait for all files and re-raise the first write error.'''
+
+        self._executor.shutdown(wait=True)
+        futures, self._futures = self._futures, []
+
+        return [future.result() for future in futures]
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, *exc_info):
+
+        self.close()
@@ -0,0 +1,117 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Zonal means of polygon groups without splitting the shapefile.
+
+2c used to split the polygon shapefile with SplitByAttributes into one
+shapefile per value of the split field and run ZonalStatisticsAsTable
+on each of them for every day. Here the split field becomes a group
+code array over the features, every (group, zone value) pair becomes
+one zone, and the zone weights of all groups are built once per raster
+grid (rasterize.get_zoneweights). Each day is then a single
+WeightMatrix.apply for all groups, and the group code is written as a
+column of the output instead of being the name of a split file.
+"""
+
+import csv
+
+import numpy
+
+from . import dbf, rasterize, shapes
+from .geotiff import GeoTiff
+from .grid import Grid
+from .points import NODATA, read_band
+
+
+################ 1. Groups and zones.
+
+def get_groupcodes(values):
+    '''
+    Group code of every feature from its split field value.
+
+    :return: codes (index into groups), groups (sorted unique values).
+    '''
+
+    groups, codes = numpy.unique(numpy.asarray(values), return_inverse=True)
+
+    return codes.ravel(), groups
+
+
+def get_zones(codes, zonevalues):
+    '''
+    One zone per (group, zone value) pair, as ZonalStatisticsAsTable
+    gives one row per zone value in each split shapefile.
+
+    :param codes: group code of every feature.
+    :param zonevalues: zone field (pgvf) value of every feature.
+    :return: zone index of every feature, group code and zone value of
+             every zone (sorted by group, then value).
+    '''
+
+    valuecodes, values = get_groupcodes(zonevalues)
+    keys, zones = numpy.unique(codes.astype(numpy.int64) * len(values) + valuecodes, return_inverse=True)
+
+    return zones.ravel(), keys // len(values), values[keys % len(values)]
+
+
+class GroupedZones(object):
+    '''
+    The zones of a polygon shapefile grouped by a split field, with
+    their weights cached per raster grid.
+
+    :param shpfile: polygon shapefile in lat/lon.
+    :param zonefield: zone field (pgvf); "FID" numbers the features.
+    :param groupfield: split field (pgsf).
+    :param supersample: sub-cells per cell side used to measure how
+                        much of each cell a polygon covers.
+    '''
+
+    def __init__(self, shpfile, zonefield, groupfield, supersample=16):
+
+        self.polygons = shapes.read_polygons(shpfile)
+        records, fields = dbf.read_dbf(shpfile[:-4] + '.dbf')
+        zonevalues = numpy.arange(self.polygons.nfeatures) if zonefield.upper() == "FID" else \
+            dbf.get_column(records, fields, zonefield)
+        codes, self.groups = get_groupcodes(dbf.get_column(records, fields, groupfield))
+
+        self.featurezones, zonecodes, self.zonevalues = get_zones(codes, zonevalues)
+        self.zonegroups = self.groups[zonecodes]
+        self.supersample = supersample
+        self.weights = {}
+
+    @property
+    def nzones(self):
+
+        return len(self.zonevalues)
+
+    def get_weights(self, raster):
+        '''Zone weights on the grid of a GeoTiff, computed once per grid.'''
+
+        key = (raster.geotransform, raster.height, raster.width)
+        if key not in self.weights:
+            grid = Grid.from_geotransform(raster.geotransform, (raster.height, raster.width))
+            self.weights[key] = rasterize.get_zoneweights(self.polygons, grid, self.supersample,
+                                                          self.featurezones, self.nzones)
+
+        return self.weights[key]
+
+    def extract(self, tiffile):
+        '''Mean of every zone of every group on one raster (NaN where no cell has data).'''
+
+        raster = GeoTiff(tiffile)
+
+        return self.get_weights(raster).apply(read_band(raster)[None])[0]
+
+
+################ 2. Output.
+
+def write_zonecsv(outputfile, groups, zonevalues, column, values, groupfield, zonefield):
+    '''
+    Write one day of zone means: OID, the split field (group code), the
+    zone field and one date column (e.g. d900_1_31), NoData as -9999.
+    '''
+
+    with open(outputfile, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['OID', groupfield, zonefield, column])
+        for oid, (group, zonevalue, value) in enumerate(zip(groups, zonevalues, values)):
+            writer.writerow([oid, group, zonevalue, NODATA if numpy.isnan(value) else '{:g}'.format(value)])
@@ -0,0 +1,11 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Run the tests against the noaatools package and the scripts next to this folder."""
+
+import os
+import sys
+
+SCRIPTPATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if SCRIPTPATH not in sys.path:
+    sys.path.insert(0, SCRIPTPATH)
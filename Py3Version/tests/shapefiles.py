@@ -0,0 +1,66 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Small shapefiles written for the tests of the shapefile reader and the rasterizer."""
+
+import struct
+
+import numpy
+
+from noaatools import shapes
+
+
+def write_shapefile(shpfile, shapetype, records):
+    '''
+    Minimal .shp/.shx writer for the tests.
+
+    :param records: None (null shape), (x, y) for points, or a list of
+                    rings (lists of (x, y)) for polygons.
+    '''
+
+    contents = []
+    for record in records:
+        if record is None:
+            contents.append(struct.pack('<i', shapes.NULLSHAPE))
+        elif shapetype == 1:
+            contents.append(struct.pack('<i2d', 1, *record))
+        else:
+            coords = numpy.concatenate([numpy.asarray(ring, dtype=numpy.float64) for ring in record])
+            parts = numpy.cumsum([0] + [len(ring) for ring in record[:-1]])
+            box = coords.min(axis=0).tolist() + coords.max(axis=0).tolist()
+            contents.append(struct.pack('<i4d2i', shapetype, *(box + [len(record), len(coords)])) +
+                            struct.pack('<{}i'.format(len(parts)), *parts) + coords.astype('<f8').tobytes())
+
+    valid = [record for record in records if record is not None]
+    coords = numpy.array([record for record in valid] if shapetype == 1 else
+                         [point for record in valid for ring in record for point in ring])
+    box = coords.min(axis=0).tolist() + coords.max(axis=0).tolist()
+
+    def header(length):
+        return struct.pack('>i20xi', 9994, length // 2) + struct.pack('<2i4d32x', 1000, shapetype, *box)
+
+    body, index, offset = b'', b'', 100
+    for number, content in enumerate(contents):
+        body += struct.pack('>2i', number + 1, len(content) // 2) + content
+        index += struct.pack('>2i', offset // 2, len(content) // 2)
+        offset += 8 + len(content)
+
+    with open(shpfile, 'wb') as f:
+        f.write(header(100 + len(body)) + body)
+    with open(shpfile[:-4] + '.shx', 'wb') as f:
+        f.write(header(100 + len(index)) + index)
+
+    return shpfile
+
+
+def get_square(x0, y0, x1, y1, clockwise=True):
+
+    ring = [(x0, y0), (x0, y1), (x1, y1), (x1, y0), (x0, y0)]
+
+    return ring if clockwise else ring[::-1]
+
+
+# Two cells by two; a 2 x 2 square with a quarter-cell hole; half a cell.
+POLYGONS = [[get_square(1, -1, 3, 1)],
+            [get_square(0, 0, 2, 2), get_square(0.5, 0.5, 1, 1, clockwise=False)],
+            None,
+            [get_square(3, -2, 3.5, -1)]]
@@ -0,0 +1,50 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Splitting batch runs into stages and jobs, and parameters missing from the dialogs."""
+
+import sys
+import types
+
+from noaatools import batch
+
+
+def get_plan(tool, parameters):
+    '''Variables of the jobs of each stage.'''
+
+    return [[job.parameters.get('variables') for job in batch.expand_jobs(stagetool, stage)]
+            for stagetool, stage in batch.expand_stages(tool, parameters)]
+
+
+def test_split_shapefile_variables_run_in_stages(tmp_path):
+
+    projected = str(tmp_path / 'nuts2.shp')
+    (tmp_path / 'nuts2.prj').write_text('PROJCS["ETRS89_LAEA"]')
+    geographic = str(tmp_path / 'nuts3.shp')
+    (tmp_path / 'nuts3.prj').write_text('GEOGCS["GCS_WGS_1984"]')
+    parameters = {'root': 'D:/noaa', 'pgvf': 'NUTS_ID', 'pgsf': 'CNTR_CODE', 'variables': 'prate:mm/day;air'}
+
+    # The split shapefiles and temporary tables in root are shared.
+    assert get_plan('polygons', dict(parameters, pgshp=projected)) == [['prate:mm/day'], ['air.2m']]
+    assert get_plan('polygons', dict(parameters, pgshp=geographic, pgsf='')) == [['prate:mm/day'], ['air.2m']]
+
+    # Grouped zones in memory have no shared files.
+    assert get_plan('polygons', dict(parameters, pgshp=geographic)) == [['prate:mm/day', 'air.2m']]
+    assert get_plan('polygons', dict(parameters, pgshp=projected, inputpath='D:/noaa')) == [['prate:mm/day;air']]
+
+    # One stage per shapefile first, then per variable where needed.
+    assert get_plan('polygons', dict(parameters, pgshp=[geographic, projected])) == \
+        [['prate:mm/day', 'air.2m'], ['prate:mm/day'], ['air.2m']]
+    points = {'root': 'D:/noaa', 'ptshp': 'points.shp', 'variables': parameters['variables']}
+    assert get_plan('points', points) == [['prate:mm/day', 'air.2m']]
+
+
+def test_parameters_missing_from_the_dialog(monkeypatch):
+
+    # A dialog made before the variables and shard parameters existed.
+    dialog = ['D:/noaa', 'D:/points.shp', '1']
+    arcpy = types.SimpleNamespace(GetArgumentCount=lambda: len(dialog),
+                                  GetParameterAsText=lambda index: dialog[index])
+    monkeypatch.setitem(sys.modules, 'arcpy', arcpy)
+
+    assert [batch.get_parameter(index) for index in range(5)] == ['D:/noaa', 'D:/points.shp', '1', '', '']
+    assert not batch.get_flag(4)
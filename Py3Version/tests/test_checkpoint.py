@@ -0,0 +1,98 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Band checkpoints of stage 1: resuming mid-year and starting over on a replaced input."""
+
+import os
+
+import pytest
+
+from noaatools.checkpoint import CHECKPOINTFILE, BandCheckpoint
+
+
+PARAMETERS = {'engine': 'numpy', 'cellsize': 0.04}
+
+
+@pytest.fixture
+def year(tmp_path):
+
+    inputfile = tmp_path / 'prate.1900.nc'
+    inputfile.write_bytes(b'CDF\x01' + bytes(100))
+    outputpath = tmp_path / 'prate.1900'
+    outputpath.mkdir()
+
+    return str(inputfile), str(outputpath)
+
+
+def write_bands(checkpoint, bands):
+
+    for band in bands:
+        outputfile = os.path.join(checkpoint.outputpath, 'prate_1900_1_{}.tif'.format(band + 1))
+        with open(outputfile, 'wb') as f:
+            f.write(bytes([band]) * (10 + band))
+        checkpoint.commit(band, outputfile)
+
+
+def test_resume_after_a_stop(year):
+
+    inputfile, outputpath = year
+    checkpoint = BandCheckpoint(outputpath, inputfile, PARAMETERS)
+    assert checkpoint.resume(5) == 0
+    write_bands(checkpoint, range(3))
+    with pytest.raises(ValueError):
+        checkpoint.commit(4, os.path.join(outputpath, 'prate_1900_1_1.tif'))
+
+    # A new run continues from the first band missing.
+    checkpoint = BandCheckpoint(outputpath, inputfile, PARAMETERS)
+    assert checkpoint.committed == 3 and not checkpoint.is_complete()
+    assert checkpoint.resume(5) == 3
+    write_bands(checkpoint, range(3, 5))
+    assert BandCheckpoint(outputpath, inputfile, PARAMETERS).is_complete()
+
+
+def test_damaged_last_band_is_written_again(year):
+
+    inputfile, outputpath = year
+    checkpoint = BandCheckpoint(outputpath, inputfile, PARAMETERS)
+    checkpoint.resume(5)
+    write_bands(checkpoint, range(4))
+
+    # Same size, other bytes: only the checksum tells.
+    with open(os.path.join(outputpath, 'prate_1900_1_4.tif'), 'r+b') as f:
+        f.write(b'\xff')
+    os.remove(os.path.join(outputpath, 'prate_1900_1_3.tif'))
+
+    checkpoint = BandCheckpoint(outputpath, inputfile, PARAMETERS)
+    assert checkpoint.resume(5) == 2
+    assert [name for name, _, _ in BandCheckpoint(outputpath, inputfile, PARAMETERS).outputs] == \
+        ['prate_1900_1_1.tif', 'prate_1900_1_2.tif']
+
+
+def test_replaced_input_or_settings_start_over(year):
+
+    inputfile, outputpath = year
+    checkpoint = BandCheckpoint(outputpath, inputfile, PARAMETERS)
+    checkpoint.resume(5)
+    write_bands(checkpoint, range(5))
+
+    # Touched: same size, new modification time.
+    stat = os.stat(inputfile)
+    os.utime(inputfile, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert BandCheckpoint(outputpath, inputfile, PARAMETERS).committed == 0
+
+    # Replaced by a file of another size with the recorded mtime.
+    checkpoint = BandCheckpoint(outputpath, inputfile, PARAMETERS)
+    checkpoint.resume(5)
+    write_bands(checkpoint, range(5))
+    mtime = os.stat(inputfile).st_mtime_ns
+    with open(inputfile, 'ab') as f:
+        f.write(b'\x00')
+    os.utime(inputfile, ns=(mtime, mtime))
+    assert BandCheckpoint(outputpath, inputfile, PARAMETERS).committed == 0
+
+    # Other settings, or a year with another number of bands.
+    checkpoint = BandCheckpoint(outputpath, inputfile, PARAMETERS)
+    checkpoint.resume(5)
+    write_bands(checkpoint, range(5))
+    assert BandCheckpoint(outputpath, inputfile, dict(PARAMETERS, engine='arcpy')).committed == 0
+    assert BandCheckpoint(outputpath, inputfile, PARAMETERS).resume(6) == 0
+    assert os.path.exists(os.path.join(outputpath, CHECKPOINTFILE))
@@ -0,0 +1,94 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Day-of-year climatologies: known answers and the save/load round trip."""
+
+import numpy
+
+from noaatools import climatology
+
+
+def get_yeardates(year):
+
+    return numpy.arange('{}-01-01'.format(year), '{}-01-01'.format(year + 1), dtype='datetime64[D]')
+
+
+def test_dayofyear_on_leap_calendar():
+
+    dates = numpy.array(['1900-01-01', '1900-02-28', '1900-03-01', '1904-02-29', '1904-03-01', '1900-12-31'],
+                        dtype='datetime64[D]')
+
+    # March 1 has the same index in every year, Feb 29 its own slot.
+    assert climatology.get_dayofyear(dates).tolist() == [0, 58, 60, 59, 60, 365]
+    assert climatology.get_years(dates).tolist() == [1900, 1900, 1900, 1904, 1904, 1900]
+
+
+def test_smooth_circular_wraps_and_skips_nan():
+
+    values = numpy.arange(366, dtype=numpy.float64)
+    smoothed = climatology.smooth_circular(values, 1)
+
+    assert smoothed[100] == 100
+    assert smoothed[0] == (365 + 0 + 1) / 3.0
+    assert smoothed[365] == (364 + 365 + 0) / 3.0
+
+    values[59] = numpy.nan
+    smoothed = climatology.smooth_circular(values, 1)
+    assert smoothed[59] == (58 + 60) / 2.0
+    assert smoothed[58] == (57 + 58) / 2.0
+
+    values[:] = numpy.nan
+    assert numpy.isnan(climatology.smooth_circular(values, 2)).all()
+    assert climatology.smooth_circular(values, 0) is values
+
+
+def test_builder_mean_and_variance():
+
+    builder = climatology.ClimatologyBuilder((2,), baseperiod=(1981, 1982))
+    for year, value in [(1980, 100.0), (1981, 1.0), (1982, 3.0)]:
+        dates = get_yeardates(year)
+        values = numpy.full((len(dates), 2), value)
+        values[0, 1] = numpy.nan
+        builder.update(values, dates)
+    result = builder.finalize()
+
+    # 1980 is outside the base period; Feb 29 has no data in 1981-1982.
+    assert result.mean[100].tolist() == [2.0, 2.0]
+    assert result.variance[100].tolist() == [2.0, 2.0]
+    assert result.count[100].tolist() == [2, 2]
+    assert numpy.isnan(result.mean[59]).all()
+    assert result.count[0].tolist() == [2, 0]
+    assert numpy.isnan(result.mean[0, 1]) and numpy.isnan(result.variance[0, 1])
+
+    dates = get_yeardates(1990)[:3]
+    anomalies = result.anomalies(numpy.full((3, 2), 4.0), dates, standardize=True)
+    assert numpy.allclose(anomalies[1:], 2.0 / numpy.sqrt(2.0))
+
+
+def test_builder_takes_one_value_per_day():
+
+    builder = climatology.ClimatologyBuilder((1,), baseperiod=None)
+    dates = numpy.concatenate([get_yeardates(1981), get_yeardates(1982)])
+
+    try:
+        builder.update(numpy.zeros((len(dates), 1)), dates)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("two years in one update were accepted")
+
+
+def test_save_and_load(tmp_path):
+
+    builder = climatology.ClimatologyBuilder((3,), baseperiod=(1981, 1981))
+    dates = get_yeardates(1981)
+    builder.update(numpy.random.RandomState(0).rand(len(dates), 3), dates)
+    result = builder.finalize(smoothing=2)
+
+    path = str(tmp_path / 'prate_climatology.npz')
+    result.save(path)
+    loaded = climatology.Climatology.load(path)
+
+    assert loaded.baseperiod == (1981, 1981)
+    assert numpy.array_equal(loaded.mean, result.mean, equal_nan=True)
+    assert numpy.array_equal(loaded.variance, result.variance, equal_nan=True)
+    assert numpy.array_equal(loaded.count, result.count)
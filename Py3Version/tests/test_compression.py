@@ -0,0 +1,92 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Codecs, predictors and quantization: known answers and round trips."""
+
+import numpy
+import pytest
+
+from noaatools import compression
+
+
+def pack_codes(codes, width=9):
+    '''MSB-first packing of fixed-width LZW codes, as TIFF stores them.'''
+
+    bits = ''.join(format(code, '0{}b'.format(width)) for code in codes)
+    bits += '0' * (-len(bits) % 8)
+
+    return bytes(int(bits[i:i + 8], 2) for i in range(0, len(bits), 8))
+
+
+def test_lzw_known_answer():
+
+    # The example of the TIFF 6.0 specification, section 13.
+    data = bytes([7, 7, 7, 8, 8, 7, 7, 6, 6])
+    expected = pack_codes([256, 7, 258, 8, 8, 258, 6, 6, 257])
+
+    assert compression.lzw_encode(data) == expected
+    assert compression.lzw_decode(expected) == data
+
+
+@pytest.mark.parametrize('codec', ['none', 'deflate', 'lzw'])
+def test_codec_round_trip(codec):
+
+    random = numpy.random.RandomState(1)
+    # Long enough for the LZW code width to grow to 12 bits and reset.
+    for data in [b'', b'a', random.bytes(20000), bytes(bytearray(range(256)) * 300)]:
+        assert compression.decompress(compression.compress(data, codec), codec) == data
+
+
+def test_unknown_codec():
+
+    with pytest.raises(ValueError):
+        compression.compress(b'data', 'jpeg')
+
+
+def test_horizontal_predictor_known_answer():
+
+    block = numpy.array([[1, 3, 6], [10, 10, 9]], dtype=numpy.int16)
+    differenced = numpy.frombuffer(compression.apply_predictor(block, compression.HORIZONTAL), dtype=numpy.int16)
+
+    assert differenced.tolist() == [1, 2, 3, 10, 0, -1]
+    assert compression.get_predictor(numpy.int16) == compression.HORIZONTAL
+    assert compression.get_predictor(numpy.float32) == compression.FLOATINGPOINT
+    with pytest.raises(ValueError):
+        compression.apply_predictor(block.astype(numpy.float32), compression.HORIZONTAL)
+
+
+@pytest.mark.parametrize('dtype', [numpy.int16, numpy.uint8, numpy.int32, numpy.float32, numpy.float64])
+def test_predictor_round_trip(dtype):
+
+    block = (numpy.random.RandomState(2).randn(5, 7) * 1000).astype(dtype)
+    predictor = compression.get_predictor(dtype)
+    data = compression.compress(compression.apply_predictor(block, predictor), 'deflate')
+    restored = compression.undo_predictor(compression.decompress(data, 'deflate'), dtype, block.shape, predictor)
+
+    assert restored.dtype == numpy.dtype(dtype)
+    assert numpy.array_equal(restored, block)
+
+
+def test_quantize_known_answer():
+
+    packed, attributes = compression.quantize(numpy.array([0.0, 1.0, 2.0, numpy.nan]), 0.5)
+
+    assert packed.dtype == numpy.int16
+    assert packed.tolist() == [-2, 0, 2, -32768]
+    assert attributes['add_offset'] == 1.0
+    assert attributes['errorbound'] == 0.25
+
+    values = compression.dequantize(packed, attributes)
+    assert values[:3].tolist() == [0.0, 1.0, 2.0]
+    assert numpy.isnan(values[3])
+
+
+def test_quantize_error_bound_and_int32_fallback():
+
+    values = numpy.random.RandomState(3).uniform(0, 500, 1000)
+    packed, attributes = compression.quantize(values, 0.01)
+    assert packed.dtype == numpy.int16
+    assert numpy.abs(compression.dequantize(packed, attributes, numpy.float64) - values).max() <= 0.005 + 1e-9
+
+    packed, attributes = compression.quantize(values, 0.001)
+    assert packed.dtype == numpy.int32
+    assert numpy.abs(compression.dequantize(packed, attributes, numpy.float64) - values).max() <= 0.0005 + 1e-9
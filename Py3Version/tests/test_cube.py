@@ -0,0 +1,109 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Fused unpacking of yearly cubes against netCDF4's own auto-scaling."""
+
+import numpy
+import pytest
+
+from noaatools import cube
+from noaatools.grid import Grid
+
+netCDF4 = pytest.importorskip('netCDF4')
+
+
+SCALE_FACTOR = 1e-07
+ADD_OFFSET = 0.0032765
+MISSING_VALUE = 32766
+
+
+def write_yearfile(path, ndays=20):
+    '''A packed int16 prate year with missing values, like prate.1900.nc'''
+
+    random = numpy.random.RandomState(5)
+    packed = random.randint(-32767, 32766, size=(ndays, 6, 8)).astype(numpy.int16)
+    packed[3, 2, 5] = MISSING_VALUE
+    packed[17, 0, 0] = MISSING_VALUE
+
+    dataset = netCDF4.Dataset(path, 'w')
+    try:
+        dataset.createDimension('time', ndays)
+        dataset.createDimension('lat', 6)
+        dataset.createDimension('lon', 8)
+        time = dataset.createVariable('time', 'f8', ('time',))
+        time.units = 'hours since 1800-01-01 00:00:0.0'
+        time[:] = (numpy.datetime64('1900-01-01') - numpy.datetime64('1800-01-01')).astype(int) * 24 + \
+            numpy.arange(ndays) * 24.0
+        dataset.createVariable('lat', 'f4', ('lat',))[:] = 90 - 1.875 * numpy.arange(6)
+        dataset.createVariable('lon', 'f4', ('lon',))[:] = 1.875 * numpy.arange(8)
+        prate = dataset.createVariable('prate', 'i2', ('time', 'lat', 'lon'))
+        prate.scale_factor = SCALE_FACTOR
+        prate.add_offset = ADD_OFFSET
+        prate.missing_value = numpy.int16(MISSING_VALUE)
+        prate.set_auto_maskandscale(False)
+        prate[:] = packed
+    finally:
+        dataset.close()
+
+    return path
+
+
+def read_autoscaled(path):
+    '''The year as netCDF4 unpacks it, masked values as NaN.'''
+
+    dataset = netCDF4.Dataset(path, 'r')
+    try:
+        return numpy.ma.filled(dataset.variables['prate'][:].astype(numpy.float64), numpy.nan)
+    finally:
+        dataset.close()
+
+
+@pytest.fixture
+def yearfile(tmp_path):
+
+    return write_yearfile(str(tmp_path / 'prate.1900.nc'))
+
+
+def test_unpack_inplace_known_answer():
+
+    packed = numpy.array([[[0, 10], [-10, 32766]]], dtype=numpy.int16)
+    values = cube.unpack_inplace(packed, 0.5, 100.0, multiplier=2.0, missing_value=32766)
+
+    assert values.dtype == numpy.float32
+    assert values[0, 0].tolist() == [200.0, 210.0]
+    assert values[0, 1, 0] == 190.0 and numpy.isnan(values[0, 1, 1])
+
+    with pytest.raises(ValueError):
+        cube.unpack_inplace(packed, out=numpy.empty(packed.shape, dtype=numpy.float64))
+
+
+def test_load_yearcube_matches_netcdf4(yearfile):
+
+    expected = read_autoscaled(yearfile)
+    # Blocks of 8 bands leave a short last block.
+    values, dates = cube.load_yearcube(yearfile, 'prate', blockbands=8)
+
+    assert values.dtype == numpy.float32 and values.shape == (20, 6, 8)
+    assert dates[0] == numpy.datetime64('1900-01-01') and dates[-1] == numpy.datetime64('1900-01-20')
+    assert numpy.isnan(values[3, 2, 5]) and numpy.isnan(values[17, 0, 0])
+    assert numpy.array_equal(numpy.isnan(values), numpy.isnan(expected))
+    assert numpy.allclose(values, expected, rtol=1e-6, atol=1e-9, equal_nan=True)
+
+    # The unit conversion is folded into the same pass.
+    mmday, _ = cube.load_yearcube(yearfile, 'prate', units='mm/day', out=values)
+    assert mmday is values
+    assert numpy.allclose(mmday, expected * 86400, rtol=1e-5, atol=1e-4, equal_nan=True)
+
+
+def test_load_yearcube_window(yearfile):
+
+    expected = read_autoscaled(yearfile)
+
+    # Rows 1..3 and columns 7, 0, 1: the window wraps across the prime meridian.
+    grid = Grid.from_netcdf(yearfile)
+    window = grid.get_window(numpy.array([-1.0, 1.0]), numpy.array([86.5, 85.0]), margin=0)
+    assert window.columnranges == [(7, 8), (0, 2)]
+
+    values, _ = cube.load_yearcube(yearfile, 'prate', window=window, blockbands=6)
+    rows = slice(window.rows.start, window.rows.stop)
+    assert values.shape == (20,) + window.shape
+    assert numpy.allclose(values, expected[:, rows][:, :, window.columns], rtol=1e-6, atol=1e-9, equal_nan=True)
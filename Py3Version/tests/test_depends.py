@@ -0,0 +1,111 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Dependency records: which outputs a touched or replaced input makes dirty."""
+
+import os
+
+import pytest
+
+from noaatools import depends
+
+
+@pytest.fixture
+def folder(tmp_path):
+
+    for name in ('prate_1900_1_1.tif', 'prate_1900_1_2.tif', 'nuts2.shp', 'nuts2.dbf'):
+        (tmp_path / name).write_bytes(b'\x00' * 16)
+
+    return tmp_path
+
+
+def get_signature(folder, tifname, pgvf='NUTS_ID'):
+
+    return depends.get_signature([str(folder / tifname)] + depends.get_shapefileinputs(str(folder / 'nuts2.shp')),
+                                 {'pgvf': pgvf})
+
+
+def touch(path, seconds=10):
+
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + seconds * 10 ** 9))
+
+
+def test_touched_or_replaced_input_is_dirty(folder):
+
+    record = depends.DependencyRecord(str(folder))
+    outputs = [str(folder / 'prate_1900_1_{}_pg.csv'.format(day)) for day in (1, 2)]
+    for day, outputfile in enumerate(outputs):
+        open(outputfile, 'w').close()
+        record.record(outputfile, get_signature(folder, 'prate_1900_1_{}.tif'.format(day + 1)))
+    record.write()
+
+    record = depends.DependencyRecord(str(folder))
+    assert record.is_current(outputs[0], get_signature(folder, 'prate_1900_1_1.tif'))
+    assert not record.is_current(outputs[0], get_signature(folder, 'prate_1900_1_1.tif', pgvf='NUTS_ID1'))
+
+    # A touched raster makes only its day dirty.
+    touch(str(folder / 'prate_1900_1_1.tif'))
+    assert not record.is_current(outputs[0], get_signature(folder, 'prate_1900_1_1.tif'))
+    assert record.is_current(outputs[1], get_signature(folder, 'prate_1900_1_2.tif'))
+    assert record.get_dirty(outputs[0], get_signature(folder, 'prate_1900_1_1.tif')) == \
+        [os.path.abspath(str(folder / 'prate_1900_1_1.tif'))]
+
+    # A shapefile replaced with its old mtime still differs in size.
+    dbffile = str(folder / 'nuts2.dbf')
+    mtime = os.stat(dbffile).st_mtime_ns
+    with open(dbffile, 'ab') as f:
+        f.write(b'\x00')
+    os.utime(dbffile, ns=(mtime, mtime))
+    assert not record.is_current(outputs[1], get_signature(folder, 'prate_1900_1_2.tif'))
+
+    # A deleted output is made again.
+    os.remove(outputs[1])
+    assert len(record.get_dirty(outputs[1], get_signature(folder, 'prate_1900_1_2.tif'))) == 3
+
+
+def test_output_without_a_record_is_made_again(folder):
+
+    outputfile = str(folder / 'prate_1900_1_1_pg.csv')
+    open(outputfile, 'w').close()
+    touch(outputfile)
+    signature = get_signature(folder, 'prate_1900_1_1.tif')
+
+    # Newer than its inputs, but made with unknown parameters.
+    record = depends.DependencyRecord(str(folder))
+    assert not record.is_current(outputfile, signature)
+    assert sorted(record.get_dirty(outputfile, signature)) == sorted(signature['inputs'])
+    assert record.get_entry(outputfile) is None
+
+
+def test_derived_output_outlives_its_source(folder):
+
+    ptshp = str(folder / 'nuts2.shp')
+    record = depends.DependencyRecord(str(folder))
+    record.record(ptshp, depends.get_signature([str(folder / 'prate_1900_1_1.tif')], {'ptinterval': 'NONE'}))
+
+    # 2b's CSV carries the shapefile's own inputs plus its parameters.
+    ptcsv = str(folder / '1900_1_1_pt.csv')
+    open(ptcsv, 'w').close()
+    record.record(ptcsv, record.derive(ptshp, {'ptvf': 'ID'}))
+    record.write()
+
+    record = depends.DependencyRecord(str(folder))
+    assert record.is_current(ptcsv, depends.get_signature([str(folder / 'prate_1900_1_1.tif')], {'ptvf': 'ID'}),
+                             subset=True)
+
+    # 2a remakes the shapefile from a touched raster, so the CSV is dirty.
+    touch(str(folder / 'prate_1900_1_1.tif'))
+    record.record(ptshp, depends.get_signature([str(folder / 'prate_1900_1_1.tif')], {'ptinterval': 'NONE'}))
+    assert not record.is_current(ptcsv, record.derive(ptshp, {'ptvf': 'ID'}))
+
+
+def test_records_of_two_jobs_are_kept(folder):
+
+    first, second = depends.DependencyRecord(str(folder)), depends.DependencyRecord(str(folder))
+    first.record(str(folder / 'a.csv'), depends.get_signature([]))
+    second.record(str(folder / 'b.csv'), depends.get_signature([]))
+    first.write()
+    second.write()
+
+    assert sorted(depends.DependencyRecord(str(folder)).entries) == ['a.csv', 'b.csv']
+    assert not os.path.exists(first.lockfile)
@@ -0,0 +1,110 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""GeoTIFF writer and reader: georeferencing known answers and round trips."""
+
+import struct
+
+import numpy
+import pytest
+
+from noaatools import geotiff
+from noaatools.packed import PackedArray
+
+
+def test_gridgeotransform_known_answer():
+
+    # Cell centres 0, 2, 4 east and 10, 0, -10 north.
+    assert geotiff.get_gridgeotransform([10.0, 0.0, -10.0], [0.0, 2.0, 4.0]) == (-1.0, 2.0, 15.0, 10.0)
+    assert geotiff.get_gridgeotransform([-10.0, 0.0, 10.0], [0.0, 2.0, 4.0]) == (-1.0, 2.0, 15.0, 10.0)
+
+    bands = numpy.arange(6).reshape(1, 3, 2)
+    assert geotiff.get_northup(bands, [-10.0, 0.0, 10.0])[0, 0].tolist() == [4, 5]
+    assert geotiff.get_northup(bands, [10.0, 0.0, -10.0]) is bands
+
+
+
+def set_compressiontag(path, value):
+    '''Overwrite the Compression tag of the first IFD of a little-endian TIFF.'''
+
+    with open(path, 'r+b') as f:
+        f.seek(4)
+        f.seek(struct.unpack('<I', f.read(4))[0])
+        for _ in range(struct.unpack('<H', f.read(2))[0]):
+            tag, typeid, count = struct.unpack('<HHI', f.read(8))
+            if tag == geotiff.COMPRESSION:
+                f.write(struct.pack('<H', value))
+                return
+            f.seek(4, 1)
+
+    raise AssertionError("no Compression tag in {}".format(path))
+
+
+@pytest.mark.parametrize('codec', ['none', 'deflate', 'lzw'])
+@pytest.mark.parametrize('tilesize', [None, 16])
+@pytest.mark.parametrize('dtype', [numpy.float32, numpy.int16])
+def test_round_trip(tmp_path, codec, tilesize, dtype):
+
+    # 3 bands of 37 x 45: the tiles do not divide the raster evenly.
+    bands = (numpy.random.RandomState(4).randn(3, 37, 45) * 100).astype(dtype)
+    geotransform = (-0.9375, 1.875, 89.5, 1.9)
+    path = geotiff.write_geotiff(str(tmp_path / 'band.tif'), bands, geotransform, nodata=-9999,
+                                 tilesize=tilesize, codec=codec)
+    raster = geotiff.GeoTiff(path)
+
+    assert (raster.nbands, raster.height, raster.width) == (3, 37, 45)
+    assert raster.codec == codec
+    assert raster.geotransform == geotransform
+    assert raster.nodata == -9999
+    for band in range(3):
+        assert numpy.array_equal(raster.read(band), bands[band])
+    assert numpy.array_equal(raster.read_window(slice(10, 30), slice(5, 40), band=2), bands[2, 10:30, 5:40])
+    assert numpy.array_equal(raster.read_pixels([0, 36], [44, 0], band=1), bands[1, [0, 36], [44, 0]])
+
+
+def test_packed_bands(tmp_path):
+
+    packed = PackedArray(numpy.array([[[0, 100], [-100, -32767]]], dtype=numpy.int16), 0.5, 10.0, -32767)
+    path = geotiff.write_geotiff(str(tmp_path / 'packed.tif'), packed, (0.0, 1.0, 2.0, 1.0), codec='deflate')
+    raster = geotiff.GeoTiff(path)
+
+    assert raster.dtype.kind == 'i'
+    assert (raster.scale_factor, raster.add_offset, raster.nodata) == (0.5, 10.0, -32767)
+    assert raster.read().tolist() == [[0, 100], [-100, -32767]]
+
+
+def test_read_points(tmp_path):
+
+    band = numpy.array([[1.0, 2.0, 3.0], [4.0, -9999.0, 6.0]], dtype=numpy.float32)
+    path = geotiff.write_geotiff(str(tmp_path / 'points.tif'), band, (0.0, 1.0, 2.0, 1.0), nodata=-9999)
+    raster = geotiff.GeoTiff(path)
+
+    rows, columns = raster.get_pixel([0.5, 2.9, 1.5], [1.5, 0.1, 0.5])
+    assert rows.tolist() == [0, 1, 1] and columns.tolist() == [0, 2, 1]
+
+    # Off the raster and NoData are NaN.
+    values = raster.read_points(numpy.array([0.5, 2.9, 1.5, 3.5, -0.5]), numpy.array([1.5, 0.1, 0.5, 1.0, 1.0]))
+    assert values[:2].tolist() == [1.0, 6.0]
+    assert numpy.isnan(values[2:]).all()
+
+
+def test_not_a_tiff(tmp_path):
+
+    path = tmp_path / 'band.tif'
+    path.write_bytes(b'GIF89a' + bytes(10))
+    with pytest.raises(ValueError):
+        geotiff.GeoTiff(str(path))
+
+
+def test_unsupported_compression(tmp_path):
+
+    band = numpy.arange(12, dtype=numpy.float32).reshape(3, 4)
+    path = geotiff.write_geotiff(str(tmp_path / 'band.tif'), band, (0.0, 1.0, 3.0, 1.0), codec='deflate')
+
+    # The old Adobe deflate code reads as deflate.
+    set_compressiontag(path, geotiff.OLDDEFLATE)
+    assert numpy.array_equal(geotiff.GeoTiff(path).read(), band)
+
+    # PackBits is refused instead of being read as raw bytes.
+    set_compressiontag(path, 32773)
+    with pytest.raises(ValueError, match="Unsupported TIFF compression 32773"):
+        geotiff.GeoTiff(path)
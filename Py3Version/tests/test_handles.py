@@ -0,0 +1,109 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""The LRU handle pool, and bad years skipped at open and at export time."""
+
+import types
+
+import pytest
+
+from noaatools import batch
+from noaatools.handles import HandlePool, iter_opened
+
+
+class Handle(object):
+
+    def __init__(self, path, opened):
+
+        self.path = path
+        self.closed = False
+        opened.append(path)
+
+    def close(self):
+
+        self.closed = True
+
+
+def get_pool(opened, maxopen=2):
+
+    def opener(path):
+        if path.endswith('1899.nc'):
+            raise IOError("cannot open " + path)
+        return Handle(path, opened)
+
+    def headerreader(handle):
+        if handle.path.endswith('1901.nc'):
+            raise RuntimeError("no time dimension in " + handle.path)
+        return {'topband': 365, 'path': handle.path}
+
+    return HandlePool(opener, headerreader, maxopen=maxopen)
+
+
+def test_lru_eviction_and_header_cache():
+
+    opened = []
+    pool = get_pool(opened)
+
+    a, b = pool.get('prate.1900.nc'), pool.get('prate.1902.nc')
+    assert pool.get('prate.1900.nc') is a                 # 1900 is now the most recent
+    c = pool.get('prate.1903.nc')
+    assert b.closed and not a.closed and not c.closed
+    assert len(pool) == 2 and opened == ['prate.1900.nc', 'prate.1902.nc', 'prate.1903.nc']
+
+    # Headers are read once and stay cached after the handle is closed.
+    assert pool.get_header('prate.1900.nc')['topband'] == 365
+    pool.release('prate.1900.nc')
+    assert a.closed and len(pool) == 1
+    assert pool.get_header('prate.1900.nc')['path'] == 'prate.1900.nc'
+    assert opened.count('prate.1900.nc') == 1
+
+    with pool:
+        pass
+    assert c.closed and len(pool) == 0
+
+
+def test_iter_opened_skips_bad_years():
+
+    opened, skipped = [], []
+    pool = get_pool(opened)
+    paths = ['prate.1899.nc', 'prate.1900.nc', 'prate.1901.nc', 'prate.1902.nc']
+
+    items = iter_opened(pool, paths, onerror=lambda path, exception: skipped.append(path))
+    # Files are opened only when their year is reached.
+    assert next(items)[0] == 'prate.1900.nc' and opened == ['prate.1900.nc']
+    assert [item for item, _, _ in items] == ['prate.1902.nc']
+
+    assert skipped == ['prate.1899.nc', 'prate.1901.nc']
+    assert 'prate.1901.nc' not in [path for path in pool._handles]
+
+    with pytest.raises(IOError):
+        list(iter_opened(get_pool([]), paths))
+
+
+def test_export_failure_skips_only_its_year(monkeypatch):
+
+    script = batch.load_script('netcdf')
+
+    class ExecuteError(Exception):
+        pass
+
+    exported, skipped = [], []
+
+    def loopovernetcdfbands(toptimeband, inputproperties, inputfilepath, outputpath, noaavariable):
+        if inputfilepath == 'prate.1901.nc':
+            raise ExecuteError("ERROR 999999: band 120 of prate.1901.nc")
+        exported.append(inputfilepath)
+
+    monkeypatch.setattr(script, 'arcpy', types.SimpleNamespace(ExecuteError=ExecuteError))
+    monkeypatch.setattr(script, 'loopovernetcdfbands', loopovernetcdfbands)
+    monkeypatch.setattr(script, 'skipyear', lambda task, exception: skipped.append(task[0]))
+
+    for path in ['prate.1900.nc', 'prate.1901.nc', 'prate.1902.nc']:
+        script.exportyear((365, None, path, 'output', None))
+
+    assert exported == ['prate.1900.nc', 'prate.1902.nc']
+    assert skipped == ['prate.1901.nc']
+
+    # Anything else is a bug and stops the run.
+    monkeypatch.setattr(script, 'loopovernetcdfbands', lambda *args: {}['topband'])
+    with pytest.raises(KeyError):
+        script.exportyear((365, None, 'prate.1903.nc', 'output', None))
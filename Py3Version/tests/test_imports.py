@@ -0,0 +1,55 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""noaatools and the toolbox scripts import without arcpy and pandas, and fast."""
+
+import json
+import os
+import subprocess
+import sys
+
+from conftest import SCRIPTPATH
+
+# Seconds a fresh interpreter may take to import everything (about 0.1 s
+# without ArcGIS), with room for slow CI machines.
+IMPORTBUDGET = 2.0
+
+# Run in a fresh interpreter: arcpy and pandas are blocked, so an import
+# of either fails loudly and is recorded even where they are installed.
+IMPORTSCRIPT = r'''
+import importlib, json, os, pkgutil, sys, time
+
+blocked = []
+
+class Blocker(object):
+    def find_spec(self, name, path=None, target=None):
+        if name.split('.')[0] in ('arcpy', 'pandas'):
+            blocked.append(name)
+            raise ImportError("blocked " + name)
+        return None
+
+sys.meta_path.insert(0, Blocker())
+started = time.time()
+
+import noaatools
+from noaatools import batch
+modules = ['noaatools.' + module.name for module in pkgutil.iter_modules(noaatools.__path__)]
+for module in modules:
+    importlib.import_module(module)
+for tool in batch.TOOLS:
+    batch.load_script(tool)
+
+print(json.dumps({'seconds': time.time() - started, 'blocked': blocked, 'modules': modules,
+                  'loaded': sorted(name for name in sys.modules if name.split('.')[0] in ('arcpy', 'pandas'))}))
+'''
+
+
+def test_imports_without_arcpy_and_pandas():
+
+    environment = dict(os.environ, PYTHONPATH=SCRIPTPATH)
+    output = subprocess.check_output([sys.executable, '-c', IMPORTSCRIPT], cwd=SCRIPTPATH, env=environment)
+    result = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+    assert 'noaatools.batch' in result['modules']
+    assert result['blocked'] == []
+    assert result['loaded'] == []
+    assert result['seconds'] < IMPORTBUDGET
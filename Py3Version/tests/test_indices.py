@@ -0,0 +1,91 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""ETCCDI precipitation indices: known answers on short series."""
+
+import csv
+
+import numpy
+import pytest
+
+from noaatools import indices
+
+
+def get_dates(start, ndays):
+
+    return numpy.datetime64(start, 'D') + numpy.arange(ndays)
+
+
+def test_rx1day_rx5day_and_counts():
+
+    dates = get_dates('1990-12-27', 10)
+    values = numpy.zeros((10, 2), dtype=numpy.float32)
+    values[:, 0] = numpy.arange(10)
+    values[:, 1] = [25, 0, 0, 0, 0, 12, 12, 12, 12, numpy.nan]
+
+    periods, result = indices.compute_indices(values, dates, basepercentiles=numpy.full((2, 2), numpy.inf))
+
+    assert periods.tolist() == ['1990', '1991']
+    assert result['rx1day'].tolist() == [[4, 25], [9, 12]]
+    # Five-day totals end in their period but may start in the one before.
+    assert result['rx5day'].tolist() == [[10, 25], [35, 48]]
+    assert result['r10mm'].tolist() == [[0, 1], [0, 4]]
+    assert result['r20mm'].tolist() == [[0, 1], [0, 0]]
+
+
+def test_cdd_cwd_restart_each_period():
+
+    # Jan 28 .. Feb 5: a wet run across the month boundary, and a NaN day.
+    dates = get_dates('1990-01-28', 9)
+    values = numpy.array([[5, 0],
+                          [5, 0],
+                          [5, 0],
+                          [5, 0],
+                          [5, 0],
+                          [5, 0],
+                          [5, numpy.nan],
+                          [0, 0],
+                          [5, 0]], dtype=numpy.float32)
+
+    periods, result = indices.compute_indices(values, dates, frequency="monthly",
+                                              basepercentiles=numpy.full((2, 2), numpy.inf))
+
+    assert periods.tolist() == ['1990-01', '1990-02']
+    assert result['cwd'].tolist() == [[4, 0], [3, 0]]
+    assert result['cdd'].tolist() == [[0, 4], [1, 2]]
+
+    runs = indices.get_runlengths(values[:, :1] >= 1, numpy.array([0, 4]))
+    assert runs[:, 0].tolist() == [1, 2, 3, 4, 1, 2, 3, 0, 1]
+
+
+def test_r95p_against_base_period_percentiles():
+
+    # 2000 is the base period: wet days of 1 .. 100 mm, the rest dry.
+    dates = numpy.concatenate([get_dates('2000-01-01', 366), get_dates('2001-01-01', 365)])
+    values = numpy.zeros((len(dates), 1), dtype=numpy.float32)
+    values[:100, 0] = numpy.arange(1, 101)
+    values[366 + 10:366 + 13, 0] = [96, 95, 200]
+
+    percentiles = indices.get_basepercentiles(values, dates, baseperiod=(2000, 2000))
+    assert percentiles[:, 0] == pytest.approx([95.05, 99.01])
+
+    periods, result = indices.compute_indices(values, dates, baseperiod=(2000, 2000))
+    assert result['r95p'][:, 0].tolist() == [96 + 97 + 98 + 99 + 100, 96 + 200]
+    assert result['r99p'][:, 0].tolist() == [100, 200]
+
+    with pytest.raises(ValueError):
+        indices.get_basepercentiles(values, dates, baseperiod=(1961, 1990))
+
+
+def test_write_indextable(tmp_path):
+
+    periods = numpy.array(['1990', '1991'])
+    result = {'rx1day': numpy.array([[1.5, 2.0], [3.0, 4.0]]), 'cdd': numpy.array([[7, 8], [9, 10]])}
+    outputfile = str(tmp_path / 'prate_indices.csv')
+    indices.write_indextable(outputfile, periods, result, ['p1', 'p2'])
+
+    with open(outputfile) as f:
+        rows = list(csv.reader(f))
+
+    assert rows[0] == ['feature_id', 'period', 'rx1day', 'cdd']
+    assert rows[1:] == [['p1', '1990', '1.5', '7'], ['p1', '1991', '3', '9'],
+                        ['p2', '1990', '2', '8'], ['p2', '1991', '4', '10']]
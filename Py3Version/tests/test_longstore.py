@@ -0,0 +1,90 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Long stores: appends, replacement, reopening and the CSV export with its offset index."""
+
+import csv
+
+import numpy
+import pytest
+
+from noaatools import longstore
+
+
+FEATUREIDS = ['FR101', 'FR102', 'FR103']
+
+
+def get_days(start, ndays):
+
+    return numpy.datetime64(start, 'D') + numpy.arange(ndays)
+
+
+def get_values(dates, factor=1.0):
+    '''Values that tell day and feature apart: day number + feature / 10.'''
+
+    days = (dates - numpy.datetime64('1900-01-01', 'D')).astype(numpy.float32)
+
+    return factor * (days[:, None] + numpy.arange(len(FEATUREIDS), dtype=numpy.float32) / 10)
+
+
+@pytest.fixture
+def store(tmp_path):
+
+    store = longstore.create_store(str(tmp_path / 'prate_pt.lts'), FEATUREIDS, 'NUTS_ID')
+    for year in (1900, 1901):
+        dates = get_days('{}-01-01'.format(year), 365)
+        store.append(dates, get_values(dates))
+
+    return store
+
+
+def test_append_and_read_feature(store):
+
+    assert [segment['name'] for segment in store.segments] == ['segment_00000', 'segment_00001']
+    assert store.segments[1]['start'] == '1901-01-01' and store.segments[1]['ndays'] == 365
+
+    dates, values = store.read_feature('FR102')
+    assert len(dates) == 730
+    assert numpy.array_equal(values, get_values(dates)[:, 1])
+
+    # The store reopens from its folder, and days already stored are not appended again.
+    reopened = longstore.create_store(store.path, FEATUREIDS)
+    assert reopened.idfield == 'NUTS_ID'
+    assert reopened.append(get_days('1901-06-01', 10), numpy.zeros((10, 3))) is None
+    with pytest.raises(ValueError):
+        longstore.create_store(store.path, ['FR101'])
+    with pytest.raises(ValueError):
+        reopened.append(get_days('1902-01-01', 1), numpy.zeros((1, 3)), featureids=['a', 'b', 'c'])
+
+
+def test_replace_rewrites_the_segment(store):
+
+    dates = get_days('1900-03-01', 10)
+    segment = store.append(dates, get_values(dates, -1.0), replace=True)
+
+    # The 1900 segment is rewritten as a new one with its other days kept.
+    assert segment['name'] == 'segment_00002'
+    assert [item['name'] for item in store.segments] == ['segment_00002', 'segment_00001']
+    assert segment['ndays'] == 365 and segment['consecutive']
+
+    storedates, values = longstore.LongStore(store.path).read_feature('FR103')
+    expected = get_values(storedates)[:, 2]
+    replaced = numpy.isin(storedates, dates)
+    expected[replaced] *= -1
+    assert numpy.array_equal(values, expected)
+
+
+def test_to_csv_index_offsets(store, tmp_path):
+
+    outputfile = store.to_csv(str(tmp_path / 'prate_pt.csv'))
+    with open(str(tmp_path / 'prate_pt_index.csv')) as f:
+        index = list(csv.DictReader(f))
+
+    assert [row['NUTS_ID'] for row in index] == FEATUREIDS
+    with open(outputfile, 'rb') as f:
+        assert f.readline() == b'NUTS_ID,date,value\n'
+        f.seek(int(index[1]['offset']))
+        rows = [f.readline().decode('utf-8').strip() for _ in range(int(index[1]['rows']))]
+
+    assert len(rows) == 730
+    assert rows[0] == 'FR102,1900-01-01,0.1'
+    assert rows[-1] == 'FR102,1901-12-31,729.1'
@@ -0,0 +1,46 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Stage 1 with the NumPy engine: which years are skipped and which errors stop the run."""
+
+import sys
+
+import pytest
+
+from noaatools import batch
+from noaatools.variables import get_variable
+
+netCDF4 = pytest.importorskip('netCDF4')
+
+
+@pytest.fixture(scope='module')
+def script():
+
+    return batch.load_script('netcdf')
+
+
+def test_unreadable_years_are_skipped(script, tmp_path):
+
+    prate = get_variable('prate')
+    assert isinstance(script.tryloadnetcdfyear(str(tmp_path / 'prate.1899.nc'), prate), OSError)
+
+    corrupt = tmp_path / 'prate.1900.nc'
+    corrupt.write_bytes(b'GIF89a' + bytes(60))
+    assert isinstance(script.tryloadnetcdfyear(str(corrupt), prate), (OSError, RuntimeError))
+
+
+def test_other_errors_stop_the_run(script, tmp_path, monkeypatch):
+
+    path = str(tmp_path / 'air.2m.1900.nc')
+    dataset = netCDF4.Dataset(path, 'w')
+    dataset.createDimension('time', 1)
+    dataset.createVariable('time', 'f8', ('time',))
+    dataset.close()
+
+    # A file without the variable is not a read error.
+    with pytest.raises(KeyError):
+        script.tryloadnetcdfyear(path, get_variable('air'))
+
+    # Nor is a missing netCDF4 package.
+    monkeypatch.setitem(sys.modules, 'netCDF4', None)
+    with pytest.raises(ImportError):
+        script.tryloadnetcdfyear(path, get_variable('air'))
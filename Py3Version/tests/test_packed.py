@@ -0,0 +1,68 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Packed int16 cubes: weights on the raw integers against the unpacked path."""
+
+import numpy
+import pytest
+
+from noaatools.extract import WeightMatrix
+from noaatools.packed import PackedArray, unpack_values
+
+
+MISSING_VALUE = 32766
+
+
+def get_packedcube():
+
+    random = numpy.random.RandomState(6)
+    data = random.randint(-32767, 32766, size=(40, 5, 7)).astype(numpy.int16)
+    data[3, 1, 1] = MISSING_VALUE
+    data[:, 4, 6] = MISSING_VALUE
+
+    return PackedArray(data, 1e-07 * 86400, 0.0032765 * 86400, MISSING_VALUE)
+
+
+def get_weights():
+    '''Bilinear-like rows, a zone with one missing cell, an all-missing cell and an empty row.'''
+
+    rows = [{0: 0.25, 1: 0.25, 7: 0.25, 8: 0.25},
+            {8: 1.0, 9: 0.5, 15: 0.75, 16: 1.0},
+            {34: 1.0},
+            {},
+            {20: 1.0}]
+    indptr = numpy.cumsum([0] + [len(row) for row in rows])
+    cells = [cell for row in rows for cell in row]
+    weights = [weight for row in rows for weight in row.values()]
+
+    return WeightMatrix(indptr, cells, weights, (5, 7))
+
+
+def test_unpack_known_answer():
+
+    packed = PackedArray(numpy.array([[0, 10], [-10, MISSING_VALUE]], dtype=numpy.int16), 0.5, 100.0,
+                         MISSING_VALUE)
+
+    assert packed.unpack()[0].tolist() == [100.0, 105.0]
+    assert packed.unpack()[1, 0] == 95.0 and numpy.isnan(packed.unpack()[1, 1])
+    assert packed[1].shape == (2,) and packed[1].scale_factor == 0.5
+    assert packed.get_packing() == {'scale_factor': 0.5, 'add_offset': 100.0, 'missing_value': MISSING_VALUE}
+
+    # Means of packed values unpack the same as the values themselves.
+    assert unpack_values(numpy.array([2.5]), 0.5, 100.0).tolist() == [101.25]
+
+
+def test_weights_on_packed_match_the_float_path():
+
+    packed = get_packedcube()
+    weights = get_weights()
+
+    expected = weights.apply(packed.unpack())
+    result = weights.apply(packed, blockbands=16)
+
+    assert result.dtype == numpy.float32 and result.shape == (40, 5)
+    # The all-missing cell and the empty row are NaN on both paths.
+    assert numpy.isnan(result[:, [2, 3]]).all()
+    assert numpy.array_equal(numpy.isnan(result), numpy.isnan(expected))
+    # Day 3 drops the missing cell 8 from the first two features.
+    assert result[3, 0] == pytest.approx(numpy.mean(packed.unpack()[3].ravel()[[0, 1, 7]]), rel=1e-5)
+    assert numpy.allclose(result, expected, rtol=1e-5, atol=1e-4, equal_nan=True)
@@ -0,0 +1,120 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Point extraction in 2a: the worker pool, its weight cache and the batched mode."""
+
+import os
+
+import numpy
+import pytest
+
+from noaatools import geotiff, points
+from noaatools.grid import Grid
+
+
+GEOTRANSFORM = (0.0, 1.875, 90.0, 1.875)
+
+# Inside (the fourth on a NoData cell), off the raster and a null shape.
+X = numpy.array([0.5, 7.3, 14.9, 3.0, 100.0, numpy.nan])
+Y = numpy.array([89.0, 85.1, 79.0, 87.0, 80.0, numpy.nan])
+
+
+@pytest.fixture
+def tiffiles(tmp_path):
+
+    folder = tmp_path / 'prate.1900'
+    folder.mkdir()
+    random = numpy.random.RandomState(7)
+    tiffiles = []
+    for day in range(1, 6):
+        band = random.rand(6, 8).astype(numpy.float32)
+        band[1, 1] = -9999
+        tiffiles.append(geotiff.write_geotiff(str(folder / 'prate_1900_1_{}.tif'.format(day)), band,
+                                              GEOTRANSFORM, nodata=-9999))
+
+    return tiffiles
+
+
+def get_expected(tiffile, interpolate):
+    '''Each point on its own with Grid.locate_points, NaN off the raster.'''
+
+    raster = geotiff.GeoTiff(tiffile)
+    band = points.read_band(raster)
+    grid = Grid.from_geotransform(raster.geotransform, band.shape)
+    outside = points.get_outside(raster.geotransform, band.shape, X, Y)
+
+    values = []
+    for x, y, off in zip(X, Y, outside):
+        weights = grid.locate_points([x], [y], interpolate)
+        values.append(numpy.nan if off else weights.apply(band[None])[0, 0])
+
+    return numpy.array(values, dtype=numpy.float32)
+
+
+def test_rasterdate():
+
+    assert points.get_rasterdate('output/prate.1900/prate_1900_1_31.tif') == numpy.datetime64('1900-01-31')
+    assert points.get_rasterdate('pt_points.csv') is None
+
+
+def test_worker_weight_cache(tiffiles):
+
+    points.init_worker(X, Y)
+    first = points.get_weights(geotiff.GeoTiff(tiffiles[0]))
+    assert points.get_weights(geotiff.GeoTiff(tiffiles[1])) is first
+
+    # Another grid gets its own weights.
+    other = geotiff.write_geotiff(os.path.join(os.path.dirname(tiffiles[0]), 'prate_1900_2_1.tif'),
+                                  numpy.zeros((3, 4), dtype=numpy.float32), (0.0, 3.75, 90.0, 3.75))
+    assert points.get_weights(geotiff.GeoTiff(other)) is not first
+    assert len(points._worker['weights']) == 2
+
+    # Only the cells under the points on the raster are sampled.
+    weights, cells = first
+    assert len(cells) == 4 and weights.nfeatures == len(X)
+
+
+@pytest.mark.parametrize('processes', [0, 2])
+def test_extract_rasters_on_the_pool(tiffiles, processes):
+
+    broken = os.path.join(os.path.dirname(tiffiles[0]), 'prate_1900_1_9.tif')
+    with open(broken, 'wb') as f:
+        f.write(b'not a tiff')
+
+    results = list(points.extract_rasters(tiffiles + [broken], X, Y, processes=processes, batchsize=2))
+
+    assert [result[0] for result in results] == tiffiles + [broken]
+    for tiffile, date, values, error in results[:-1]:
+        assert error is None and date == points.get_rasterdate(tiffile)
+        assert numpy.array_equal(values, get_expected(tiffile, False), equal_nan=True)
+        assert numpy.isnan(values[[3, 4, 5]]).all()
+    assert results[-1][2] is None and 'not a TIFF' in results[-1][3]
+
+
+@pytest.mark.parametrize('interpolate', [False, True])
+def test_batched_blocks_match_each_point(tiffiles, interpolate):
+
+    expected = numpy.array([get_expected(tiffile, interpolate) for tiffile in tiffiles])
+
+    # Blocks of 2 days leave a short last block.
+    blocks = list(points.extract_blocks(tiffiles, X, Y, interpolate, processes=0, blocksize=2))
+    assert [len(blockfiles) for blockfiles, _, _, _ in blocks] == [2, 2, 1]
+
+    dates = numpy.concatenate([blockdates for _, blockdates, _, _ in blocks])
+    values = numpy.concatenate([blockvalues for _, _, blockvalues, _ in blocks])
+    assert dates.tolist() == [points.get_rasterdate(tiffile) for tiffile in tiffiles]
+    assert values.shape == (5, len(X))
+    assert numpy.allclose(values, expected, rtol=1e-6, equal_nan=True)
+    assert all(not errors for _, _, _, errors in blocks)
+
+
+def test_block_with_an_unreadable_raster(tiffiles):
+
+    broken = os.path.join(os.path.dirname(tiffiles[0]), 'prate_1900_1_9.tif')
+    with open(broken, 'wb') as f:
+        f.write(b'not a tiff')
+
+    (blockfiles, dates, values, errors), = points.extract_blocks(tiffiles[:2] + [broken], X, Y, blocksize=3)
+
+    assert [tiffile for tiffile, _ in errors] == [broken]
+    assert numpy.isnan(values[2]).all()
+    assert numpy.array_equal(values[1], get_expected(tiffiles[1], False), equal_nan=True)
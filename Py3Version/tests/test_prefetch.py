@@ -0,0 +1,65 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Background prefetch: order, errors and the memory cap."""
+
+import time
+
+import numpy
+import pytest
+
+from noaatools import prefetch
+
+
+def test_order_and_errors():
+
+    def loader(item):
+        if item == 2:
+            raise IOError("prate.1902.nc is truncated")
+        return numpy.zeros(item)
+
+    seen = []
+    with pytest.raises(IOError):
+        for item, result in prefetch.Prefetcher(loader, range(5), depth=2):
+            seen.append((item, len(result)))
+
+    # The items before the bad one are still processed, in order.
+    assert seen == [(0, 0), (1, 1)]
+    assert [item for item, _ in prefetch.Prefetcher(lambda item: item, range(4), depth=0)] == [0, 1, 2, 3]
+
+
+def test_base_exception_reaches_the_consumer():
+
+    def loader(item):
+        if item == 1:
+            raise SystemExit(3)
+        return item
+
+    # Without the error handed over, the second item would be waited on forever.
+    with pytest.raises(SystemExit):
+        for _ in prefetch.Prefetcher(loader, range(3), depth=2):
+            pass
+
+
+def test_maxbytes_counts_the_sizer(tmp_path):
+
+    paths = []
+    for year in range(5):
+        path = tmp_path / 'prate.{}.nc'.format(1900 + year)
+        path.write_bytes(bytes(1000))
+        paths.append(str(path))
+    assert prefetch.get_filebytes(paths[:2]) == 2000 and prefetch.get_filebytes(None) == 0
+
+    loaded = []
+
+    def warm(path):
+        loaded.append(path)
+        prefetch.warm_file(path)
+        return path
+
+    for index, (path, _) in enumerate(prefetch.Prefetcher(warm, paths, depth=4, maxbytes=1000,
+                                                          sizer=prefetch.get_filebytes)):
+        time.sleep(0.05)
+        # One warmed file of 1000 bytes fills the cap, so the loader stays one ahead.
+        assert len(loaded) <= index + 2
+
+    assert loaded == paths
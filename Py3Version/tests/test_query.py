@@ -0,0 +1,76 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Date-window series and aggregates read from long stores by offset arithmetic."""
+
+import numpy
+import pytest
+
+from noaatools import longstore, query
+from noaatools.points import NODATA
+
+
+FEATUREIDS = ['FR101', 'FR102', 'FR103']
+
+
+def get_days(start, ndays):
+
+    return numpy.datetime64(start, 'D') + numpy.arange(ndays)
+
+
+def get_values(dates, factor=1.0):
+    '''Values that tell day and feature apart: day number + feature / 10.'''
+
+    days = (dates - numpy.datetime64('1900-01-01', 'D')).astype(numpy.float32)
+
+    return factor * (days[:, None] + numpy.arange(len(FEATUREIDS), dtype=numpy.float32) / 10)
+
+
+@pytest.fixture
+def store(tmp_path):
+
+    store = longstore.create_store(str(tmp_path / 'prate_pt.lts'), FEATUREIDS, 'NUTS_ID')
+    for year in (1900, 1901):
+        dates = get_days('{}-01-01'.format(year), 365)
+        store.append(dates, get_values(dates))
+
+    return store
+
+
+def test_series_window_and_aggregates(store):
+
+    seriesquery = query.SeriesQuery(store)
+
+    # A window across the two segments, found by offset arithmetic.
+    dates, values = seriesquery.get_series(['FR103', 'FR101'], '1900-12-30', '1901-01-02')
+    assert dates.tolist() == get_days('1900-12-30', 4).tolist()
+    assert numpy.array_equal(values, get_values(dates)[:, [2, 0]])
+
+    dates, values = seriesquery.get_series('FR101', '1899-01-01', '1900-01-03')
+    assert values.tolist() == [0.0, 1.0, 2.0]
+
+    means = seriesquery.get_series(FEATUREIDS, '1900-01-01', '1900-01-05', agg='mean')
+    assert means.tolist() == pytest.approx([2.0, 2.1, 2.2])
+    assert seriesquery.get_series('FR101', '1901-01-01', None, agg='count') == 365
+    assert numpy.isnan(seriesquery.get_series('FR101', '1950-01-01', '1950-12-31', agg='mean'))
+
+    with pytest.raises(KeyError):
+        seriesquery.get_series('FR999')
+
+
+def test_series_on_non_consecutive_days(tmp_path):
+
+    store = longstore.create_store(str(tmp_path / 'tmax_pg.lts'), FEATUREIDS)
+    dates = numpy.array(['1900-01-01', '1900-01-03', '1900-01-10'], dtype='datetime64[D]')
+    values = get_values(dates)
+    values[1, 0] = NODATA
+    store.append(dates, values)
+
+    assert not store.segments[0]['consecutive']
+
+    seriesquery = query.SeriesQuery(store.path)
+    window, values = seriesquery.get_series(['FR101', 'FR102'], '1900-01-02', '1900-01-09')
+    assert window.tolist() == [numpy.datetime64('1900-01-03', 'D')]
+
+    # NoData is NaN in the answers and left out of aggregates.
+    assert numpy.isnan(values[0, 0]) and values[0, 1] == pytest.approx(2.1)
+    assert seriesquery.get_series('FR101', agg='mean') == pytest.approx(4.5)
@@ -0,0 +1,62 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""The scanline rasterizer on a grid of whole-degree cells."""
+
+import numpy
+import pytest
+
+from noaatools import rasterize, shapes
+from noaatools.grid import Grid
+from shapefiles import POLYGONS, write_shapefile
+
+
+# Cell centres 0.5 .. 3.5 both ways, so cell edges are whole degrees.
+GRID = Grid([1.5, 0.5, -0.5, -1.5], [0.5, 1.5, 2.5, 3.5])
+
+
+@pytest.fixture
+def polygonfile(tmp_path):
+
+    return write_shapefile(str(tmp_path / 'zones.shp'), 5, POLYGONS)
+
+
+def test_rasterize_labels(polygonfile):
+
+    labels = rasterize.rasterize_labels(shapes.read_polygons(polygonfile), GRID, supersample=2)
+
+    expected = numpy.full((8, 8), -1)
+    expected[2:6, 2:6] = 0
+    expected[0:4, 0:4] = 1
+    expected[2, 1] = -1                 # the hole, one sub-cell at this resolution
+    expected[2:4, 2:4] = 1              # overlap: the higher index wins
+    expected[6:8, 6] = 3
+
+    assert labels.tolist() == expected.tolist()
+
+
+def test_zoneweights_known_answer(polygonfile):
+
+    weights = rasterize.get_zoneweights(shapes.read_polygons(polygonfile), GRID, supersample=4)
+
+    def get_row(feature):
+        row = slice(weights.indptr[feature], weights.indptr[feature + 1])
+        return dict(zip(weights.cells[row].tolist(), weights.weights[row].tolist()))
+
+    assert weights.nfeatures == 4
+    assert get_row(0) == {5: 1.0, 6: 1.0, 9: 1.0, 10: 1.0}
+    assert get_row(1) == {0: 1.0, 1: 1.0, 4: 0.75, 5: 1.0}
+    assert get_row(2) == {}
+    assert get_row(3) == {15: 0.5}
+
+    # Zonal means of one day; the null shape has no cells.
+    values = numpy.arange(16, dtype=numpy.float32).reshape(1, 4, 4)
+    means = weights.apply(values)[0]
+    assert means[0] == (5 + 6 + 9 + 10) / 4.0
+    assert means[1] == pytest.approx((0 + 1 + 0.75 * 4 + 5) / 3.75)
+    assert numpy.isnan(means[2])
+    assert means[3] == 15
+
+    # Features grouped into zones, as 2c does with the split field.
+    zoneweights = rasterize.get_zoneweights(polygonfile, GRID, 4, zones=[0, 0, -1, 1], nzones=2)
+    assert zoneweights.nfeatures == 2
+    assert zoneweights.apply(values)[0, 1] == 15
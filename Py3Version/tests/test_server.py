@@ -0,0 +1,120 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""The query server run in a thread: points, polygons, store series and the response cache."""
+
+import http.client
+import json
+import os
+import threading
+
+import numpy
+import pytest
+
+from noaatools import longstore, server
+from noaatools.loadtest import request
+from shapefiles import get_square, write_shapefile
+
+netCDF4 = pytest.importorskip('netCDF4')
+
+
+NDAYS = 10
+
+
+def write_yearfile(path, year):
+    '''Whole-degree cells (centres 0.5 .. 3.5), value day * 100 + row * 10 + column.'''
+
+    dataset = netCDF4.Dataset(path, 'w')
+    try:
+        dataset.createDimension('time', NDAYS)
+        dataset.createDimension('lat', 4)
+        dataset.createDimension('lon', 4)
+        time = dataset.createVariable('time', 'f8', ('time',))
+        time.units = 'days since {}-01-01'.format(year)
+        time[:] = numpy.arange(NDAYS)
+        dataset.createVariable('lat', 'f4', ('lat',))[:] = [1.5, 0.5, -0.5, -1.5]
+        dataset.createVariable('lon', 'f4', ('lon',))[:] = [0.5, 1.5, 2.5, 3.5]
+        dataset.createVariable('prate', 'f4', ('time', 'lat', 'lon'))[:] = \
+            numpy.arange(NDAYS)[:, None, None] * 100 + numpy.arange(4)[:, None] * 10 + numpy.arange(4)
+    finally:
+        dataset.close()
+
+
+@pytest.fixture
+def running(tmp_path):
+
+    inputpath, storepath = tmp_path / 'noaa', tmp_path / 'output'
+    inputpath.mkdir()
+    for year in (1900, 1901):
+        write_yearfile(str(inputpath / 'prate.{}.nc'.format(year)), year)
+
+    store = longstore.create_store(str(storepath / 'prate_pt.lts'), ['p1', 'p2'])
+    dates = numpy.datetime64('1900-01-01') + numpy.arange(5)
+    store.append(dates, numpy.array([[day, 10.0 + day] for day in range(5)]))
+
+    service = server.QueryService(str(inputpath), str(storepath))
+    queryserver = server.make_server(service, port=0, quiet=True)
+    thread = threading.Thread(target=queryserver.serve_forever)
+    thread.start()
+    connection = http.client.HTTPConnection(*queryserver.server_address[:2], timeout=10)
+
+    def get(path):
+        status, body = request(connection, path)
+        return status, json.loads(body.decode('utf-8'))
+
+    yield get, service, tmp_path
+
+    connection.close()
+    queryserver.shutdown()
+    queryserver.server_close()
+    thread.join()
+
+
+def test_point_across_years(running):
+
+    get, _, _ = running
+
+    status, result = get('/point?variable=prate&lat=0.5&lon=1.5&start=1900-01-09&end=1901-01-02')
+    assert status == 200
+    assert result['dates'] == ['1900-01-09', '1900-01-10', '1901-01-01', '1901-01-02']
+    assert result['values'] == [811, 911, 11, 111]
+
+    assert get('/point?variable=prate&lat=0.5&lon=1.5')[0] == 400
+    assert get('/nowhere')[0] == 404
+
+
+def test_polygon_from_coordinates_and_shapefile(running):
+
+    get, service, tmp_path = running
+
+    status, result = get('/polygon?variable=prate&coords=1,0,1,1,3,1,3,0,1,0&start=1900-01-01&end=1900-01-03')
+    assert status == 200 and result['values'] == [[11.5, 111.5, 211.5]]
+
+    shpfile = write_shapefile(str(tmp_path / 'zones.shp'), 5, [[get_square(0, -2, 1, 0)]])
+    assert get('/polygon?variable=prate&shp={}&start=1900-01-01&end=1900-01-02'.format(shpfile))[1]['values'] \
+        == [[25, 125]]
+
+    # The same shapefile replaced on disk is rasterized again.
+    write_shapefile(shpfile, 5, [[get_square(3, -2, 4, -1)]])
+    mtime = os.path.getmtime(shpfile) + 10
+    os.utime(shpfile, (mtime, mtime))
+    assert get('/polygon?variable=prate&shp={}&start=1900-01-03&end=1900-01-03'.format(shpfile))[1]['values'] \
+        == [[233]]
+    assert len(service._zoneweights) == 3
+
+
+def test_series_and_cache(running):
+
+    get, _, _ = running
+    path = '/series?store=prate_pt&ids=p2,p1&start=1900-01-02&end=1900-01-03'
+
+    status, result = get(path)
+    assert status == 200
+    assert result == {'store': 'prate_pt', 'dates': ['1900-01-02', '1900-01-03'],
+                      'values': {'p2': [11, 12], 'p1': [1, 2]}}
+    assert get('/series?store=prate_pt&ids=p1,p2&agg=mean')[1]['values'] == {'p1': 2, 'p2': 12}
+    assert get('/series?store=nostore&ids=p1')[0] == 404
+
+    # The same request again is answered from the cache.
+    assert get(path)[1] == result
+    stats = get('/stats')[1]
+    assert stats['hits'] == 1 and stats['misses'] == 3 and stats['entries'] == 2
@@ -0,0 +1,50 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Shapefile geometry read straight from the .shp and .shx."""
+
+import os
+
+import numpy
+import pytest
+
+from noaatools import shapes
+from shapefiles import POLYGONS, get_square, write_shapefile
+
+
+@pytest.fixture
+def polygonfile(tmp_path):
+
+    return write_shapefile(str(tmp_path / 'zones.shp'), 5, POLYGONS)
+
+
+def test_read_points(tmp_path):
+
+    shpfile = write_shapefile(str(tmp_path / 'points.shp'), 1, [(10.5, -5.25), None, (0.0, 45.0)])
+    points = shapes.read_points(shpfile)
+
+    assert points.shape == (3, 2)
+    assert points[0].tolist() == [10.5, -5.25] and points[2].tolist() == [0.0, 45.0]
+    assert numpy.isnan(points[1]).all()
+    assert shapes.read_shpheader(shpfile) == (1, (0.0, -5.25, 10.5, 45.0))
+
+
+def test_read_polygons(polygonfile):
+
+    polygons = shapes.read_polygons(polygonfile)
+
+    assert polygons.nfeatures == 4 and polygons.nrings == 4
+    assert polygons.featureoffsets.tolist() == [0, 1, 3, 3, 4]
+    assert polygons.ringoffsets.tolist() == [0, 5, 10, 15, 20]
+    assert polygons.get_ringfeatures().tolist() == [0, 1, 1, 3]
+    assert polygons.bboxes[1].tolist() == [0.0, 0.0, 2.0, 2.0]
+    assert numpy.isnan(polygons.bboxes[2]).all()
+    assert polygons.get_feature(2) == []
+    assert polygons.get_feature(1)[1].tolist() == [list(point) for point in get_square(0.5, 0.5, 1, 1, False)]
+
+    # A shapefile without its .shx is read by walking the records.
+    offsets = shapes.read_recordoffsets(polygonfile)
+    os.remove(polygonfile[:-4] + '.shx')
+    assert shapes.read_recordoffsets(polygonfile).tolist() == offsets.tolist()
+
+    with pytest.raises(ValueError):
+        shapes.read_points(polygonfile)
@@ -0,0 +1,80 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Shard assignment, manifests and merge-shards over point and polygon outputs."""
+
+import csv
+import os
+
+import numpy
+import pytest
+
+from noaatools import pipeline, points, shard as sharding, tables, zones
+
+
+def read_rows(path):
+
+    with open(path) as f:
+        return list(csv.reader(f))
+
+
+def test_select_shard_covers_every_item_once():
+
+    years = ['prate.{}.nc'.format(year) for year in range(1900, 1911)]
+    weight = lambda name: sharding.get_yearweight(name.split('.')[1])
+    shards = [sharding.select_shard(reversed(years), (i, 3), weight=weight) for i in (1, 2, 3)]
+
+    assert sorted(sum(shards, [])) == years
+    # The assignment does not depend on the order of the items.
+    assert shards[0] == [name for name in reversed(years)
+                         if name in sharding.select_shard(years, (1, 3), weight=weight)]
+    assert sharding.select_shard(years, None) == years
+    assert sharding.pop_shardargument(['D:/noaa', '--shard', '2/3', '1900']) == (['D:/noaa', '1900'], (2, 3))
+    with pytest.raises(ValueError):
+        sharding.parse_shard('4/3')
+
+
+def test_merge_shards_of_points_and_polygons(tmp_path):
+
+    root = str(tmp_path)
+    os.makedirs(os.path.join(root, 'prate.1900'))
+    days = numpy.datetime64('1900-01-01') + numpy.arange(4)
+
+    # Daily CSVs of 2a and 2c, and a yearly table of the NetCDF mode.
+    ptfiles, pgfiles = [], []
+    for day, date in enumerate(days):
+        column = tables.get_datecolumn(date)
+        ptfiles.append(os.path.join(root, 'prate.1900', '1900_1_{}_pt.csv'.format(day + 1)))
+        points.write_pointcsv(ptfiles[-1], ['p1', 'p2'], column, numpy.array([day, 10.0 + day]), 'ID')
+        pgfiles.append(os.path.join(root, 'prate_1900_1_{}_pg.csv'.format(day + 1)))
+        zones.write_zonecsv(pgfiles[-1], ['DE', 'FR'], ['DE1', 'FR1'], column, numpy.array([day, 0.5]),
+                            'CNTR', 'NUTS_ID')
+    yearlyfile = os.path.join(root, 'air.2m.1900', 'air_1900_pt_yearly.csv')
+    os.makedirs(os.path.dirname(yearlyfile))
+    tables.write_widetable(yearlyfile, ['p1', 'p2'], days[:2], numpy.array([[1.0, 2.0], [3.0, 4.0]]), 'ID')
+
+    for i, tasks in enumerate([range(0, 2), range(2, 4)]):
+        names = ['day{}'.format(day) for day in tasks]
+        sharding.write_manifest(root, (i + 1, 2), names, [ptfiles[day] for day in tasks], 'pt_prate')
+        sharding.write_manifest(root, (i + 1, 2), names, [pgfiles[day] for day in tasks], 'pg_prate')
+
+    # A step with a shard missing stops the merge.
+    sharding.write_manifest(root, (1, 2), ['air.1900'], [yearlyfile], 'pt_air')
+    with pytest.raises(IOError):
+        pipeline.merge_shards(root, 2)
+    sharding.write_manifest(root, (2, 2), [], [], 'pt_air')
+    assert sharding.get_manifestnames(root, 2) == ['pg_prate', 'pt_air', 'pt_prate']
+
+    mergedfiles = pipeline.merge_shards(root, 2)
+    assert [os.path.basename(path) for path in mergedfiles] == ['air_pt_merged.csv', 'prate_pg_merged.csv',
+                                                               'prate_pt_merged.csv']
+
+    assert read_rows(mergedfiles[1]) == [['CNTR_NUTS_ID', 'd900_1_1', 'd900_1_2', 'd900_1_3', 'd900_1_4'],
+                                         ['DE_DE1', '0', '1', '2', '3'],
+                                         ['FR_FR1', '0.5', '0.5', '0.5', '0.5']]
+    assert read_rows(mergedfiles[2])[2] == ['p2', '10', '11', '12', '13']
+    assert read_rows(mergedfiles[0])[1] == ['p1', '1', '3']
+
+    # A task done by two shards is refused.
+    sharding.write_manifest(root, (2, 2), ['day0'], [ptfiles[0]], 'pt_prate')
+    with pytest.raises(ValueError):
+        pipeline.merge_shards(root, 2, ['pt_prate'])
@@ -0,0 +1,65 @@
+# !/usr/bin/python
+# -*- coding: utf-8 -*-
+"""Grouped zones of 2c against the zonal means of each split shapefile on its own."""
+
+import numpy
+import pytest
+
+from noaatools import dbf, geotiff, points, rasterize, zones
+from noaatools.grid import Grid
+from shapefiles import get_square, write_shapefile
+
+
+GEOTRANSFORM = (0.0, 1.0, 2.0, 1.0)
+
+# Two features share DE1; FR1 overlaps DE; DE1 also names a zone of FR.
+FEATURES = [('DE', 'DE1', get_square(0, 0, 2, 2)),
+            ('DE', 'DE1', get_square(2, 0, 3, 1)),
+            ('DE', 'DE2', get_square(0, -2, 2, 0)),
+            ('FR', 'FR1', get_square(1, -1, 3, 1)),
+            ('FR', 'DE1', get_square(3.5, -2, 4, 2))]
+
+
+@pytest.fixture
+def zonefiles(tmp_path):
+
+    shpfile = write_shapefile(str(tmp_path / 'nuts.shp'), 5, [[ring] for _, _, ring in FEATURES])
+    dbf.write_dbf(str(tmp_path / 'nuts.dbf'), [dbf.DbfField('CNTR', 'C', 2), dbf.DbfField('NUTS_ID', 'C', 5)],
+                  [[group for group, _, _ in FEATURES], [zone for _, zone, _ in FEATURES]])
+
+    band = numpy.arange(16, dtype=numpy.float32).reshape(4, 4)
+    band[0, 1] = -9999
+    tiffile = geotiff.write_geotiff(str(tmp_path / 'prate_1900_1_1.tif'), band, GEOTRANSFORM, nodata=-9999)
+
+    return shpfile, tiffile
+
+
+def test_grouped_means_match_each_group(zonefiles):
+
+    shpfile, tiffile = zonefiles
+    grouped = zones.GroupedZones(shpfile, 'NUTS_ID', 'CNTR', supersample=4)
+    means = grouped.extract(tiffile)
+
+    assert grouped.groups.tolist() == ['DE', 'FR']
+    assert list(zip(grouped.zonegroups.tolist(), grouped.zonevalues.tolist())) == \
+        [('DE', 'DE1'), ('DE', 'DE2'), ('FR', 'DE1'), ('FR', 'FR1')]
+
+    # What SplitByAttributes and one ZonalStatisticsAsTable per split file give.
+    raster = geotiff.GeoTiff(tiffile)
+    band = points.read_band(raster)
+    grid = Grid.from_geotransform(raster.geotransform, band.shape)
+    expected = {}
+    for group in ('DE', 'FR'):
+        zonevalues = sorted(set(zone for name, zone, _ in FEATURES if name == group))
+        featurezones = [zonevalues.index(zone) if name == group else -1 for name, zone, _ in FEATURES]
+        weights = rasterize.get_zoneweights(shpfile, grid, 4, featurezones, len(zonevalues))
+        expected.update(((group, zone), value) for zone, value in zip(zonevalues, weights.apply(band[None])[0]))
+
+    for group, zone, value in zip(grouped.zonegroups, grouped.zonevalues, means):
+        assert value == pytest.approx(expected[group, zone], rel=1e-6)
+
+    # The NoData cell is left out of DE1.
+    assert expected['DE', 'DE1'] == pytest.approx((0 + 4 + 5 + 6) / 4.0)
+
+    # Weights are built once per grid.
+    assert grouped.get_weights(raster) is grouped.get_weights(geotiff.GeoTiff(tiffile))